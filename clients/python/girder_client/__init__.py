@@ -10,9 +10,11 @@ except DistributionNotFound:
 __license__ = 'Apache 2.0'
 
 import diskcache
+import collections
 import errno
 import getpass
 import glob
+import hashlib
 import json
 import logging
 import mimetypes
@@ -22,11 +24,15 @@ import requests
 import shutil
 import six
 import tempfile
+import threading
+import time
 
 from contextlib import contextmanager
 
 DEFAULT_PAGE_LIMIT = 20000  # Number of results to fetch per request
 REQ_BUFFER_SIZE = 65536  # Chunk size when iterating a download body
+PARTIAL_DOWNLOAD_SUFFIX = '.part'  # Suffix of files being downloaded concurrently
+PARTIAL_VERSION_SUFFIX = '.version'  # Suffix of the file version of a .part file
 
 _safeNameRegex = re.compile(r'^[/\\]+')
 
@@ -112,6 +118,101 @@ class _ProgressBytesIO(six.BytesIO):
         return _chunk
 
 
+class _TransferProgress(object):
+    """
+    Thread-safe tally of a concurrent download or upload, reported through one
+    progress reporter whose label shows file counts, retries and throughput.
+
+    :param reporter: The progress reporter.
+    :param verb: The statistics key of the number of files transferred, e.g.
+        'downloaded'.
+    """
+
+    def __init__(self, reporter, verb):
+        self.reporter = reporter
+        self.verb = verb
+        self.files = 0
+        self.transferred = 0
+        self.skipped = 0
+        self.failed = 0
+        self.retries = 0
+        self.bytes = 0
+        self.start = time.time()
+        self._lock = threading.Lock()
+
+    def addFile(self, size):
+        with self._lock:
+            self.files += 1
+            if hasattr(self.reporter, 'length'):
+                self.reporter.length += size
+            self._relabel()
+
+    def update(self, chunkSize):
+        with self._lock:
+            self.bytes += chunkSize
+            self.reporter.update(chunkSize)
+
+    def fileDone(self, transferred, size):
+        with self._lock:
+            if transferred:
+                self.transferred += 1
+            else:
+                self.skipped += 1
+                # count skipped files as done, so the bar can finish
+                self.reporter.update(size)
+            self._relabel()
+
+    def fileFailed(self):
+        with self._lock:
+            self.failed += 1
+            self._relabel()
+
+    def retry(self):
+        with self._lock:
+            self.retries += 1
+            self._relabel()
+
+    def stats(self):
+        """
+        :returns: dict of file counts, retries, bytes transferred, elapsed
+            seconds and throughput in bytes per second
+        """
+        with self._lock:
+            elapsed = time.time() - self.start
+            return {
+                'files': self.files,
+                self.verb: self.transferred,
+                'skipped': self.skipped,
+                'failed': self.failed,
+                'retries': self.retries,
+                'bytes': self.bytes,
+                'seconds': elapsed,
+                'bytesPerSecond': self.bytes / elapsed if elapsed else 0.0
+            }
+
+    def _relabel(self):
+        # Must hold the lock
+        elapsed = time.time() - self.start
+        label = '%d/%d files' % (self.transferred + self.skipped, self.files)
+        if self.skipped:
+            label += ', %d skipped' % self.skipped
+        if self.failed:
+            label += ', %d failed' % self.failed
+        if self.retries:
+            label += ', %d retries' % self.retries
+        if elapsed:
+            label += ', %.2f MB/s' % (self.bytes / elapsed / 1024 ** 2)
+        self.reporter.label = label
+
+
+def _fileSha512(path):
+    checksum = hashlib.sha512()
+    with open(path, 'rb') as fh:
+        for chunk in iter(lambda: fh.read(REQ_BUFFER_SIZE), b''):
+            checksum.update(chunk)
+    return checksum.hexdigest()
+
+
 class GirderClient(object):
     """
     A class for interacting with the Girder RESTful API.
@@ -236,6 +337,12 @@ class GirderClient(object):
 
         self.progressReporterCls = progressReporterCls
         self._session = None
+        # Sessions of threads downloading concurrently; see _useThreadSession
+        self._threadLocal = threading.local()
+        # Folders and items created or found by uploadConcurrently, by kind,
+        # local path and parent ID
+        self._uploadedPaths = {}
+        self._uploadedPathsLock = threading.Lock()
 
     @contextmanager
     def session(self, session=None):
@@ -406,11 +513,41 @@ class GirderClient(object):
         return self._serverApiDescription
 
     def _requestFunc(self, method):
-        if self._session is not None:
-            return getattr(self._session, method.lower())
+        session = getattr(self._threadLocal, 'session', None) or self._session
+        if session is not None:
+            return getattr(session, method.lower())
         else:
             return getattr(requests, method.lower())
 
+    def _configureSession(self, session):
+        """
+        Configure a :class:`requests.Session` created for a download thread.
+        Subclasses that configure the sessions they send requests with should
+        do the same here.
+
+        :param session: The new session.
+        """
+        if self._session is not None:
+            session.headers.update(self._session.headers)
+            session.auth = self._session.auth
+            session.cert = self._session.cert
+            session.proxies = self._session.proxies
+            session.verify = self._session.verify
+
+    def _useThreadSession(self, sessions):
+        """
+        Send the requests of the calling thread with its own session, since a
+        :class:`requests.Session` shouldn't be shared between threads.
+
+        :param sessions: A list that new sessions are added to, for the caller
+            to close.
+        """
+        if getattr(self._threadLocal, 'session', None) is None:
+            session = requests.Session()
+            self._configureSession(session)
+            self._threadLocal.session = session
+            sessions.append(session)
+
     def sendRestRequest(self, method, path, parameters=None,
                         data=None, files=None, json=None, headers=None, jsonResp=True,
                         **kwargs):
@@ -470,7 +607,8 @@ class GirderClient(object):
             **kwargs)
 
         # If success, return the json object. Otherwise throw an exception.
-        if result.status_code in (200, 201):
+        # A 206 answers a request with a Range header.
+        if result.status_code in (200, 201, 206):
             if jsonResp:
                 return result.json()
             else:
@@ -974,7 +1112,7 @@ class GirderClient(object):
             return self.uploadStreamToFolder(folderId, f, filename, filesize, reference, mimeType,
                                              progressCallback)
 
-    def _uploadContents(self, uploadObj, stream, size, progressCallback=None):
+    def _uploadContents(self, uploadObj, stream, size, progressCallback=None, reporter=None):
         """
         Uploads contents of a file.
 
@@ -990,37 +1128,43 @@ class GirderClient(object):
             with progress information. It passes a single positional argument
             to the callable which is a dict of information about progress.
         :type progressCallback: callable
+        :param reporter: The progress reporter to update, instead of a new one
+            for this file.
         """
+        if reporter is None:
+            with self.progressReporterCls(
+                    label=uploadObj.get('name', ''), length=size) as reporter:
+                return self._uploadContents(
+                    uploadObj, stream, size, progressCallback, reporter=reporter)
+
         offset = 0
         uploadId = uploadObj['_id']
 
-        with self.progressReporterCls(label=uploadObj.get('name', ''), length=size) as reporter:
-
-            while True:
-                chunk = stream.read(min(self.MAX_CHUNK_SIZE, (size - offset)))
+        while True:
+            chunk = stream.read(min(self.MAX_CHUNK_SIZE, (size - offset)))
 
-                if not chunk:
-                    break
+            if not chunk:
+                break
 
-                if isinstance(chunk, six.text_type):
-                    chunk = chunk.encode('utf8')
+            if isinstance(chunk, six.text_type):
+                chunk = chunk.encode('utf8')
 
-                uploadObj = self.post(
-                    'file/chunk?offset=%d&uploadId=%s' % (offset, uploadId),
-                    data=_ProgressBytesIO(chunk, reporter=reporter))
+            uploadObj = self.post(
+                'file/chunk?offset=%d&uploadId=%s' % (offset, uploadId),
+                data=_ProgressBytesIO(chunk, reporter=reporter))
 
-                if '_id' not in uploadObj:
-                    raise Exception(
-                        'After uploading a file chunk, did not receive object with _id. '
-                        'Got instead: ' + json.dumps(uploadObj))
+            if '_id' not in uploadObj:
+                raise Exception(
+                    'After uploading a file chunk, did not receive object with _id. '
+                    'Got instead: ' + json.dumps(uploadObj))
 
-                offset += len(chunk)
+            offset += len(chunk)
 
-                if callable(progressCallback):
-                    progressCallback({
-                        'current': offset,
-                        'total': size
-                    })
+            if callable(progressCallback):
+                progressCallback({
+                    'current': offset,
+                    'total': size
+                })
 
         if offset != size:
             self.delete('file/upload/' + uploadId)
@@ -1279,7 +1423,7 @@ class GirderClient(object):
             if len(files) < DEFAULT_PAGE_LIMIT:
                 break
 
-    def downloadFolderRecursive(self, folderId, dest, sync=False):
+    def downloadFolderRecursive(self, folderId, dest, sync=False, workers=None, retries=3):
         """
         Download a folder recursively from Girder into a local directory.
 
@@ -1290,7 +1434,20 @@ class GirderClient(object):
         :param sync: If True, check if item exists in local metadata
             cache and skip download provided that metadata is identical.
         :type sync: bool
-        """
+        :param workers: If set, download this many files at a time while
+            listing the folder tree, resuming interrupted files and skipping
+            files whose local copy matches their checksum. See
+            :py:meth:`downloadConcurrently`.
+        :type workers: int
+        :param retries: With `workers`, the number of times to resume a file
+            after a transfer error.
+        :type retries: int
+        :returns: With `workers`, the download statistics.
+        """
+        if workers:
+            return self.downloadConcurrently(
+                folderId, dest, 'folder', sync=sync, workers=workers, retries=retries)
+
         offset = 0
         folderId = self._checkResourcePath(folderId)
         while True:
@@ -1331,7 +1488,8 @@ class GirderClient(object):
             if len(items) < DEFAULT_PAGE_LIMIT:
                 break
 
-    def downloadResource(self, resourceId, dest, resourceType='folder', sync=False):
+    def downloadResource(self, resourceId, dest, resourceType='folder', sync=False,
+                         workers=None, retries=3):
         """
         Download a collection, user, or folder recursively from Girder into a local directory.
 
@@ -1346,7 +1504,18 @@ class GirderClient(object):
         :param sync: If True, check if items exist in local metadata
             cache and skip download if the metadata is identical.
         :type sync: bool
-        """
+        :param workers: If set, download this many files at a time. See
+            :py:meth:`downloadConcurrently`.
+        :type workers: int
+        :param retries: With `workers`, the number of times to resume a file
+            after a transfer error.
+        :type retries: int
+        :returns: With `workers`, the download statistics.
+        """
+        if workers and resourceType in ('folder', 'collection', 'user'):
+            return self.downloadConcurrently(
+                resourceId, dest, resourceType, sync=sync, workers=workers, retries=retries)
+
         if resourceType == 'folder':
             self.downloadFolderRecursive(resourceId, dest, sync)
         elif resourceType in ('collection', 'user'):
@@ -1372,6 +1541,208 @@ class GirderClient(object):
         else:
             raise Exception('Invalid resource type: %s' % resourceType)
 
+    def downloadConcurrently(self, resourceId, dest, resourceType='folder', sync=False,
+                             workers=4, retries=3):
+        """
+        Download a collection, user, or folder recursively from Girder into a
+        local directory, transferring up to `workers` files at a time while the
+        folder tree is still being listed. The local layout is the same as
+        :py:meth:`downloadResource`.
+
+        Each file is written to a ``.part`` file next to its destination and
+        renamed once complete. After a transfer error, or when a previous
+        download was interrupted, the ``.part`` file is resumed with an HTTP
+        range request. Files whose local copy has the size and SHA-512 checksum
+        that the server reports (the checksum is exposed by the hashsum_download
+        plugin) are not downloaded again; with `sync`, items whose metadata is
+        unchanged since the last download are skipped without checking.
+
+        Progress is reported through one progress reporter, whose label shows
+        file counts, retries and throughput.
+
+        :param resourceId: ID or path of the resource to download.
+        :type resourceId: ObjectId or Unix-style path to the resource in Girder.
+        :param dest: The local download destination.
+        :type dest: str
+        :param resourceType: The type of resource being downloaded: 'collection', 'user',
+            or 'folder'.
+        :type resourceType: str
+        :param sync: If True, skip items whose metadata is identical in the local
+            metadata cache.
+        :type sync: bool
+        :param workers: The number of files to download at a time.
+        :type workers: int
+        :param retries: The number of times to resume a file after a transfer error.
+        :type retries: int
+        :returns: A dict of statistics: the number of files found, downloaded,
+            skipped and failed, the number of retries, the bytes transferred,
+            the elapsed seconds and the throughput in bytes per second.
+        """
+        from concurrent.futures import ThreadPoolExecutor
+
+        if resourceType not in ('folder', 'collection', 'user'):
+            raise Exception('Invalid resource type: %s' % resourceType)
+        resourceId = self._checkResourcePath(resourceId)
+        workers = max(1, int(workers))
+        # Bound the files listed ahead of the transfers
+        slots = threading.BoundedSemaphore(workers * 4)
+        sessions = []
+        errors = []
+
+        def transfer(file, path):
+            try:
+                self._useThreadSession(sessions)
+                downloaded = self._downloadFileResumable(file, path, progress, retries)
+                progress.fileDone(downloaded, file['size'])
+            except Exception as e:
+                _logger.error('Could not download file %s to %s: %s' % (file['_id'], path, e))
+                progress.fileFailed()
+                errors.append(e)
+            finally:
+                slots.release()
+
+        with self.progressReporterCls(label='Downloading', length=0) as reporter:
+            progress = _TransferProgress(reporter, 'downloaded')
+            self._useThreadSession(sessions)
+            try:
+                with ThreadPoolExecutor(max_workers=workers) as pool:
+                    for file, path in self._iterDownloadFiles(
+                            resourceId, dest, resourceType, sync):
+                        progress.addFile(file['size'])
+                        slots.acquire()
+                        pool.submit(transfer, file, path)
+            finally:
+                self._threadLocal.session = None
+                for session in sessions:
+                    session.close()
+
+        if errors:
+            raise errors[0]
+        return progress.stats()
+
+    def _iterDownloadFiles(self, parentId, dest, parentType, sync):
+        """
+        List the files under a resource breadth-first, creating their local
+        directories.
+
+        :returns: A generator of (file, local path) tuples.
+        """
+        parents = collections.deque([(parentType, parentId, dest)])
+        while parents:
+            parentType, parentId, dest = parents.popleft()
+            for folder in self.listFolder(parentId, parentFolderType=parentType):
+                local = os.path.join(dest, self.transformFilename(folder['name']))
+                _safeMakedirs(local)
+                parents.append(('folder', folder['_id'], local))
+
+            if parentType != 'folder':
+                continue
+            for item in self.listItem(parentId):
+                _id = item['_id']
+                self.incomingMetadata[_id] = item
+                if sync and _id in self.localMetadata and item == self.localMetadata[_id]:
+                    continue
+                files = list(self.listFile(_id))
+                # Same layout as downloadItem
+                if len(files) == 1 and files[0]['name'] == item['name']:
+                    yield files[0], os.path.join(dest, self.transformFilename(item['name']))
+                    continue
+                itemDest = os.path.join(dest, self.transformFilename(item['name']))
+                _safeMakedirs(itemDest)
+                for file in files:
+                    yield file, os.path.join(itemDest, self.transformFilename(file['name']))
+
+    def _downloadFileResumable(self, file, path, progress, retries=3):
+        """
+        Download a file through a ``.part`` file that is resumed with range
+        requests after transfer errors. A ``.part`` file is only resumed if it
+        was started for the same version of the file, as recorded next to it
+        in a ``.part.version`` file.
+
+        :param file: The file document.
+        :param path: The local path to write the file to.
+        :param progress: The _TransferProgress of the download.
+        :param retries: The number of times to resume after a transfer error.
+        :returns: False if the local copy was already current, otherwise True.
+        """
+        if file.get('sha512') and os.path.isfile(path) and \
+                os.path.getsize(path) == file['size'] and \
+                _fileSha512(path) == file['sha512']:
+            return False
+
+        cacheKey = '\n'.join([self.urlBase, file['_id'], file['created']])
+        if self.cache is not None:
+            fp = self.cache.get(cacheKey, read=True)
+            if fp:
+                with fp:
+                    self._copyFile(fp, path)
+                return True
+
+        partial = path + PARTIAL_DOWNLOAD_SUFFIX
+        partialVersion = partial + PARTIAL_VERSION_SUFFIX
+        version = '\n'.join([
+            file.get('updated') or file['created'], str(file['size']),
+            file.get('sha512') or ''])
+        if os.path.isfile(partial):
+            try:
+                with open(partialVersion) as fh:
+                    current = fh.read() == version
+            except (IOError, OSError):
+                current = False
+            if not current:
+                # Left from another version of the file; resuming it would mix
+                # their bytes
+                os.remove(partial)
+        with open(partialVersion, 'w') as fh:
+            fh.write(version)
+        attempt = 0
+        while True:
+            offset = os.path.getsize(partial) if os.path.isfile(partial) else 0
+            if offset > file['size']:
+                offset = 0
+            try:
+                if offset < file['size'] or not offset:
+                    headers = {'Range': 'bytes=%d-' % offset} if offset else None
+                    req = self.sendRestRequest(
+                        'get', 'file/%s/download' % file['_id'], headers=headers,
+                        stream=True, jsonResp=False)
+                    # A server that ignores the range sends the whole file
+                    mode = 'ab' if offset and req.status_code == 206 else 'wb'
+                    try:
+                        with open(partial, mode) as fh:
+                            for chunk in req.iter_content(chunk_size=REQ_BUFFER_SIZE):
+                                fh.write(chunk)
+                                progress.update(len(chunk))
+                    finally:
+                        req.close()
+                size = os.path.getsize(partial)
+                if size != file['size']:
+                    raise IncompleteResponseError(
+                        'File %s download' % file['_id'], file['size'], size)
+                if file.get('sha512') and _fileSha512(partial) != file['sha512']:
+                    # e.g. resumed from a part of an older version of the file
+                    os.remove(partial)
+                    raise requests.RequestException(
+                        'File %s download does not match its checksum' % file['_id'])
+                break
+            except requests.RequestException as e:
+                if isinstance(e, HttpError) and e.status < 500 and e.status != 429:
+                    raise
+                if attempt >= retries:
+                    raise
+                attempt += 1
+                progress.retry()
+                _logger.warning('Resuming download of file %s after error: %s' % (
+                    file['_id'], e))
+                time.sleep(min(2 ** attempt, 30))
+
+        if self.cache is not None:
+            with open(partial, 'rb') as fp:
+                self.cache.set(cacheKey, fp, read=True)
+        shutil.move(partial, path)
+        os.remove(partialVersion)
+        return True
+
     def saveLocalMetadata(self, dest):
         """
         Dumps item metadata collected during a folder download.
@@ -1636,7 +2007,7 @@ class GirderClient(object):
                     callback(folder, localFolder)
 
     def upload(self, filePattern, parentId, parentType='folder', leafFoldersAsItems=False,
-               reuseExisting=False, blacklist=None, dryRun=False, reference=None):
+               reuseExisting=False, blacklist=None, dryRun=False, reference=None, workers=None):
         """
         Upload a pattern of files.
 
@@ -1662,7 +2033,17 @@ class GirderClient(object):
         :type dryRun: bool
         :param reference: Option reference to send along with the upload.
         :type reference: str
+        :param workers: If set, upload this many files at a time. See
+            :py:meth:`uploadConcurrently`.
+        :type workers: int
+        :returns: With `workers`, the upload statistics.
         """
+        if workers and not dryRun:
+            return self.uploadConcurrently(
+                filePattern, parentId, parentType, leafFoldersAsItems=leafFoldersAsItems,
+                reuseExisting=reuseExisting, blacklist=blacklist, reference=reference,
+                workers=workers)
+
         filePatternList = filePattern if isinstance(filePattern, (list, tuple)) else [filePattern]
         blacklist = blacklist or []
         empty = True
@@ -1692,6 +2073,384 @@ class GirderClient(object):
         if empty:
             print('No matching files: ' + repr(filePattern))
 
+    def uploadConcurrently(self, filePattern, parentId, parentType='folder',
+                           leafFoldersAsItems=False, reuseExisting=False, blacklist=None,
+                           reference=None, workers=4, chunkWorkers=4, retries=3):
+        """
+        Upload a pattern of files like :py:meth:`upload`, transferring up to
+        `workers` files at a time while the local directories are still being
+        walked.
+
+        Folders and items are looked up or created once per local path and
+        parent, and remembered by this client, so uploading the same tree
+        again (e.g. after an interruption) doesn't look them up again. Files
+        that fit in one request are sent with the request that creates them.
+        When the server has an S3 assetstore, the parts of larger files are
+        sent straight to S3, up to `chunkWorkers` at a time, and each part is
+        retried up to `retries` times. Chunks sent through Girder must arrive
+        in order, so for other assetstores each file's chunks are sent one
+        after another.
+
+        Progress is reported through one progress reporter, whose label shows
+        file counts, retries and throughput. Item upload callbacks are called
+        from the upload threads. Folder upload callbacks, and the item
+        callbacks of leaf folders uploaded as items, are called once every
+        file has been uploaded.
+
+        :param filePattern: a glob pattern for files that will be uploaded,
+            recursively copying any file folder structures.  If this is a list
+            or tuple each item in it will be used in turn.
+        :type filePattern: str
+        :param parentId: Id of the parent in Girder or resource path.
+        :type parentId: ObjectId or Unix-style path to the resource in Girder.
+        :param parentType: one of (collection,folder,user), default of folder.
+        :type parentType: str
+        :param leafFoldersAsItems: bool whether leaf folders should have all
+            files uploaded as single items.
+        :type leafFoldersAsItems: bool
+        :param reuseExisting: bool whether to accept an existing item of
+            the same name in the same location, or create a new one instead.
+        :type reuseExisting: bool
+        :param reference: Option reference to send along with the upload.
+        :type reference: str
+        :param workers: The number of files to upload at a time.
+        :type workers: int
+        :param chunkWorkers: The number of S3 parts to upload at a time, across
+            all files.
+        :type chunkWorkers: int
+        :param retries: The number of times to retry an S3 request.
+        :type retries: int
+        :returns: A dict of statistics: the number of files found, uploaded,
+            skipped (already current in their item) and failed, the number of
+            retries, the bytes transferred, the elapsed seconds and the
+            throughput in bytes per second.
+        """
+        from concurrent.futures import ThreadPoolExecutor
+
+        filePatternList = filePattern if isinstance(filePattern, (list, tuple)) else [filePattern]
+        blacklist = blacklist or []
+        empty = True
+        parentId = self._checkResourcePath(parentId)
+        workers = max(1, int(workers))
+        chunkWorkers = max(1, int(chunkWorkers))
+        # Bound the files queued ahead of the transfers
+        slots = threading.BoundedSemaphore(workers * 4)
+        sessions = []
+        errors = []
+        callbacks = []
+
+        def transfer(localPath, name, target):
+            try:
+                self._useThreadSession(sessions)
+                item = None
+                if 'createItemIn' in target:
+                    item = self._loadOrCreateItemCached(
+                        localPath, name, target['createItemIn'], reuseExisting)
+                    target = {'itemId': item['_id']}
+                uploaded = self._uploadFileConcurrently(
+                    localPath, name, progress, partPool, sessions, reference=reference,
+                    chunkWorkers=chunkWorkers, retries=retries, **target)
+                progress.fileDone(uploaded, os.path.getsize(localPath))
+                if item is not None:
+                    for callback in self._itemUploadCallbacks:
+                        callback(item, localPath)
+            except Exception as e:
+                _logger.error('Could not upload %s: %s' % (localPath, e))
+                progress.fileFailed()
+                errors.append(e)
+            finally:
+                slots.release()
+
+        def submit(localPath, name, **target):
+            progress.addFile(os.path.getsize(localPath))
+            slots.acquire()
+            pool.submit(transfer, localPath, name, target)
+
+        with self.progressReporterCls(label='Uploading', length=0) as reporter:
+            progress = _TransferProgress(reporter, 'uploaded')
+            self._useThreadSession(sessions)
+            try:
+                # Fetch the cached server version before the threads need it
+                self.getServerVersion()
+                with ThreadPoolExecutor(max_workers=chunkWorkers) as partPool, \
+                        ThreadPoolExecutor(max_workers=workers) as pool:
+                    for pattern in filePatternList:
+                        for currentFile in glob.iglob(pattern):
+                            empty = False
+                            currentFile = os.path.normpath(currentFile)
+                            filename = os.path.basename(currentFile)
+                            if filename in blacklist:
+                                continue
+                            if os.path.isfile(currentFile):
+                                if parentType != 'folder':
+                                    raise Exception(
+                                        'Attempting to upload an item under a %s. Items can only '
+                                        'be added to folders.' % parentType)
+                                self._queueUploadFile(
+                                    currentFile, filename, parentId, reuseExisting, submit)
+                            else:
+                                self._queueUploadFolder(
+                                    currentFile, parentId, parentType, leafFoldersAsItems,
+                                    reuseExisting, blacklist, submit, callbacks)
+            finally:
+                self._threadLocal.session = None
+                for session in sessions:
+                    session.close()
+
+        if errors:
+            raise errors[0]
+        for uploadCallbacks, resource, localPath in callbacks:
+            for callback in uploadCallbacks:
+                callback(resource, localPath)
+        if empty:
+            print('No matching files: ' + repr(filePattern))
+        return progress.stats()
+
+    def _queueUploadFile(self, localPath, name, parentFolderId, reuseExisting, submit):
+        """
+        Queue a file to be uploaded as an item, like :py:meth:`_uploadAsItem`.
+        """
+        if reuseExisting or len(self._itemUploadCallbacks) or os.path.getsize(localPath) == 0:
+            submit(localPath, name, createItemIn=parentFolderId)
+        else:
+            submit(localPath, name, folderId=parentFolderId)
+
+    def _queueUploadFolder(self, localFolder, parentId, parentType, leafFoldersAsItems,
+                           reuseExisting, blacklist, submit, callbacks):
+        """
+        Create the folders and items of a local directory like
+        :py:meth:`_uploadFolderRecursive`, and queue its files to be uploaded.
+        """
+        name = os.path.basename(localFolder)
+        if leafFoldersAsItems and self._hasOnlyFiles(localFolder):
+            if parentType != 'folder':
+                raise Exception(
+                    ('Attempting to upload a folder as an item under a %s. '
+                     % parentType) + 'Items can only be added to folders.')
+            item = self._loadOrCreateItemCached(localFolder, name, parentId, reuseExisting)
+            for entry in sorted(os.listdir(localFolder)):
+                if entry not in blacklist:
+                    submit(os.path.join(localFolder, entry), entry, itemId=item['_id'])
+            callbacks.append((self._itemUploadCallbacks, item, localFolder))
+            return
+
+        if name in blacklist:
+            return
+        folder = self._loadOrCreateFolderCached(localFolder, parentId, parentType)
+        for entry in sorted(os.listdir(localFolder)):
+            if entry in blacklist:
+                continue
+            fullEntry = os.path.join(localFolder, entry)
+            if os.path.islink(fullEntry):
+                # os.walk skips symlinks by default
+                print('Skipping file %s as it is a symlink' % entry)
+            elif os.path.isdir(fullEntry):
+                self._queueUploadFolder(
+                    fullEntry, folder['_id'], 'folder', leafFoldersAsItems, reuseExisting,
+                    blacklist, submit, callbacks)
+            else:
+                self._queueUploadFile(fullEntry, entry, folder['_id'], reuseExisting, submit)
+        callbacks.append((self._folderUploadCallbacks, folder, localFolder))
+
+    def _loadOrCreateFolderCached(self, localFolder, parentId, parentType):
+        """
+        :py:meth:`loadOrCreateFolder`, remembered by local path and parent.
+        """
+        key = ('folder', os.path.abspath(localFolder), str(parentId))
+        with self._uploadedPathsLock:
+            folder = self._uploadedPaths.get(key)
+        if folder is None:
+            folder = self.loadOrCreateFolder(os.path.basename(localFolder), parentId, parentType)
+            with self._uploadedPathsLock:
+                self._uploadedPaths[key] = folder
+        return folder
+
+    def _loadOrCreateItemCached(self, localPath, name, parentFolderId, reuseExisting):
+        """
+        :py:meth:`loadOrCreateItem`, remembered by local path and parent when
+        reusing existing items.
+        """
+        if not reuseExisting:
+            return self.loadOrCreateItem(name, parentFolderId, reuseExisting)
+        key = ('item', os.path.abspath(localPath), str(parentFolderId))
+        with self._uploadedPathsLock:
+            item = self._uploadedPaths.get(key)
+        if item is None:
+            item = self.loadOrCreateItem(name, parentFolderId, reuseExisting)
+            with self._uploadedPathsLock:
+                self._uploadedPaths[key] = item
+        return item
+
+    def _uploadFileConcurrently(self, localPath, name, progress, partPool, sessions,
+                                folderId=None, itemId=None, reference=None, chunkWorkers=4,
+                                retries=3):
+        """
+        Upload a file into a folder (as a new item) or an item.
+
+        :param localPath: The path of the file.
+        :param name: The name of the file in Girder.
+        :param progress: The _TransferProgress of the upload.
+        :param partPool: The executor to upload S3 parts with.
+        :param sessions: The list of thread sessions to close afterward.
+        :param folderId: The ID of the folder to upload into.
+        :param itemId: The ID of the item to upload into.
+        :param reference: Option reference to send along with the upload.
+        :param chunkWorkers: The number of S3 parts of the file to have in flight.
+        :param retries: The number of times to retry an S3 request.
+        :returns: False if the item already had the file with the same size,
+            otherwise True.
+        """
+        size = os.path.getsize(localPath)
+        if itemId is not None:
+            fileId, current = self.isFileCurrent(itemId, name, localPath)
+            if current:
+                return False
+        else:
+            fileId = None
+
+        if fileId is not None:
+            params = {'size': size}
+            if reference:
+                params['reference'] = reference
+            obj = self.put('file/%s/contents' % fileId, params)
+        else:
+            params = {
+                'parentType': 'folder' if itemId is None else 'item',
+                'parentId': folderId if itemId is None else itemId,
+                'name': name,
+                'size': size,
+                'mimeType': mimetypes.guess_type(localPath)[0]
+            }
+            if reference:
+                params['reference'] = reference
+            if size <= self.MAX_CHUNK_SIZE and self.getServerVersion() >= ['2', '3']:
+                with open(localPath, 'rb') as f:
+                    chunk = f.read()
+                self.post('file', params, data=_ProgressBytesIO(chunk, reporter=progress))
+                return True
+            obj = self.post('file', params)
+        if '_id' not in obj:
+            raise Exception(
+                'After creating an upload token, expected an object with an id. '
+                'Got instead: ' + json.dumps(obj))
+
+        with open(localPath, 'rb') as f:
+            if obj.get('behavior') == 's3' and size > 0:
+                self._uploadS3Direct(
+                    obj, f, size, progress, partPool, sessions, chunkWorkers, retries)
+            else:
+                self._uploadContents(obj, f, size, reporter=progress)
+        return True
+
+    def _uploadS3Direct(self, uploadObj, stream, size, progress, partPool, sessions,
+                        chunkWorkers=4, retries=3):
+        """
+        Upload the contents of a file straight to S3, using the requests the
+        server signed for the upload, with several parts in flight at once.
+        """
+        from concurrent.futures import FIRST_COMPLETED, wait
+        from xml.etree import ElementTree
+
+        uploadId = uploadObj['_id']
+        s3 = uploadObj['s3']
+        request = s3['request']
+        try:
+            if not s3['chunked']:
+                chunk = stream.read(size)
+                self._s3Request(
+                    request['method'], request['url'], progress, data=chunk,
+                    headers=request.get('headers'), retries=retries)
+                progress.update(len(chunk))
+            else:
+                resp = self._s3Request(
+                    request['method'], request['url'], progress,
+                    headers=request.get('headers'), retries=retries)
+                s3UploadId = None
+                for element in ElementTree.fromstring(resp.content).iter():
+                    if element.tag.split('}')[-1] == 'UploadId':
+                        s3UploadId = element.text
+                if not s3UploadId:
+                    raise Exception('S3 did not start a multipart upload for %s.' % uploadId)
+
+                parts = []
+                pending = set()
+                partNumber = 0
+                offset = 0
+                while offset < size:
+                    # Bound the parts read into memory
+                    while len(pending) >= chunkWorkers:
+                        done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                        parts.extend(future.result() for future in done)
+                    chunk = stream.read(min(s3['chunkLength'], size - offset))
+                    if not chunk:
+                        break
+                    partNumber += 1
+                    pending.add(partPool.submit(
+                        self._uploadS3Part, uploadId, s3UploadId, partNumber, chunk, progress,
+                        sessions, retries))
+                    offset += len(chunk)
+                parts.extend(future.result() for future in pending)
+                if offset != size:
+                    raise IncorrectUploadLengthError(
+                        'Expected upload to be %d bytes, but received %d.' % (size, offset),
+                        upload=uploadObj)
+        except Exception:
+            self.delete('file/upload/' + uploadId)
+            raise
+
+        file = self.post('file/completion', parameters={'uploadId': uploadId})
+        if 's3FinalizeRequest' in file:
+            request = file['s3FinalizeRequest']
+            body = '<CompleteMultipartUpload>%s</CompleteMultipartUpload>' % ''.join(
+                '<Part><PartNumber>%d</PartNumber><ETag>%s</ETag></Part>' % part
+                for part in sorted(parts))
+            self._s3Request(
+                request['method'], request['url'], progress, data=body,
+                headers=request.get('headers'), retries=retries)
+        return file
+
+    def _uploadS3Part(self, uploadId, s3UploadId, partNumber, chunk, progress, sessions,
+                      retries=3):
+        """
+        Upload one part of a multipart upload straight to S3.
+
+        :returns: A (part number, ETag) tuple.
+        """
+        self._useThreadSession(sessions)
+        upload = self.post('file/chunk', parameters={
+            'offset': 0,
+            'uploadId': uploadId,
+            'chunk': json.dumps({'partNumber': partNumber, 's3UploadId': s3UploadId})
+        })
+        request = upload['s3']['request']
+        resp = self._s3Request(
+            request['method'], request['url'], progress, data=chunk, retries=retries)
+        progress.update(len(chunk))
+        return (partNumber, resp.headers['ETag'])
+
+    def _s3Request(self, method, url, progress, data=None, headers=None, retries=3):
+        """
+        Send a signed request to S3, retrying after connection errors and
+        server errors.
+        """
+        for attempt in range(retries + 1):
+            try:
+                resp = self._requestFunc(method)(url, data=data, headers=headers)
+            except (requests.ConnectionError, requests.Timeout) as e:
+                error = e
+            else:
+                if resp.status_code in (200, 201, 204):
+                    return resp
+                error = HttpError(
+                    status=resp.status_code, url=url, method=method, text=resp.text,
+                    response=resp)
+                if resp.status_code < 500:
+                    break
+            if attempt < retries:
+                progress.retry()
+                time.sleep(min(2 ** (attempt + 1), 30))
+        raise error
+
     def _checkResourcePath(self, objId):
         if isinstance(objId, six.string_types) and objId.startswith('/'):
             try:
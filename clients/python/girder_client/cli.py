@@ -80,11 +80,17 @@ class GirderCli(GirderClient):
         elif username:
             self.authenticate(username, password, interactive=interactive)
 
+    def _configureSession(self, session):
+        session.verify = self.sslVerify
+        if self.retries:
+            session.mount(self.urlBase, HTTPAdapter(max_retries=self.retries))
+
     def sendRestRequest(self, *args, **kwargs):
+        if getattr(self._threadLocal, 'session', None) is not None:
+            # A concurrent download thread, which has its own session
+            return super(GirderCli, self).sendRestRequest(*args, **kwargs)
         with self.session() as session:
-            session.verify = self.sslVerify
-            if self.retries:
-                session.mount(self.urlBase, HTTPAdapter(max_retries=self.retries))
+            self._configureSession(session)
             return super(GirderCli, self).sendRestRequest(*args, **kwargs)
 
 
@@ -291,8 +297,11 @@ _short_help = 'Download files from Girder'
     _short_help, _common_help.replace('LOCAL_FOLDER', 'LOCAL_FOLDER (default: ".")')))
 @_CommonParameters(additional_parent_types=[
     'collection', 'user', 'item', 'file'], path_default='.')
+@click.option('--workers', default=None, type=click.IntRange(1),
+              help='download folders, collections and users this many files at a time, '
+              'resuming interrupted files and skipping files that match their checksum')
 @click.pass_obj
-def _download(gc, parent_type, parent_id, local_folder):
+def _download(gc, parent_type, parent_id, local_folder, workers):
     if parent_type == 'auto':
         parent_type = _lookup_parent_type(gc, parent_id)
     if parent_type == 'item':
@@ -300,7 +309,7 @@ def _download(gc, parent_type, parent_id, local_folder):
     elif parent_type == 'file':
         gc.downloadFile(parent_id, local_folder)
     else:
-        gc.downloadResource(parent_id, local_folder, parent_type)
+        gc.downloadResource(parent_id, local_folder, parent_type, workers=workers)
 
 
 _short_help = 'Synchronize local folder with remote Girder folder'
@@ -308,12 +317,15 @@ _short_help = 'Synchronize local folder with remote Girder folder'
 
 @main.command('localsync', short_help=_short_help, help='%s\n\n%s' % (_short_help, _common_help))
 @_CommonParameters(additional_parent_types=[])
+@click.option('--workers', default=None, type=click.IntRange(1),
+              help='download this many files at a time, resuming interrupted files and '
+              'skipping files that match their checksum')
 @click.pass_obj
-def _localsync(gc, parent_type, parent_id, local_folder):
+def _localsync(gc, parent_type, parent_id, local_folder, workers):
     if parent_type != 'folder':
         raise Exception('localsync command only accepts parent-type of folder')
     gc.loadLocalMetadata(local_folder)
-    gc.downloadFolderRecursive(parent_id, local_folder, sync=True)
+    gc.downloadFolderRecursive(parent_id, local_folder, sync=True, workers=workers)
     gc.saveLocalMetadata(local_folder)
 
 
@@ -335,15 +347,19 @@ _short_help = 'Upload files to Girder'
               help='comma-separated list of filenames to ignore')
 @click.option('--reference', default=None,
               help='optional reference to send along with the upload')
+@click.option('--workers', default=None, type=click.IntRange(1),
+              help='upload this many files at a time, sending the parts of large files '
+              'straight to S3 assetstores concurrently')
 @click.pass_obj
 def _upload(gc, parent_type, parent_id, local_folder,
-            leaf_folders_as_items, reuse, blacklist, dry_run, reference):
+            leaf_folders_as_items, reuse, blacklist, dry_run, reference, workers):
     if parent_type == 'auto':
         parent_type = _lookup_parent_type(gc, parent_id)
     gc.upload(
         local_folder, parent_id, parent_type,
         leafFoldersAsItems=leaf_folders_as_items, reuseExisting=reuse,
-        blacklist=blacklist.split(','), dryRun=dry_run, reference=reference)
+        blacklist=blacklist.split(','), dryRun=dry_run, reference=reference,
+        workers=workers)
 
 
 if __name__ == '__main__':
@@ -25,7 +25,7 @@ def admin(fun, scope=None, cookie=False):
     """
     @six.wraps(fun)
     def wrapped(*args, **kwargs):
-        rest.requireAdmin(rest.getCurrentUser())
+        rest.requireAdmin(rest.getCurrentUserCore())
         return fun(*args, **kwargs)
     wrapped.accessLevel = 'admin'
     wrapped.requiredScopes = scope
@@ -52,7 +52,7 @@ def user(fun, scope=None, cookie=False):
     """
     @six.wraps(fun)
     def wrapped(*args, **kwargs):
-        if not rest.getCurrentUser():
+        if not rest.getCurrentUserCore():
             raise AccessException('You must be logged in.')
         return fun(*args, **kwargs)
     wrapped.accessLevel = 'user'
@@ -9,7 +9,7 @@ import cherrypy
 from collections import OrderedDict
 
 from girderformindlogger import constants, logprint
-from girderformindlogger.api.rest import getCurrentUser, getBodyJson
+from girderformindlogger.api.rest import getCurrentUserCore, getBodyJson
 from girderformindlogger.constants import SortDir, VERSION
 from girderformindlogger.exceptions import RestException
 from girderformindlogger.models.setting import Setting
@@ -734,7 +734,8 @@ class autoDescribeRoute(describeRoute):  # noqa: class name
         if info['force']:
             doc = model.load(id, force=True, **info['kwargs'])
         elif info['level'] is not None:
-            doc = model.load(id=id, level=info['level'], user=getCurrentUser(), **info['kwargs'])
+            doc = model.load(
+                id=id, level=info['level'], user=getCurrentUserCore(), **info['kwargs'])
         else:
             doc = model.load(id, **info['kwargs'])
 
@@ -742,7 +743,8 @@ class autoDescribeRoute(describeRoute):  # noqa: class name
             raise RestException('Invalid %s id (%s).' % (model.name, str(id)))
 
         if info['requiredFlags']:
-            model.requireAccessFlags(doc, user=getCurrentUser(), flags=info['requiredFlags'])
+            model.requireAccessFlags(
+                doc, user=getCurrentUserCore(), flags=info['requiredFlags'])
 
         return doc
 
@@ -25,7 +25,8 @@ from girderformindlogger.models.setting import Setting
 from girderformindlogger.models.token import Token
 from girderformindlogger.models.user import User
 from girderformindlogger.settings import SettingKey
-from girderformindlogger.utility import toBool, config, JsonEncoder, optionalArgumentDecorator
+from girderformindlogger.utility import toBool, config, JsonEncoder, optionalArgumentDecorator, \
+    auth_cache, json_encoding
 from girderformindlogger.utility._cache import requestCache
 from girderformindlogger.utility.model_importer import ModelImporter
 from six.moves import range, urllib
@@ -162,7 +163,14 @@ def getCurrentToken(allowCookie=None):
     if not tokenStr:
         return None
 
-    return Token().load(tokenStr, force=True, objectId=False)
+    cache = auth_cache.getAuthCache()
+    entry = cache.get(tokenStr)
+    if entry is not None:
+        return entry['token']
+    token = Token().load(tokenStr, force=True, objectId=False)
+    if token is not None:
+        cache.setToken(token)
+    return token
 
 
 def getCurrentUser(returnToken=False):
@@ -209,6 +217,49 @@ def getCurrentUser(returnToken=False):
         return retVal(user, token)
 
 
+def getCurrentUserCore():
+    """
+    Returns the `_id` and the fields access checks need
+    (:py:data:`girderformindlogger.utility.auth_cache.AUTH_USER_FIELDS`) of
+    the currently authenticated user, without loading the rest of the user
+    document. Use this rather than :py:func:`getCurrentUser` when the full
+    document isn't needed, and never save what it returns.
+
+    :returns: a partial user document, or None if the user is not logged in
+              or the token is invalid or expired.
+    """
+    if hasattr(cherrypy.request, 'girderUser'):
+        return auth_cache.userCore(cherrypy.request.girderUser)
+    if hasattr(cherrypy.request, 'girderUserCore'):
+        return cherrypy.request.girderUserCore
+
+    event = events.trigger('auth.user.get')
+    if event.defaultPrevented and len(event.responses) > 0:
+        return auth_cache.userCore(event.responses[0])
+
+    token = getCurrentToken()
+    user = None
+    if (token is not None
+            and token['expires'] >= datetime.datetime.utcnow()
+            and 'userId' in token):
+        try:
+            ensureTokenScopes(token, getattr(
+                cherrypy.request, 'requiredScopes', TokenScope.USER_AUTH))
+        except AccessException:
+            pass
+        else:
+            cache = auth_cache.getAuthCache()
+            entry = cache.get(token['_id'])
+            if entry is not None and 'user' in entry:
+                user = entry['user']
+            else:
+                user = User().load(
+                    token['userId'], force=True, fields=list(auth_cache.AUTH_USER_FIELDS))
+                cache.setUser(token['_id'], user)
+    cherrypy.request.girderUserCore = user
+    return user
+
+
 def setCurrentUser(user):
     """
     Explicitly set the user for the current request thread. This can be used
@@ -385,7 +436,7 @@ class loadmodel(object):  # noqa: class name
                         id, force=True, **self.kwargs)
                 elif self.level is not None:
                     kwargs[converted] = model.load(
-                        id=id, level=self.level, user=getCurrentUser(),
+                        id=id, level=self.level, user=getCurrentUserCore(),
                         **self.kwargs)
                 else:
                     kwargs[converted] = model.load(id, **self.kwargs)
@@ -396,12 +447,95 @@ class loadmodel(object):  # noqa: class name
 
                 if self.requiredFlags:
                     model.requireAccessFlags(
-                        kwargs[converted], user=getCurrentUser(), flags=self.requiredFlags)
+                        kwargs[converted], user=getCurrentUserCore(),
+                        flags=self.requiredFlags)
 
             return fun(*args, **kwargs)
         return wrapped
 
 
+def _totalCountEnabled():
+    """
+    :returns: bool, the `total_count` option in the ``[server]`` config
+        section, which controls whether list responses count their results
+        for the Girder-Total-Count header
+    """
+    return toBool(config.getConfig().get('server', {}).get('total_count', True))
+
+
+class JsonArrayStream(object):
+    """
+    Return an instance of this from an endpoint to send an iterable as a JSON
+    array whose elements are encoded and written one at a time, so that the
+    whole result is never held in memory. It can also be iterated like any
+    other iterable, e.g. when a Python caller uses the endpoint's result.
+
+    Errors raised while iterating happen after the response has started, so
+    they can't become error responses; they are logged and the array ends
+    with an error element like the body of a 500 response (``{"type":
+    "internal", ...}``) instead. Do any validation before returning the
+    stream, and only stream results that are too large to build in memory.
+
+    :param iterable: The elements of the array.
+    :type iterable: iterable
+    :param count: The total number of elements for the Girder-Total-Count
+        header, or a function that returns it. It is only used if the
+        ``total_count`` option of the ``[server]`` config section is True.
+    :type count: int, callable or None
+    """
+
+    # Approximate size in bytes of each chunk written to the response
+    CHUNK_SIZE = 65536
+
+    def __init__(self, iterable, count=None):
+        self.iterable = iterable
+        self.count = count
+
+    def __iter__(self):
+        return iter(self.iterable)
+
+    def setCountHeader(self):
+        """
+        Set the Girder-Total-Count header, if enabled and known.
+        """
+        if self.count is None or not _totalCountEnabled():
+            return
+        count = self.count() if callable(self.count) else self.count
+        setResponseHeader('Girder-Total-Count', count)
+
+    def encode(self):
+        """
+        Generator of the UTF-8 encoded JSON array, in chunks of about
+        ``CHUNK_SIZE`` bytes.
+        """
+        chunk = [b'[']
+        size = 1
+        written = 0
+        try:
+            for element in self.iterable:
+                data = json_encoding.dumps(element)
+                if written:
+                    chunk.append(b',')
+                chunk.append(data)
+                written += 1
+                size += len(data) + 1
+                if size >= self.CHUNK_SIZE:
+                    yield b''.join(chunk)
+                    chunk = []
+                    size = 0
+        except Exception:
+            logger.exception('Error while streaming a JSON array')
+            if written:
+                chunk.append(b',')
+            chunk.append(json_encoding.dumps({
+                'type': 'internal',
+                'uid': getattr(cherrypy.request, 'girderRequestUid', None),
+                'message': 'The response was truncated by an error on the server.'
+            }))
+        chunk.append(b']')
+        yield b''.join(chunk)
+
+
 class filtermodel(object):  # noqa: class name
     def __init__(self, model, plugin='_core', addFields=None):
         """
@@ -437,10 +571,14 @@ class filtermodel(object):  # noqa: class name
             else:
                 model = ModelImporter.model(self.model, self.plugin)
 
-            user = getCurrentUser()
+            user = getCurrentUserCore()
 
-            if isinstance(val, _MONGO_CURSOR_TYPES):
-                if callable(getattr(val, 'count', None)):
+            if isinstance(val, JsonArrayStream):
+                return JsonArrayStream((
+                    model.filter(m, user, self.addFields) for m in val
+                ), count=val.count)
+            elif isinstance(val, _MONGO_CURSOR_TYPES):
+                if callable(getattr(val, 'count', None)) and _totalCountEnabled():
                     cherrypy.response.headers['Girder-Total-Count'] = val.count()
                 return [model.filter(m, user, self.addFields) for m in val]
             elif isinstance(val, (list, tuple, types.GeneratorType)):
@@ -490,6 +628,19 @@ def rawResponse(fun):
     return wrapped
 
 
+def _prefersHtml():
+    """
+    Whether the client's "Accept" header asks for "text/html" before
+    "application/json".
+    """
+    for accept in cherrypy.request.headers.elements('Accept'):
+        if accept.value == 'application/json':
+            return False
+        elif accept.value == 'text/html':
+            return True
+    return False
+
+
 def _createResponse(val):
     """
     Helper that encodes the response according to the requested "Accepts"
@@ -506,25 +657,20 @@ def _createResponse(val):
             return val.encode('utf8')
         return val
 
-    accepts = cherrypy.request.headers.elements('Accept')
-    for accept in accepts:
-        if accept.value == 'application/json':
-            break
-        elif accept.value == 'text/html':
-            # Pretty-print and HTML-ify the response for the browser
-            setResponseHeader('Content-Type', 'text/html')
-            resp = cgi.escape(json.dumps(
-                val, indent=4, sort_keys=True, allow_nan=False, separators=(',', ': '),
-                cls=JsonEncoder))
-            resp = resp.replace(' ', '&nbsp;').replace('\n', '<br />')
-            resp = '<div style="font-family:monospace;">%s</div>' % resp
-            return resp.encode('utf8')
+    if _prefersHtml():
+        # Pretty-print and HTML-ify the response for the browser
+        setResponseHeader('Content-Type', 'text/html')
+        resp = cgi.escape(json.dumps(
+            val, indent=4, sort_keys=True, allow_nan=False, separators=(',', ': '),
+            cls=JsonEncoder))
+        resp = resp.replace(' ', '&nbsp;').replace('\n', '<br />')
+        resp = '<div style="font-family:monospace;">%s</div>' % resp
+        return resp.encode('utf8')
 
     # Default behavior will just be normal JSON output. Keep this
     # outside of the loop body in case no Accept header is passed.
     setResponseHeader('Content-Type', 'application/json')
-    return json.dumps(val, sort_keys=True, allow_nan=False,
-                      cls=JsonEncoder).encode('utf8')
+    return json_encoding.dumps(val)
 
 
 def _handleRestException(e):
@@ -539,7 +685,7 @@ def _handleRestException(e):
 def _handleAccessException(e):
     # Permission exceptions should throw a 401 or 403, depending
     # on whether the user is logged in or not
-    if getCurrentUser() is None:
+    if getCurrentUserCore() is None:
         cherrypy.response.status = 401
     else:
         cherrypy.response.status = 403
@@ -601,7 +747,7 @@ def _mongoCursorToList(val):
     # This needs to be before the callable check, as mongo cursors can
     # be callable.
     if isinstance(val, _MONGO_CURSOR_TYPES):
-        if callable(getattr(val, 'count', None)):
+        if callable(getattr(val, 'count', None)) and _totalCountEnabled():
             cherrypy.response.headers['Girder-Total-Count'] = val.count()
         val = list(val)
     return val
@@ -617,7 +763,8 @@ def endpoint(fun):
     using 500 status and including a useful traceback in those cases.
 
     If you want a streamed response, simply return a generator function
-    from the inner method.
+    from the inner method. To stream a JSON array, return a
+    :py:class:`JsonArrayStream`.
     """
     @six.wraps(fun)
     def endpointDecorator(self, *path, **params):
@@ -635,6 +782,16 @@ def endpoint(fun):
 
             val = _mongoCursorToList(val)
 
+            if isinstance(val, JsonArrayStream):
+                val.setCountHeader()
+                if getattr(cherrypy.request, 'girderRawResponse', False) is not True \
+                        and not _prefersHtml():
+                    setResponseHeader('Content-Type', 'application/json')
+                    cherrypy.response.stream = True
+                    _logRestRequest(self, path, params)
+                    return val.encode()
+                val = list(val)
+
             if callable(val):
                 # If the endpoint returned anything callable (function,
                 # lambda, functools.partial), we assume it's a generator
@@ -1225,7 +1382,7 @@ class Resource(object):
         the access level for a given route.
         """
         if not hasattr(handler, 'accessLevel'):
-            requireAdmin(getCurrentUser())
+            requireAdmin(getCurrentUserCore())
 
 
 # An instance of Resource that can be shared by boundHandlers for efficiency
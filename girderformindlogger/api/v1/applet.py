@@ -28,7 +28,8 @@ from bson.objectid import ObjectId
 from girderformindlogger.constants import AccessType, SortDir, TokenScope,     \
     DEFINED_INFORMANTS, REPROLIB_CANONICAL, SPECIAL_SUBJECTS, USER_ROLES
 from girderformindlogger.api import access
-from girderformindlogger.exceptions import AccessException, ValidationException
+from girderformindlogger.exceptions import AccessException, RestException,   \
+    ValidationException
 from girderformindlogger.models.activity import Activity as ActivityModel
 from girderformindlogger.models.applet import Applet as AppletModel
 from girderformindlogger.models.collection import Collection as CollectionModel
@@ -199,32 +200,51 @@ class Applet(Resource):
         )
         .param(
             'format',
-            'JSON or CSV',
-            required=False
+            'JSON, CSV, Parquet or Arrow (IPC stream). All but JSON are '
+            'streamed; Parquet and Arrow require pyarrow.',
+            required=False,
+            enum=['json', 'csv', 'parquet', 'arrow'],
+            default='json',
+            lower=True
         )
         .errorResponse('Write access was denied for this applet.', 403)
     )
     def getAppletData(self, id, format='json'):
-        import pandas as pd
         from datetime import datetime
-        from ..rest import setContentDisposition, setRawResponse, setResponseHeader
+        from girderformindlogger.utility.export import arrowAvailable,       \
+            streamArrow, streamCSV
+        from ..rest import JsonArrayStream, setContentDisposition,            \
+            setResponseHeader
 
         format = ('json' if format is None else format).lower()
+        if format in ['parquet', 'arrow'] and not arrowAvailable():
+            raise RestException(
+                'The {} format requires pyarrow.'.format(format),
+                'format'
+            )
         thisUser = self.getCurrentUser()
-        data = AppletModel().getResponseData(id, thisUser)
+        rows = AppletModel().iterResponseData(id, thisUser)
 
         setContentDisposition("{}-{}.{}".format(
             str(id),
             datetime.now().isoformat(),
             format
         ))
+        if format=='json':
+            setResponseHeader('Content-Type', 'application/json')
+            return(JsonArrayStream(rows))
+        # every column is needed for the header, before any row is written
+        columns = AppletModel().responseDataColumns(id)
         if format=='csv':
-            setRawResponse()
-            setResponseHeader('Content-Type', 'text/{}'.format(format))
-            csv = pd.DataFrame(data).to_csv(index=False)
-            return(csv)
-        setResponseHeader('Content-Type', 'application/{}'.format(format))
-        return(data)
+            setResponseHeader('Content-Type', 'text/csv')
+            return(lambda: streamCSV(rows, columns))
+        setResponseHeader(
+            'Content-Type',
+            'application/vnd.apache.arrow.stream' if format=='arrow' else (
+                'application/octet-stream'
+            )
+        )
+        return(lambda: streamArrow(rows, columns, format=format))
 
 
     @access.user(scope=TokenScope.DATA_WRITE)
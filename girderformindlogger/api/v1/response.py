@@ -20,9 +20,10 @@
 import itertools
 import tzlocal
 from ..describe import Description, autoDescribeRoute
-from ..rest import Resource, filtermodel, setResponseHeader, \
+from ..rest import JsonArrayStream, Resource, filtermodel, setResponseHeader, \
     setContentDisposition
 from datetime import datetime
+from girderformindlogger import logger
 from girderformindlogger.utility import ziputil
 from girderformindlogger.constants import AccessType, TokenScope
 from girderformindlogger.exceptions import AccessException, RestException, \
@@ -34,6 +35,7 @@ from girderformindlogger.models.assignment import Assignment as AssignmentModel
 from girderformindlogger.models.folder import Folder
 from girderformindlogger.models.response_folder import ResponseFolder as \
     ResponseFolderModel, ResponseItem as ResponseItemModel
+from girderformindlogger.models.response_rollup import ResponseRollup
 from girderformindlogger.models.roles import getCanonicalUser, getUserCipher
 from girderformindlogger.models.user import User as UserModel
 from girderformindlogger.models.upload import Upload as UploadModel
@@ -42,6 +44,7 @@ from girderformindlogger.utility.response import formatResponse, \
 from girderformindlogger.utility.resource import listFromString
 from pymongo import ASCENDING, DESCENDING
 from bson import ObjectId
+from bson.errors import InvalidId
 import hashlib
 
 
@@ -99,6 +102,29 @@ class ResponseItem(Resource):
             'thereof.',
             required=False
         )
+        .param(
+            'format',
+            'JSON (an Array), NDJSON or CSV. NDJSON and CSV are streamed.',
+            required=False,
+            enum=['json', 'ndjson', 'csv'],
+            default='json',
+            lower=True
+        )
+        .param(
+            'limit',
+            'Maximum number of responses to return, newest first; 0 for all. '
+            'If the limit is reached, the Girder-Next-After header holds the '
+            '"after" value of the next page.',
+            required=False,
+            dataType='integer',
+            default=0
+        )
+        .param(
+            'after',
+            'Page cursor from the Girder-Next-After header, or an ISO '
+            'datetime to only return responses created before it.',
+            required=False
+        )
         .errorResponse('ID was invalid.')
         .errorResponse(
             'Read access was denied for this applet for this user.',
@@ -112,7 +138,16 @@ class ResponseItem(Resource):
         applet=[],
         # activity=[],
         # screen=[]
+        format='json',
+        limit=0,
+        after=None
     ):
+        from girderformindlogger.utility.export import streamCSV,            \
+            streamNDJSON
+        from girderformindlogger.utility.response import TIDY_COLUMNS,       \
+            TIDY_FIELDS, tidyResponses
+        import pytz
+
         assert applet,  'you need to specify an applet'
 
         # grab the current user
@@ -178,62 +213,50 @@ class ResponseItem(Resource):
             )
         }
 
-        allResponses = list(ResponseItemModel().find(
+        if after:
+            # a page cursor is "<created>_<_id>" of the last response of the
+            # previous page, so responses created at the same instant aren't
+            # skipped at a page boundary; a bare datetime is also accepted
+            created, _, lastId = after.partition('_')
+            try:
+                created = datetime.fromisoformat(created)
+                lastId = ObjectId(lastId) if lastId else None
+            except (ValueError, InvalidId):
+                raise RestException('Invalid page cursor.', 'after')
+            if created.tzinfo:
+                created = created.astimezone(pytz.utc).replace(tzinfo=None)
+            q['$or'] = [{'created': {'$lt': created}}] + ([{
+                'created': created,
+                '_id': {'$lt': lastId}
+            }] if lastId else [])
+        if limit < 0:
+            raise RestException('Limit must not be negative.', 'limit')
+
+        responses = ResponseItemModel().find(
             query=q,
-            user=reviewer,
-            sort=[("created", DESCENDING)]
-        ))
-
-        # TODO: for now, an applet only has one group
-        # get the manager group and make sure there is just 1:
-        managerGroupOfApplet = appletInfo['roles']['manager']['groups']
-        assert len(managerGroupOfApplet) == 1, 'there should be only 1 group '
-        'for an applet, for now.'
-        managerGroupOfApplet = managerGroupOfApplet[0]['id']
-
-        # check to see if the current user is a manager too.
-        isAManager = len(list(filter(
-            lambda x: x == managerGroupOfApplet,
-            reviewer['groups']
-        )))
-
-        # Format the output response.
-        # else, get the userCipher and use that for the userId.
-        outputResponse = []
-        for response in allResponses:
-            userId = response['baseParentId']
-
-            # encode the userId below:
-            # TODO: create a user cipher, which is the hash of
-            # an appletid concatenated with the user id
-            appletIdUserId = applet + str(userId)
-            # hash it:
-            hash_object = hashlib.md5(appletIdUserId.encode())
-            encodedId = hash_object.hexdigest()
-
-            # format the response and add the userId
-            formattedResponse = formatResponse(response)['thisResponse']
-            formattedResponse['userId'] = encodedId
-            outputResponse.append(formattedResponse)
-
-        # lets format the output response in tidy format.
-        # a list of objects, with columns:
-        # ['itemURI', 'value', 'userId', 'schema:startDate', 'schema:endDate']
-
-        formattedOutputResponse = []
-
-        for response in outputResponse:
-            tmp = {
-                'schema:startDate': response['schema:startDate'],
-                'schema:endDate': response['schema:endDate'],
-                'userId': response['userId'],
-            }
-            for key, value in response['responses'].items():
-                tmp['itemURI'] = key
-                tmp['value'] = value
-                formattedOutputResponse.append(tmp)
-
-        return formattedOutputResponse
+            fields=TIDY_FIELDS,
+            sort=[("created", DESCENDING), ("_id", DESCENDING)],
+            limit=limit
+        )
+        if limit:
+            # a page is bounded, so read it to know where the next one starts
+            responses = list(responses)
+            if len(responses)==limit:
+                setResponseHeader('Girder-Next-After', '{}_{}'.format(
+                    responses[-1]['created'].isoformat(),
+                    responses[-1]['_id']
+                ))
+
+        # tidy format: one row per item response, with columns
+        # ['schema:startDate', 'schema:endDate', 'userId', 'itemURI', 'value']
+        rows = tidyResponses(responses, applet)
+        if format=='ndjson':
+            setResponseHeader('Content-Type', 'application/x-ndjson')
+            return(lambda: streamNDJSON(rows))
+        if format=='csv':
+            setResponseHeader('Content-Type', 'text/csv')
+            return(lambda: streamCSV(rows, TIDY_COLUMNS))
+        return(JsonArrayStream(rows))
 
         # responseArray = [
         #     formatResponse(response) for response in allResponses
@@ -277,10 +300,15 @@ class ResponseItem(Resource):
         subject=None,
         referenceDate=None
     ):
+        from girderformindlogger.utility.cache_storage import findCached
         from girderformindlogger.utility.response import last7Days
         from bson.objectid import ObjectId
         try:
-            appletInfo = AppletModel().findOne({'_id': ObjectId(applet)})
+            appletInfo = findCached(
+                AppletModel(),
+                {'_id': ObjectId(applet)},
+                ['activities']
+            )
             user = self.getCurrentUser()
             return(last7Days(applet, appletInfo, user.get('_id'), user, referenceDate))
         except:
@@ -334,7 +362,10 @@ class ResponseItem(Resource):
     ):
         from girderformindlogger.models.profile import Profile
         try:
-            from girderformindlogger.utility.response import aggregateAndSave
+            from girderformindlogger.utility.aggregation_queue import       \
+                getAggregationQueue
+            from girderformindlogger.utility.response import                \
+                canonicalActivityURL
             # TODO: pending
             metadata['applet'] = {
                 "@id": applet.get('_id'),
@@ -347,10 +378,10 @@ class ResponseItem(Resource):
             metadata['activity'] = {
                 "@id": activity.get('_id'),
                 "name": ActivityModel().preferredName(activity),
-                "url": activity.get(
+                "url": canonicalActivityURL(activity.get(
                     'url',
                     activity.get('meta', {}).get('activity', {}).get('url')
-                )
+                ))
             }
             informant = self.getCurrentUser()
             subject_id = subject_id if subject_id else str(
@@ -397,46 +428,44 @@ class ResponseItem(Resource):
                     "Couldn't find activity name for this response"
                 )
 
-            # for each blob in the parameter, upload it to a File under the item.
-            for key, value in params.items():
-                # upload the value (a blob)
-                um = UploadModel()
-                filename = "{}.{}".format(
+            # upload the blobs in the parameters to Files under the item.
+            keys = list(params.keys())
+            newFiles = UploadModel().uploadFromFiles([{
+                'obj': params[key].file,
+                'size': metadata['responses'][key]['size'],
+                'name': "{}.{}".format(
                     key,
                     metadata['responses'][key]['type'].split('/')[-1]
-                )
-                newUpload = um.uploadFromFile(
-                    value.file,
-                    metadata['responses'][key]['size'],
-                    filename,
-                    'item',
-                    newItem,
-                    informant,
-                    metadata['responses'][key]['type']
-                )
+                ),
+                'mimeType': metadata['responses'][key]['type']
+            } for key in keys], 'item', newItem, informant)
+            for key, newFile in zip(keys, newFiles):
                 # now, replace the metadata key with a link to this upload
-                metadata['responses'][key] = "file::{}".format(newUpload['_id'])
+                metadata['responses'][key] = "file::{}".format(newFile['_id'])
 
             if metadata:
                 newItem = self._model.setMetadata(newItem, metadata)
 
             print(metadata)
-            if not pending:
-                # create a Thread to calculate and save aggregates
-
-                # TODO: probably uncomment this as we scale.
-                # idea: thread all time, but synchronously do last7 days
-                # agg = threading.Thread(target=aggregateAndSave, args=(newItem, informant))
-                # agg.start()
-                aggregateAndSave(newItem, informant)
-                newItem['readOnly'] = True
-            print(newItem)
-            return(newItem)
         except:
             import sys, traceback
             print(sys.exc_info())
             print(traceback.print_tb(sys.exc_info()[2]))
             return(str(traceback.print_tb(sys.exc_info()[2])))
+        if not pending:
+            # count the response now; aggregates are calculated and saved in
+            # the background. The response is already saved, so a failure
+            # here is logged rather than failing the request.
+            try:
+                ResponseRollup().addResponse(newItem)
+            except Exception:
+                logger.exception('Could not roll up response {}'.format(
+                    newItem['_id']
+                ))
+            getAggregationQueue().enqueue(newItem, informant)
+            newItem['readOnly'] = True
+        print(newItem)
+        return(newItem)
 
 def save():
     return(lambda x: x)
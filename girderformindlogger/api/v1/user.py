@@ -6,7 +6,8 @@ import itertools
 
 from ..describe import Description, autoDescribeRoute
 from girderformindlogger.api import access
-from girderformindlogger.api.rest import Resource, filtermodel, setCurrentUser
+from girderformindlogger.api.rest import JsonArrayStream, Resource, filtermodel, \
+    setCurrentUser
 from girderformindlogger.constants import AccessType, SortDir, TokenScope,     \
     USER_ROLES
 from girderformindlogger.exceptions import RestException, AccessException
@@ -488,8 +489,9 @@ class User(Resource):
         refreshCache=False
     ):
         import threading
-        from bson import json_util
         from bson.objectid import ObjectId
+        from girderformindlogger.models.user_applet_cache import \
+            UserAppletCache
 
         reviewer = self.getCurrentUser()
         if reviewer is None:
@@ -526,46 +528,46 @@ class User(Resource):
                            "in several mintutes to see it."
             })
         try:
-            if 'cached' in reviewer:
-                reviewer['cached'] = json_util.loads(
-                    reviewer['cached']
-                ) if isinstance(reviewer['cached'], str) else reviewer['cached']
-            else:
-                reviewer['cached'] = {}
-            if 'applets' in reviewer[
-                'cached'
-            ] and role in reviewer['cached']['applets'] and isinstance(
-                reviewer['cached']['applets'][role],
-                list
-            ) and len(reviewer['cached']['applets'][role]):
-                applets = reviewer['cached']['applets'][role]
-                thread = threading.Thread(
-                    target=AppletModel().updateUserCache,
-                    args=(role, reviewer),
-                    kwargs={"active": True, "refreshCache": refreshCache}
+            if UserAppletCache().hasApplets(reviewer['_id'], role):
+                stale = UserAppletCache().getStaleAppletIds(
+                    reviewer['_id'],
+                    role
                 )
-                thread.start()
+                if stale:
+                    # applets that changed since they were cached
+                    AppletModel().updateUserCache(
+                        role,
+                        reviewer,
+                        active=True,
+                        applets=stale
+                    )
             else:
-                applets = AppletModel().updateUserCache(
+                # formatted applets are stored a batch at a time, then
+                # streamed back from the cache like any other request's
+                AppletModel().updateUserCache(
                     role,
                     reviewer,
                     active=True,
                     refreshCache=refreshCache
                 )
-            for applet in applets:
-                try:
-                    applet["applet"]["responseDates"] = responseDateList(
-                        applet['applet'].get(
-                            '_id',
-                            ''
-                        ).split('applet/')[-1],
-                        user.get('_id'),
-                        user
-                    )
-                except:
-                    applet["applet"]["responseDates"] = []
-
-            return(applets)
+            applets = UserAppletCache().getApplets(reviewer['_id'], role)
+            def withResponseDates(applets):
+                for applet in applets:
+                    try:
+                        applet["applet"]["responseDates"] = responseDateList(
+                            applet['applet'].get(
+                                '_id',
+                                ''
+                            ).split('applet/')[-1],
+                            user.get('_id'),
+                            user
+                        )
+                    except:
+                        applet["applet"]["responseDates"] = []
+                    yield applet
+
+            # each applet is encoded as soon as its response dates are added
+            return(JsonArrayStream(withResponseDates(applets)))
         except Exception as e:
             import sys, traceback
             print(sys.exc_info())
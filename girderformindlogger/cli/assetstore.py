@@ -0,0 +1,21 @@
+# -*- coding: utf-8 -*-
+import click
+
+
+@click.group('assetstore', short_help='Manage assetstores.',
+             help='Manage the data stored in assetstores.')
+def main():
+    pass
+
+
+@main.command('hash-pending', short_help='Hash files stored in zero-copy mode.',
+              help='Hash the files of filesystem assetstores that were stored in zero-copy '
+              'mode and are still waiting to be hashed, and move them to their '
+              'content-addressed locations. The server also does this in the background '
+              'when it starts.')
+def hashPending():
+    from girderformindlogger.utility.filesystem_assetstore_adapter import \
+        hashAllPendingFiles
+
+    count = hashAllPendingFiles()
+    click.echo('Hashed %d file(s)' % count)
@@ -0,0 +1,52 @@
+# -*- coding: utf-8 -*-
+import click
+import time
+
+ACCESS_LEVELS = ('read', 'write', 'admin')
+
+
+@click.group('benchmark', short_help='Time database access paths.',
+             help='Time database access paths against the configured database.')
+def main():
+    pass
+
+
+@main.command('acl-paging', short_help='Time permission-filtered paging.',
+              help='Page through the documents of an access-controlled model that a user '
+              'can see, at increasing offsets, with the database doing the permission '
+              'filtering (findWithPermissions) and with the Python filter '
+              '(filterResultsByPermission), and check that both return the same page.')
+@click.option('--model', 'modelName', default='folder', show_default=True,
+              help='Access-controlled model to page through.')
+@click.option('--user', 'login', required=True, help='Login of the user to filter for.')
+@click.option('--offset', 'offsets', type=int, multiple=True, default=(0, 1000, 10000),
+              show_default=True, help='Offsets to time (repeatable).')
+@click.option('--limit', type=int, default=50, show_default=True, help='Page size.')
+@click.option('--level', type=click.Choice(ACCESS_LEVELS), default='read',
+              show_default=True, help='Access level to require.')
+def aclPaging(modelName, login, offsets, limit, level):
+    from girderformindlogger.constants import AccessType
+    from girderformindlogger.models.user import User
+    from girderformindlogger.utility.model_importer import ModelImporter
+
+    model = ModelImporter.model(modelName)
+    if not hasattr(model, 'findWithPermissions'):
+        raise click.ClickException('%s is not access-controlled.' % modelName)
+    user = User().findOne({'login': login.lower()})
+    if user is None:
+        raise click.ClickException('No user with login %s.' % login)
+    level = getattr(AccessType, level.upper())
+    sort = [('_id', 1)]
+    for offset in offsets:
+        start = time.perf_counter()
+        query = [doc['_id'] for doc in model.findWithPermissions(
+            {}, offset=offset, limit=limit, sort=sort, fields=['_id'], user=user,
+            level=level)]
+        queryTime = time.perf_counter() - start
+        start = time.perf_counter()
+        python = [doc['_id'] for doc in model.filterResultsByPermission(
+            model.find({}, sort=sort), user, level, limit=limit, offset=offset)]
+        pythonTime = time.perf_counter() - start
+        click.echo('offset %7d: query %8.3f s, python %8.3f s, %d doc(s)%s' % (
+            offset, queryTime, pythonTime, len(query),
+            '' if query == python else ' (MISMATCH)'))
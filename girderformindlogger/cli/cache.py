@@ -0,0 +1,127 @@
+# -*- coding: utf-8 -*-
+import click
+
+from girderformindlogger.utility.cache_storage import CACHE_STORAGE_MODES
+
+# Models whose documents carry a formatted JSON-LD `cached` field
+CACHED_MODELS = ('folder', 'item', 'user')
+BATCH_SIZE = 500
+
+
+def _migrate(model, to, dryRun):
+    from pymongo import UpdateOne
+    from girderformindlogger.utility.cache_storage import dumpCache, parseCache
+
+    query = {'cached': {'$type': 'string' if to == 'native' else 'object'}}
+    count = 0
+    batch = []
+    for doc in model.collection.find(query, {'cached': True}):
+        count += 1
+        if dryRun:
+            continue
+        try:
+            cached = dumpCache(parseCache(doc['cached']), mode=to)
+        except (TypeError, ValueError):
+            click.echo('Skipping unreadable cache on %s %s' % (
+                model.name, doc['_id']), err=True)
+            continue
+        batch.append(UpdateOne({'_id': doc['_id']}, {'$set': {'cached': cached}}))
+        if len(batch) >= BATCH_SIZE:
+            model.collection.bulk_write(batch, ordered=False)
+            batch = []
+    if batch:
+        model.collection.bulk_write(batch, ordered=False)
+    return count
+
+
+@click.group('cache', short_help='Manage formatted JSON-LD caches.',
+             help='Manage the formatted JSON-LD caches stored on applets, '
+             'protocols, activities, screens and users.')
+def main():
+    pass
+
+
+@main.command('migrate', short_help='Convert caches to another storage format.',
+              help='Convert every stored cache to the given storage format. Set the '
+              '"cache_storage" option in the [jsonld] config section to the same format '
+              'so new caches are written that way too.')
+@click.option('--to', type=click.Choice(CACHE_STORAGE_MODES), default='native',
+              show_default=True, help='Storage format to convert to.')
+@click.option('--dry-run', is_flag=True, help='Only count the caches to convert.')
+def migrate(to, dry_run):
+    from girderformindlogger.utility.model_importer import ModelImporter
+
+    for modelName in CACHED_MODELS:
+        count = _migrate(ModelImporter.model(modelName), to, dry_run)
+        click.echo('%s %d %s cache(s) to %s' % (
+            'Would convert' if dry_run else 'Converted', count, modelName, to))
+
+
+@main.command('benchmark-json', short_help='Time the JSON encoders on cached applets.',
+              help='Encode the cached formatted applets with each available JSON encoder, '
+              'with and without sorted keys, and report the best time of each. Set the '
+              '"json_encoder" and "json_sort_keys" options in the [server] config section '
+              'to choose.')
+@click.option('--limit', type=int, default=20, show_default=True,
+              help='Number of applets to encode.')
+@click.option('--repeat', type=int, default=5, show_default=True,
+              help='Number of runs per encoder.')
+def benchmarkJson(limit, repeat):
+    from girderformindlogger.utility.cache_storage import parseCache
+    from girderformindlogger.utility.json_encoding import benchmark
+    from girderformindlogger.utility.model_importer import ModelImporter
+
+    values = [parseCache(doc['cached']) for doc in ModelImporter.model(
+        'folder').collection.find({
+            'meta.applet': {'$exists': True},
+            'cached': {'$exists': True}
+        }, {'cached': True}, limit=limit)]
+    if not values:
+        raise click.ClickException('No cached applets to encode.')
+    results = benchmark(values, repeat=repeat)
+    baseline = results[0]['seconds']
+    for result in results:
+        click.echo('%-7s sort_keys=%-5s %8.3f s  %5.2fx  %d bytes' % (
+            result['encoder'], result['sortKeys'], result['seconds'],
+            baseline / result['seconds'] if result['seconds'] else 0,
+            result['bytes']))
+
+
+@main.command('drop-user-applets', short_help='Remove applet lists from user documents.',
+              help='Remove the formatted applet lists that used to be cached on user '
+              'documents. They are now kept in the userAppletCache collection and rebuilt '
+              'there on demand.')
+@click.option('--dry-run', is_flag=True, help='Only count the users to update.')
+def dropUserApplets(dry_run):
+    from pymongo import UpdateOne
+    from girderformindlogger.models.user import User
+    from girderformindlogger.utility.cache_storage import dumpCache, parseCache
+
+    collection = User().collection
+    native = {'cached.applets': {'$exists': True}}
+    if dry_run:
+        count = collection.find(native, {'_id': True}).count()
+    else:
+        count = collection.update_many(
+            native, {'$unset': {'cached.applets': True}}).modified_count
+    batch = []
+    for doc in collection.find({'cached': {'$type': 'string'}}, {'cached': True}):
+        try:
+            cached = parseCache(doc['cached'])
+        except (TypeError, ValueError):
+            continue
+        if not isinstance(cached, dict) or 'applets' not in cached:
+            continue
+        count += 1
+        if dry_run:
+            continue
+        del cached['applets']
+        batch.append(UpdateOne({'_id': doc['_id']}, {'$set': {
+            'cached': dumpCache(cached, mode='string')}}))
+        if len(batch) >= BATCH_SIZE:
+            collection.bulk_write(batch, ordered=False)
+            batch = []
+    if batch:
+        collection.bulk_write(batch, ordered=False)
+    click.echo('%s applet lists on %d user(s)' % (
+        'Would remove' if dry_run else 'Removed', count))
@@ -0,0 +1,20 @@
+# -*- coding: utf-8 -*-
+import click
+
+
+@click.group('responses', short_help='Manage stored responses.',
+             help='Manage stored responses and the aggregates kept about them.')
+def main():
+    pass
+
+
+@main.command('rebuild-rollups', short_help='Recompute response rollups.',
+              help='Recompute the per-item response rollups that allTime and last7Days '
+              'aggregates are built from, by rescanning the stored responses. Run this '
+              'once after upgrading so that responses submitted earlier are counted.')
+@click.option('--applet', default=None, help='Only rebuild the rollups of this applet ID.')
+def rebuildRollups(applet):
+    from girderformindlogger.models.response_rollup import ResponseRollup
+
+    count = ResponseRollup().rebuild(appletId=applet)
+    click.echo('Rolled up %d response(s)' % count)
@@ -10,6 +10,8 @@ import girderformindlogger
 PACKAGE_DIR = os.path.dirname(os.path.abspath(__file__))
 ROOT_DIR = os.path.dirname(PACKAGE_DIR)
 LOG_ROOT = os.path.join(os.path.expanduser('~'), '.girderformindlogger', 'logs')
+JSONLD_CACHE_ROOT = os.path.join(
+    os.path.expanduser('~'), '.girderformindlogger', 'jsonld_cache')
 MAX_LOG_SIZE = 1024 * 1024 * 10  # Size in bytes before logs are rotated.
 LOG_BACKUP_COUNT = 5
 ACCESS_FLAGS = {}
@@ -423,6 +425,12 @@ class CoreEventHandler(object):
     # For updating an item's size to include a new file.
     FILE_PROPAGATE_SIZE = 'core.propagateSizeToItem'
 
+    # For hashing files stored without a hash by a zero-copy assetstore.
+    FILE_HASH_PENDING = 'core.hashPendingFile'
+
+    # For dropping cached authentication of changed users, groups and tokens.
+    AUTH_CACHE_INVALIDATE = 'core.invalidateAuthCache'
+
     # For adding a group's creator into its ACL at creation time.
     GROUP_CREATOR_ACCESS = 'core.grantCreatorAccess'
 
@@ -21,14 +21,21 @@ For obvious reasons, the asynchronous method does not return a value to the
 caller. Instead, the caller may optionally pass the callback argument as a
 function to be called when the task is finished. That callback function will
 receive the Event object as its only argument.
+
+Asynchronous events are handled by a pool of worker threads, with a queue per
+event name, so a slow handler only delays events of the same name. Events of a
+name are handled concurrently unless one of its handlers was bound with
+``ordered=True``, in which case they are handled one at a time, in the order
+they were triggered.
 """
 
 import contextlib
 import girderformindlogger
 import six
 import threading
+import time
 
-from collections import OrderedDict
+from collections import deque, OrderedDict
 from girderformindlogger.utility import config
 from six.moves import queue
 
@@ -108,6 +115,9 @@ class ForegroundEventsDaemon(object):
     def stop(self):
         pass
 
+    def metrics(self):
+        return {'workers': 0}
+
     def trigger(self, eventName=None, info=None, callback=None):
         if eventName is None:
             event = Event(None, info, asynchronous=False)
@@ -194,7 +204,214 @@ class AsyncEventsThread(threading.Thread):
         # super(AsyncEventsThread, self).__del__()
 
 
-def bind(eventName, handlerName, handler):
+class AsyncEventsPool(object):
+    """
+    This class executes the pipeline for events asynchronously on a pool of
+    worker threads, with a bounded queue per event name. This should not be
+    invoked directly by callers; instead, they should use
+    girderformindlogger.events.daemon.trigger().
+
+    :param workers: The number of worker threads.
+    :type workers: int
+    :param capacity: The number of events that may wait in each event name's
+        queue.
+    :type capacity: int
+    :param timeout: How many seconds ``trigger`` waits for room in a full
+        queue. After that the event is handled on the calling thread, so
+        events are never dropped.
+    :type timeout: float
+    """
+
+    def __init__(self, workers=4, capacity=1000, timeout=10):
+        self.workers = max(1, int(workers))
+        self.capacity = max(1, int(capacity))
+        self.timeout = timeout
+        self.terminate = False
+        self._queues = OrderedDict()
+        self._running = {}
+        self._stats = {}
+        self._threads = []
+        self._condition = threading.Condition()
+
+    def start(self):
+        """
+        Start the worker threads.
+        """
+        girderformindlogger.logprint.info(
+            'Started asynchronous event manager with %d workers.' % self.workers)
+        with self._condition:
+            self.terminate = False
+            while len(self._threads) < self.workers:
+                thread = threading.Thread(
+                    target=self._work, name='events-%d' % len(self._threads))
+                thread.daemon = True
+                self._threads.append(thread)
+                thread.start()
+
+    def stop(self):
+        """
+        Gracefully stops the workers. Each will finish the event it is
+        processing before stopping.
+        """
+        with self._condition:
+            self.terminate = True
+            self._threads = []
+            self._condition.notify_all()
+
+    def trigger(self, eventName=None, info=None, callback=None):
+        """
+        Adds a new event on the queue of its name to trigger asynchronously.
+        If that queue is full, this waits for room, and handles the event on
+        the calling thread if there is still none after ``timeout`` seconds.
+
+        :param eventName: The event name to pass to the girderformindlogger.events.trigger
+        :param info: The info object to pass to girderformindlogger.events.trigger
+        :param callback: Optional callable to be called upon completion of
+            all bound event handlers. It takes one argument, which is the
+            event object itself.
+        """
+        deadline = time.time() + self.timeout
+        with self._condition:
+            eventQueue = self._queues.setdefault(eventName, deque())
+            stats = self._statsFor(eventName)
+            while len(eventQueue) >= self.capacity and not self.terminate:
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    break
+                stats['blocked'] += 1
+                self._condition.wait(remaining)
+            overflowed = len(eventQueue) >= self.capacity
+            if overflowed:
+                stats['overflowed'] += 1
+            else:
+                eventQueue.append((info, callback, time.time()))
+                stats['queued'] += 1
+                self._condition.notify_all()
+        if overflowed:
+            girderformindlogger.logger.warning(
+                'Event queue for "%s" is full; handling the event synchronously.' % eventName)
+            self._dispatch(eventName, info, callback, time.time(), asynchronous=False)
+
+    def metrics(self):
+        """
+        :returns: A dict with the number of workers, the queue capacity and,
+            for each event name, the queue depth, events in progress, counts
+            of processed, failed, blocked and overflowed events, the time
+            events waited in the queue and the time each handler took.
+        """
+        with self._condition:
+            return {
+                'workers': len(self._threads),
+                'capacity': self.capacity,
+                'events': {
+                    str(name): dict(
+                        stats,
+                        depth=len(self._queues.get(name, ())),
+                        running=self._running.get(name, 0),
+                        handlers={
+                            handlerName: dict(handlerStats)
+                            for handlerName, handlerStats in six.viewitems(stats['handlers'])
+                        })
+                    for name, stats in six.viewitems(self._stats)
+                }
+            }
+
+    def _statsFor(self, eventName):
+        # Must hold the lock
+        if eventName not in self._stats:
+            self._stats[eventName] = {
+                'queued': 0,
+                'processed': 0,
+                'failed': 0,
+                'blocked': 0,
+                'overflowed': 0,
+                'maxWait': 0.0,
+                'handlers': {}
+            }
+        return self._stats[eventName]
+
+    def _next(self):
+        """
+        Pop the oldest event of the next event name, in turn, that has one
+        waiting and isn't ordered and already being handled. Must hold the
+        lock.
+        """
+        for eventName in list(self._queues):
+            eventQueue = self._queues[eventName]
+            if not eventQueue:
+                continue
+            if self._running.get(eventName) and isOrdered(eventName):
+                continue
+            # Take turns between event names
+            self._queues.move_to_end(eventName)
+            return eventName, eventQueue.popleft()
+        return None, None
+
+    def _work(self):
+        while True:
+            with self._condition:
+                eventName, task = self._next()
+                while task is None and not self.terminate:
+                    self._condition.wait()
+                    eventName, task = self._next()
+                if task is None:
+                    break
+                self._running[eventName] = self._running.get(eventName, 0) + 1
+                # There is now room in the queue
+                self._condition.notify_all()
+            try:
+                info, callback, enqueued = task
+                self._dispatch(eventName, info, callback, enqueued)
+            finally:
+                with self._condition:
+                    self._running[eventName] -= 1
+                    self._condition.notify_all()
+        girderformindlogger.logprint.info('Stopped asynchronous event manager thread.')
+
+    def _dispatch(self, eventName, info, callback, enqueued, asynchronous=True):
+        timings = []
+
+        def pre(handlerName, **kwargs):
+            timings.append((handlerName, time.time()))
+
+        start = time.time()
+        failed = False
+        try:
+            if eventName is None:
+                event = Event(None, info, asynchronous=asynchronous)
+            else:
+                event = trigger(
+                    eventName, info, pre=pre, asynchronous=asynchronous, daemon=True)
+
+            if callable(callback):
+                callback(event)
+        except Exception:
+            # Must continue the event loop even if handler failed
+            failed = True
+            girderformindlogger.logger.exception('In handler for event "%s":' % eventName)
+        end = time.time()
+
+        with self._condition:
+            stats = self._statsFor(eventName)
+            stats['failed' if failed else 'processed'] += 1
+            stats['maxWait'] = round(max(stats['maxWait'], start - enqueued), 3)
+            for index, (handlerName, handlerStart) in enumerate(timings):
+                handlerEnd = timings[index + 1][1] if index + 1 < len(timings) else end
+                handlerStats = stats['handlers'].setdefault(handlerName, {
+                    'calls': 0,
+                    'failed': 0,
+                    'totalTime': 0.0,
+                    'maxTime': 0.0
+                })
+                elapsed = handlerEnd - handlerStart
+                handlerStats['calls'] += 1
+                handlerStats['totalTime'] = round(handlerStats['totalTime'] + elapsed, 3)
+                handlerStats['maxTime'] = round(max(handlerStats['maxTime'], elapsed), 3)
+                if failed and index == len(timings) - 1:
+                    handlerStats['failed'] += 1
+
+
+def bind(eventName, handlerName, handler, ordered=False):
     """
     Bind a listener (handler) to the event identified by eventName. It is
     convention that plugins will use their own name as the handlerName, so that
@@ -211,6 +428,10 @@ def bind(eventName, handlerName, handler):
                     triggerer should be passed via the addResponse() method of
                     the Event.
     :type handler: function
+    :param ordered: Whether events of this name must be handled one at a time,
+        in the order they were triggered, when they are triggered on the
+        daemon.
+    :type ordered: bool
     """
     if eventName in _deprecated:
         girderformindlogger.logger.warning('event "%s" is deprecated; %s' % (eventName, _deprecated[eventName]))
@@ -222,6 +443,8 @@ def bind(eventName, handlerName, handler):
         girderformindlogger.logger.warning('Event binding already exists: %s -> %s' % (eventName, handlerName))
     else:
         _mapping[eventName][handlerName] = handler
+        if ordered:
+            _ordered.setdefault(eventName, set()).add(handlerName)
 
 
 def unbind(eventName, handlerName):
@@ -234,6 +457,7 @@ def unbind(eventName, handlerName):
     :type handlerName: str
     """
     _mapping.get(eventName, {}).pop(handlerName, None)
+    _ordered.get(eventName, set()).discard(handlerName)
 
 
 def unbindAll():
@@ -245,16 +469,17 @@ def unbindAll():
        never be called outside of testing.
     """
     _mapping.clear()
+    _ordered.clear()
 
 
 @contextlib.contextmanager
-def bound(eventName, handlerName, handler):
+def bound(eventName, handlerName, handler, ordered=False):
     """
     A context manager to temporarily bind an event handler within its scope.
 
     Parameters are the same as those to :py:func:`girderformindlogger.events.bind`.
     """
-    bind(eventName, handlerName, handler)
+    bind(eventName, handlerName, handler, ordered=ordered)
     try:
         yield
     finally:
@@ -299,14 +524,27 @@ def trigger(eventName, info=None, pre=None, asynchronous=False, daemon=False):
     return e
 
 
+def isOrdered(eventName):
+    """
+    :returns: Whether a handler of this event name was bound with
+        ``ordered=True``.
+    """
+    return bool(_ordered.get(eventName))
+
+
 _deprecated = {}
 _mapping = {}
+_ordered = {}
 daemon = ForegroundEventsDaemon()
 
 
 def setupDaemon():
     global daemon
-    if config.getConfig()['server'].get('disable_event_daemon', False):
+    cfg = config.getConfig()['server']
+    if cfg.get('disable_event_daemon', False):
         daemon = ForegroundEventsDaemon()
     else:
-        daemon = AsyncEventsThread()
+        daemon = AsyncEventsPool(
+            workers=int(cfg.get('event_daemon_workers', 4)),
+            capacity=int(cfg.get('event_queue_size', 1000)),
+            timeout=float(cfg.get('event_queue_timeout', 10)))
@@ -205,7 +205,7 @@ class Applet(Folder):
             user,
             refreshCache=True
         )
-        self.updateUserCacheAllRoles(user)
+        self.updateUserCacheAllRoles(user, applets=[applet])
 
     def getResponseData(self, appletId, reviewer, filter={}):
         """
@@ -217,42 +217,142 @@ class Applet(Folder):
         :type reviewer: dict
         :param filter: reduction criteria (not yet implemented)
         :type filter: dict
-        :reutrns: TBD
+        :reutrns: list of dicts, see `iterResponseData`
+        """
+        return(list(self.iterResponseData(appletId, reviewer, filter)))
+
+    def iterResponseData(self, appletId, reviewer, filter={}):
+        """
+        Function to stream the response data available to given reviewer,
+        newest first: one row per (response, respondent ID code), with the
+        response's metadata except its `last7Days` and `allTime` aggregates.
+        Responses are read in chunks, and the respondents of each chunk are
+        resolved with one query for their profiles and one for their ID codes.
+
+        :param appletId: ID of applet for which to get response data
+        :type appletId: ObjectId or str
+        :param reviewer: Reviewer making request
+        :type reviewer: dict
+        :param filter: reduction criteria (not yet implemented)
+        :type filter: dict
+        :returns: generator of dicts
         """
-        from .ID_code import IDCode
-        from .profile import Profile
         from .response_folder import ResponseItem
-        from .user import User
+        from girderformindlogger.utility.export import chunked
         from pymongo import DESCENDING
 
+        # check access before the caller starts streaming
         if not self._hasRole(appletId, reviewer, 'reviewer'):
             raise AccessException("You are not a reviewer for this applet.")
-        query = {
-            "baseParentType": "user",
-            "meta.applet.@id": ObjectId(appletId)
-        }
-        responses = list(ResponseItem().find(
-            query=query,
-            user=reviewer,
+        responses = ResponseItem().find(
+            query={
+                "baseParentType": "user",
+                "meta.applet.@id": ObjectId(appletId)
+            },
+            fields={
+                'meta.last7Days': False,
+                'meta.allTime': False
+            },
             sort=[("created", DESCENDING)]
-        ))
-        respondents = {
-            str(response['baseParentId']): IDCode().findIdCodes(
-                Profile().createProfile(
-                    appletId,
-                    User().load(response['baseParentId'], force=True),
-                    'user'
-                )['_id']
-            ) for response in responses if 'baseParentId' in response
+        )
+
+        def rows():
+            respondents = {}
+            for chunk in chunked(responses):
+                self._resolveRespondents(appletId, {
+                    response['baseParentId'] for response in chunk if (
+                        'baseParentId' in response
+                    )
+                } - set(respondents), respondents)
+                for response in chunk:
+                    if 'baseParentId' not in response:
+                        continue
+                    for code in respondents[response['baseParentId']]:
+                        yield({
+                            "respondent": code,
+                            **response.get('meta', {})
+                        })
+
+        return(rows())
+
+    def responseDataColumns(self, appletId):
+        """
+        Function to list the columns of `iterResponseData` rows without
+        reading the responses themselves: 'respondent', then every metadata
+        key of the applet's responses, in the order they first appear in the
+        rows.
+
+        :param appletId: ID of the applet
+        :type appletId: ObjectId or str
+        :returns: list of str
+        """
+        from .response_folder import ResponseItem
+
+        keys = ResponseItem().collection.aggregate([
+            {'$match': {
+                'baseParentType': 'user',
+                'meta.applet.@id': ObjectId(appletId)
+            }},
+            {'$sort': {'created': -1}},
+            {'$project': {
+                'created': True,
+                'keys': {'$objectToArray': {'$ifNull': ['$meta', {}]}}
+            }},
+            {'$unwind': {'path': '$keys', 'includeArrayIndex': 'position'}},
+            {'$match': {'keys.k': {'$nin': ['last7Days', 'allTime']}}},
+            {'$group': {
+                '_id': '$keys.k',
+                'created': {'$first': '$created'},
+                'position': {'$first': '$position'}
+            }},
+            {'$sort': {'created': -1, 'position': 1}}
+        ], allowDiskUse=True)
+        return(['respondent', *[
+            key['_id'] for key in keys if key['_id'] != 'respondent'
+        ]])
+
+    def _resolveRespondents(self, appletId, userIds, respondents):
+        """
+        Look up the ID codes of respondents to an applet. A respondent with
+        an applet profile but no ID code is given one, as `IDCode.findIdCodes`
+        does; a respondent without a profile gets [None].
+
+        :param appletId: ID of the applet
+        :type appletId: ObjectId or str
+        :param userIds: IDs of the respondents to resolve
+        :type userIds: set of ObjectId
+        :param respondents: dict to add {userId: [ID codes]} to
+        :type respondents: dict
+        """
+        from .ID_code import IDCode
+        from .profile import Profile
+
+        if not userIds:
+            return
+        profiles = {
+            profile['userId']: profile['_id'] for profile in Profile().find(
+                {
+                    'appletId': ObjectId(appletId),
+                    'userId': {'$in': list(userIds)},
+                    'profile': True
+                },
+                fields=['userId']
+            )
         }
-        return([
-            {
-                "respondent": code,
-                **response.get('meta', {})
-            } for response in responses for code in respondents[
-                str(response['baseParentId'])
-            ]
-        ])
+        codes = {}
+        for idCode in IDCode().find({'profileId': {'$in': [
+            *profiles.values(),
+            *[str(profileId) for profileId in profiles.values()]
+        ]}}, fields=['profileId', 'code']):
+            if 'code' in idCode:
+                codes.setdefault(str(idCode['profileId']), []).append(
+                    idCode['code']
+                )
+        for userId in userIds:
+            profileId = profiles.get(userId)
+            respondents[userId] = [None] if profileId is None else codes.get(
+                str(profileId)
+            ) or IDCode().findIdCodes(profileId)
 
     def updateRelationship(self, applet, relationship):
         """
@@ -262,7 +362,7 @@ class Applet(Folder):
         :type relationship: str
         :returns: updated Applet
         """
-        from bson.json_util import dumps
+        from girderformindlogger.utility.cache_storage import dumpCache
         from girderformindlogger.utility.jsonld_expander import loadCache
 
         if not isinstance(relationship, str):
@@ -276,7 +376,7 @@ class Applet(Folder):
             applet['cached'] = loadCache(applet['cached'])
         if 'applet' in applet['cached']:
             applet['cached']['applet']['informantRelationship'] = relationship
-        applet['cached'] = dumps(applet['cached'])
+        applet['cached'] = dumpCache(applet['cached'])
         return(self.save(applet, validate=False))
 
     def unexpanded(self, applet):
@@ -373,77 +473,177 @@ class Applet(Folder):
         ))
         return(applets if isinstance(applets, list) else [applets])
 
-    def updateUserCacheAllUsersAllRoles(self, applet, coordinator):
-        from .profile import Profile as ProfileModel
+    def updateUserCacheAllUsersAllRoles(self, applet, coordinator=None):
+        """
+        Mark every user's cached copy of an applet stale after it changed, and
+        queue them to be rebuilt (see
+        `girderformindlogger.utility.applet_cache_queue`). Users who read a
+        stale applet before then get it rebuilt first.
 
-        [self.updateUserCacheAllRoles(
-            UserModel().load(
-                id=ProfileModel().load(
-                    user['_id'],
-                    force=True
-                ).get('userId'),
-                force=True
-            )
-        ) for user in self.getAppletUsers(
-            applet,
-            coordinator
-        ).get('active', [])]
+        :param applet: applet
+        :type applet: dict
+        :param coordinator: unused; the applet is formatted as one of its
+            users in each role
+        :type coordinator: dict or None
+        """
+        from girderformindlogger.utility.applet_cache_queue import \
+            getAppletCacheQueue
+        from .user_applet_cache import UserAppletCache
 
-    def updateUserCacheAllRoles(self, user):
-        [self.updateUserCache(role, user) for role in list(USER_ROLES.keys())]
+        UserAppletCache().markStale(applet['_id'])
+        getAppletCacheQueue().enqueue(applet['_id'])
 
-    def updateUserCache(self, role, user, active=True, refreshCache=False):
-        import threading
-        from bson import json_util
-        from girderformindlogger.utility import jsonld_expander
+    def refreshUserCacheForApplet(self, appletId, batchSize=100):
+        """
+        Rebuild the stale UserAppletCache entries of an applet, formatting it
+        once per role, and bring its entries in line with its roles: users
+        who lost a role lose the applet, and users who gained one get it at
+        the end of their cached list.
 
-        applets=self.getAppletsForUser(role, user, active)
-        user['cached'] = user.get('cached', {})
-        user['cached'] = json_util.loads(user['cached']) if isinstance(
-            user['cached'], str
-        ) else user['cached']
-        user['cached']['applets'] = user['cached'].get('applets', {})
-        user['cached']['applets'][role] = user['cached']['applets'].get(
-            role,
-            {}
-        )
-        formatted = [
-            {
-                **jsonld_expander.formatLdObject(
-                    applet,
-                    'applet',
-                    user,
-                    refreshCache=refreshCache,
-                    responseDates=False
-                ),
-                "users": self.getAppletUsers(applet, user),
-                "groups": self.getAppletGroups(
-                    applet,
-                    arrayOfObjects=True
+        :param appletId: the applet's ID
+        :type appletId: ObjectId or str
+        :param batchSize: number of entries to write at a time
+        :type batchSize: int
+        :returns: int, the number of entries written
+        """
+        from .user_applet_cache import UserAppletCache
+
+        cache = UserAppletCache()
+        applet = self.load(appletId, force=True)
+        if applet is None or applet.get('meta', {}).get('applet', {}).get(
+            'deleted'
+        ):
+            cache.removeApplet(appletId)
+            return(0)
+        written = 0
+        for role in USER_ROLES.keys():
+            computed = datetime.datetime.utcnow()
+            groupIds = [
+                group.get('id') for roleName in (
+                    [role, 'manager'] if role=="coordinator" else [role]
+                ) for group in applet.get('roles', {}).get(
+                    roleName,
+                    {}
+                ).get('groups', [])
+            ]
+            entries = {
+                entry['userId']: entry for entry in cache.find(
+                    {'appletId': applet['_id'], 'role': role},
+                    fields={'userId': True, 'position': True, 'stale': True}
                 )
-            } if role in ["coordinator", "manager"] else {
-                **jsonld_expander.formatLdObject(
-                    applet,
-                    'applet',
-                    user,
-                    refreshCache=refreshCache,
-                    responseDates=(role=="user")
-                ),
-                "groups": [
-                    group for group in self.getAppletGroups(applet).get(
-                        role
-                    ) if ObjectId(
-                        group
-                    ) in [
-                        *user.get('groups', []),
-                        *user.get('formerGroups', []),
-                        *[invite['groupId'] for invite in [
-                            *user.get('groupInvites', []),
-                            *user.get('declinedInvites', [])
-                        ]]
+            }
+            members = {
+                member['_id']: member for member in UserModel().find(
+                    {'groups': {'$in': groupIds}},
+                    fields=[
+                        'groups',
+                        'formerGroups',
+                        'groupInvites',
+                        'declinedInvites'
                     ]
-                ]
-            } for applet in applets if (
+                )
+            } if groupIds else {}
+            gone = [userId for userId in entries if userId not in members]
+            if gone:
+                cache.removeWithQuery({
+                    'appletId': applet['_id'],
+                    'role': role,
+                    'userId': {'$in': gone}
+                })
+            # users without any cached applets for the role format them all
+            # when they next read them
+            positions = {
+                userId: entry['position'] for userId, entry in entries.items()
+                if entry.get('stale') and userId in members
+            }
+            positions.update(cache.nextPositions(
+                [userId for userId in members if userId not in entries],
+                role
+            ))
+            if not positions:
+                continue
+            userIds = list(positions.keys())
+            shared = self._formatForRole(
+                applet,
+                role,
+                UserModel().load(userIds[0], force=True)
+            )
+            for offset in range(0, len(userIds), batchSize):
+                batch = userIds[offset:offset + batchSize]
+                cache.setEntries([(
+                    userId,
+                    role,
+                    applet['_id'],
+                    positions[userId],
+                    self._formatForUserCache(
+                        applet,
+                        role,
+                        members[userId],
+                        shared=shared
+                    )
+                ) for userId in batch], computed)
+                written += len(batch)
+        return(written)
+
+    def updateUserCacheAllRoles(self, user, applets=None):
+        [self.updateUserCache(
+            role,
+            user,
+            applets=applets
+        ) for role in list(USER_ROLES.keys())]
+
+    def updateUserCache(
+        self,
+        role,
+        user,
+        active=True,
+        refreshCache=False,
+        applets=None
+    ):
+        """
+        Format a user's applets for a role and store them in the user's
+        UserAppletCache entries.
+
+        :param role: role
+        :type role: str
+        :param user: user
+        :type user: dict
+        :param active: only format active applets?
+        :type active: bool
+        :param refreshCache: reformat the applets from their sources?
+        :type refreshCache: bool
+        :param applets: only format these applets (or applet IDs), leaving the
+            user's other cached applets as they are, or None to format all of
+            them
+        :type applets: list or None
+        :returns: int, the number of applets cached; read them back with
+            `UserAppletCache().getApplets`
+        """
+        from .user_applet_cache import UserAppletCache
+
+        computed = datetime.datetime.utcnow()
+        userApplets = list(enumerate(self.getAppletsForUser(role, user, active)))
+        if applets is not None:
+            appletIds = {
+                ObjectId(applet['_id'] if isinstance(applet, dict) else applet)
+                for applet in applets
+            }
+            for appletId in appletIds - {
+                applet['_id'] for position, applet in userApplets
+            }:
+                # no longer one of the user's applets in this role
+                UserAppletCache().removeApplet(appletId, user['_id'], role)
+            userApplets = [
+                (position, applet) for position, applet in userApplets if (
+                    applet['_id'] in appletIds
+                )
+            ]
+        formatted = (
+            (
+                applet['_id'],
+                position,
+                self._formatForUserCache(applet, role, user, refreshCache)
+            ) for position, applet in userApplets if (
                 applet is not None and not applet.get(
                     'meta',
                     {}
@@ -452,14 +652,79 @@ class Applet(Folder):
                     {}
                 ).get('deleted')
             )
-        ]
-        user['cached']['applets'].update({role: formatted})
-        thread = threading.Thread(
-            target=UserModel().save,
-            args=(user,)
         )
-        thread.start()
-        return(formatted)
+        return(UserAppletCache().setApplets(
+            user['_id'],
+            role,
+            formatted,
+            computed,
+            complete=applets is None
+        ))
+
+    def _formatForRole(self, applet, role, user, refreshCache=False):
+        """
+        Format the part of a user's cached applet that is the same for every
+        user with a role.
+
+        :param user: any user with the role
+        :type user: dict
+        """
+        from girderformindlogger.utility import jsonld_expander
+
+        formatted = jsonld_expander.formatLdObject(
+            applet,
+            'applet',
+            user,
+            refreshCache=refreshCache,
+            responseDates=False
+        )
+        if role in ["coordinator", "manager"]:
+            return({
+                **formatted,
+                "users": self.getAppletUsers(applet, user),
+                "groups": self.getAppletGroups(
+                    applet,
+                    arrayOfObjects=True
+                )
+            })
+        return({
+            **formatted,
+            "groups": list(self.getAppletGroups(applet).get(role, {}))
+        })
+
+    def _formatForUserCache(
+        self,
+        applet,
+        role,
+        user,
+        refreshCache=False,
+        shared=None
+    ):
+        """
+        :param shared: the applet formatted by _formatForRole, if already
+            done for another user
+        :type shared: dict or None
+        """
+        if shared is None:
+            shared = self._formatForRole(applet, role, user, refreshCache)
+        if role in ["coordinator", "manager"]:
+            return(shared)
+        userGroups = [
+            *user.get('groups', []),
+            *user.get('formerGroups', []),
+            *[invite['groupId'] for invite in [
+                *user.get('groupInvites', []),
+                *user.get('declinedInvites', [])
+            ]]
+        ]
+        return({
+            **shared,
+            "groups": [
+                group for group in shared["groups"] if ObjectId(
+                    group
+                ) in userGroups
+            ]
+        })
 
     def getAppletsForUser(self, role, user, active=True):
         """
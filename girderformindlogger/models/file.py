@@ -26,6 +26,7 @@ class File(acl_mixin.AccessControlMixin, Model):
         self.ensureIndices(
             ['itemId', 'assetstoreId', 'exts']
             + assetstore_utilities.fileIndexFields())
+        self.ensureIndex(('hashPending', {'sparse': True}))
         self.ensureTextIndex({'name': 1})
         self.resourceColl = 'item'
         self.resourceParent = 'itemId'
@@ -39,6 +40,9 @@ class File(acl_mixin.AccessControlMixin, Model):
         events.bind('model.file.save.created',
                     CoreEventHandler.FILE_PROPAGATE_SIZE,
                     self._propagateSizeToItem)
+        events.bind('data.process',
+                    CoreEventHandler.FILE_HASH_PENDING,
+                    self._hashPendingFile)
 
     def remove(self, file, updateItemSize=True, **kwargs):
         """
@@ -358,6 +362,19 @@ class File(acl_mixin.AccessControlMixin, Model):
             item = Item().load(itemId, force=True)
             self.propagateSizeChange(item, fileDoc['size'])
 
+    def _hashPendingFile(self, event):
+        """
+        This callback computes the hash of a newly-created file that its
+        assetstore stored without one (see the ``zero_copy`` option of the
+        ``[filesystem_assetstore]`` config section). It runs in the event
+        daemon, after the upload request has returned.
+        """
+        fileDoc = event.info.get('file', {})
+        if fileDoc.get('hashPending') and fileDoc.get('assetstoreId'):
+            adapter = self.getAssetstoreAdapter(fileDoc)
+            if hasattr(adapter, 'hashPendingFile'):
+                adapter.hashPendingFile(fileDoc)
+
     def updateFile(self, file):
         """
         Call this when changing properties of an existing file, such as name
@@ -1,9 +1,10 @@
 # -*- coding: utf-8 -*-
 import datetime
 
-from .model_base import AccessControlledModel
+from .model_base import AccessControlledModel, _flagClauses
 from girderformindlogger import events
 from girderformindlogger.constants import AccessType, CoreEventHandler
+from girderformindlogger.utility import auth_cache
 from girderformindlogger.exceptions import ValidationException
 
 
@@ -52,6 +53,9 @@ class Group(AccessControlledModel):
         events.bind('model.group.save.created',
                     CoreEventHandler.GROUP_CREATOR_ACCESS,
                     self._grantCreatorAccess)
+        for eventName in ('model.group.save.after', 'model.group.remove'):
+            events.bind(eventName, CoreEventHandler.AUTH_CACHE_INVALIDATE,
+                        self._invalidateAuthCache)
 
     def validate(self, doc):
         doc['name'] = doc['name'].strip()
@@ -353,6 +357,10 @@ class Group(AccessControlledModel):
 
         return(self.save(group))
 
+    def _invalidateAuthCache(self, event):
+        # Removing a group pulls it from its members without saving them
+        auth_cache.getAuthCache().clear()
+
     def _grantCreatorAccess(self, event):
         """
         This callback makes the group creator an administrator member of the
@@ -476,7 +484,7 @@ class Group(AccessControlledModel):
                 )
             )
 
-    def permissionClauses(self, user=None, level=None, prefix=''):
+    def permissionClauses(self, user=None, level=None, prefix='', flags=None):
         permission = super(Group, self).permissionClauses(user, level, prefix)
         if user and level == AccessType.READ:
             permission['$or'].extend([
@@ -484,6 +492,9 @@ class Group(AccessControlledModel):
                 {prefix + '_id': {'$in': [i['groupId'] for i in
                                           user.get('groupInvites', [])]}},
             ])
+        flagClauses = _flagClauses(user, flags, prefix)
+        if flagClauses:
+            permission = {'$and': [permission] + flagClauses}
         return permission
 
     def getAccessLevel(self, doc, user):
@@ -30,7 +30,42 @@ _allowedFindArgs = ('cursor_type', 'allow_partial_results', 'oplog_replay',
 _modelSingletons = []
 
 
-def _permissionClauses(user=None, level=None, prefix=''):
+def _flagClauses(user=None, flags=None, prefix=''):
+    """
+    Given a user and a set of access flags, return a list of clauses that
+    match documents on which the user has every flag, in the same way as
+    AccessControlledModel.hasAccessFlags.
+
+    :param user: The user to check policies against.
+    :type user: dict or None
+    :param flags: A flag or set of flags to test.
+    :type flags: flag identifier, or a list/set/tuple of them
+    :param prefix: an optional string to prepend to the keys used in the
+        clauses.
+    :type prefix: str
+    :returns: A list of query dictionaries, all of which must match.
+    """
+    if not flags or (user and user['admin']):
+        return []
+    if not isinstance(flags, (list, tuple, set)):
+        flags = {flags}
+    clauses = []
+    for flag in sorted(set(flags)):
+        flagClause = [{prefix + 'publicFlags': flag}]
+        if user:
+            flagClause.extend([
+                {prefix + 'access.users': {'$elemMatch': {
+                    'id': user['_id'],
+                    'flags': flag}}},
+                {prefix + 'access.groups': {'$elemMatch': {
+                    'id': {'$in': user.get('groups', [])},
+                    'flags': flag}}},
+            ])
+        clauses.append({'$or': flagClause})
+    return clauses
+
+
+def _permissionClauses(user=None, level=None, prefix='', flags=None):
     """
     Given a user and access level, return a list of clauses that can be used as
     part of a Mongo find query or aggregate match step.
@@ -43,6 +78,8 @@ def _permissionClauses(user=None, level=None, prefix=''):
     :param prefix: an optional string to prepend to the keys used in the
         clauses.
     :type prefix: str
+    :param flags: An optional flag or set of flags that are also required.
+    :type flags: flag identifier, or a list/set/tuple of them
     :returns: A query dictionary with an '$or' entry which consists of a list
         of match clauses, any one of which implies validation.
     """
@@ -50,6 +87,9 @@ def _permissionClauses(user=None, level=None, prefix=''):
     if level is None or (user and user['admin']):
         # Without a level or with an admin user, match everything.
         return {}
+    flagClauses = _flagClauses(user, flags, prefix)
+    if flagClauses:
+        return {'$and': [_permissionClauses(user, level, prefix)] + flagClauses}
     if level <= AccessType.READ:
         permissionClauses.append({prefix + 'public': True})
     elif not user:
@@ -1903,6 +1943,10 @@ class AccessControlledModel(Model):
         results that the user has the given level of access and specified access flags on,
         respecting the limit and offset specified.
 
+        Every document up to the offset has to be read and checked, so prefer
+        :py:meth:`findWithPermissions`, which does the filtering and paging in
+        the database.
+
         :param cursor: The database cursor object from "find()".
         :param user: The user to check policies against.
         :type user: dict or None
@@ -2011,11 +2055,12 @@ class AccessControlledModel(Model):
             filters, offset=offset, limit=limit, sort=sort, fields=fields,
             user=user, level=level)
 
-    def permissionClauses(self, user=None, level=None, prefix=''):
-        return _permissionClauses(user, level, prefix)
+    def permissionClauses(self, user=None, level=None, prefix='', flags=None):
+        return _permissionClauses(user, level, prefix, flags)
 
     def findWithPermissions(self, query=None, offset=0, limit=0, timeout=None, fields=None,
-                            sort=None, user=None, level=AccessType.READ, **kwargs):
+                            sort=None, user=None, level=AccessType.READ, flags=None,
+                            **kwargs):
         """
         Search the collection by a set of parameters, only returning results
         that the combined user and level have permission to access. Passes any
@@ -2043,11 +2088,16 @@ class AccessControlledModel(Model):
         :param level: The access level.  Explicitly passing None skips doing
             permissions checks.
         :type level: AccessType
+        :param flags: Access flags that are also required.
+        :type flags: flag identifier, or a list/set/tuple of them
         :returns: A pymongo Cursor or CommandCursor.  If a CommandCursor, it
             has been augmented with a count function.
         """
         if level is not None and (not user or not user['admin']):
-            query = {'$and': [query or {}, self.permissionClauses(user, level)]}
+            query = {'$and': [
+                query or {},
+                self.permissionClauses(user, level, flags=flags)
+            ]}
         return self.find(
             query=query, offset=offset, limit=limit, timeout=timeout,
             fields=fields, sort=sort, **kwargs)
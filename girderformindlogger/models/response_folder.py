@@ -41,6 +41,19 @@ class ResponseItem(Item):
         self.name = 'item'
         self.ensureIndices(('folderId', 'name', 'lowerName',
                             ([('folderId', 1), ('name', 1)], {})))
+        # latest response per (user, applet, activity)
+        self.ensureIndex(([
+            ('baseParentId', 1),
+            ('meta.applet.@id', 1),
+            ('meta.activity.url', 1),
+            ('updated', -1)
+        ], {}))
+        # applet exports, newest first
+        self.ensureIndex(([
+            ('meta.applet.@id', 1),
+            ('created', -1),
+            ('_id', -1)
+        ], {}))
         self.ensureTextIndex({
             'name': 1,
             'description': 1
@@ -0,0 +1,244 @@
+# -*- coding: utf-8 -*-
+import datetime
+import isodate
+
+from girderformindlogger.models.model_base import Model
+from girderformindlogger.utility import config
+from pymongo import UpdateOne
+from pymongo.errors import BulkWriteError
+
+DEFAULT_ROLLUP_DAYS = 8
+
+
+class ResponseRollup(Model):
+    """
+    Running totals of the responses to each item, kept per (informant,
+    subject, applet, activity, item) so that a response's `allTime` and
+    `last7Days` aggregates don't require rescanning the informant's history.
+
+    Each key has one all-time document (`day` is None) with a count per
+    distinct value, and one document per day (`day` is an ISO date) with
+    that day's values and dates. Day documents expire after `rollup_days`
+    days (``[aggregation]`` config section).
+    """
+
+    KEY_FIELDS = ('informantId', 'subjectId', 'appletId', 'activityURL')
+
+    def initialize(self):
+        self.name = 'responseRollup'
+        self.ensureIndex(([
+            ('informantId', 1),
+            ('subjectId', 1),
+            ('appletId', 1),
+            ('activityURL', 1),
+            ('itemURI', 1),
+            ('day', 1)
+        ], {'unique': True}))
+        self.ensureIndex(('expires', {'expireAfterSeconds': 0}))
+
+    def validate(self, doc):
+        return doc
+
+    def rollupKey(self, response):
+        """
+        :param response: response item
+        :type response: dict
+        :returns: dict of the KEY_FIELDS
+        """
+        from girderformindlogger.utility.response import canonicalActivityURL
+
+        metadata = response.get('meta', {})
+        return({
+            'informantId': str(response.get('baseParentId')),
+            'subjectId': str(metadata.get('subject', {}).get('@id')),
+            'appletId': str(metadata.get('applet', {}).get('@id')),
+            'activityURL': canonicalActivityURL(
+                metadata.get('activity', {}).get('url')
+            )
+        })
+
+    def addResponse(self, response):
+        """
+        Add a response to the rollups of its items. Each response is only
+        counted once, however many times this is called. If the rollups
+        can't be written the response is released, so a later call (or a
+        rebuild) counts it.
+
+        :param response: response item, with its metadata already saved
+        :type response: dict
+        :returns: bool, whether the response was added
+        """
+        from girderformindlogger.models.response_folder import ResponseItem
+        from girderformindlogger.utility.cache_storage import encodeKey
+
+        responses = response.get('meta', {}).get('responses', {})
+        if not isinstance(responses, dict) or not responses:
+            return(False)
+        claimed = ResponseItem().collection.update_one(
+            {'_id': response['_id'], 'rolledUp': {'$ne': True}},
+            {'$set': {'rolledUp': True}}
+        )
+        if not claimed.modified_count:
+            return(False)
+        key = self.rollupKey(response)
+        updated = response.get('updated', datetime.datetime.utcnow())
+        expires = updated + datetime.timedelta(days=getRollupDays())
+        ops = []
+        for itemURI, value in responses.items():
+            valueKey = encodeKey(str(value))
+            ops.append(UpdateOne({**key, 'itemURI': itemURI, 'day': None}, {
+                '$inc': {'counts.{}'.format(valueKey): 1},
+                '$set': {'values.{}'.format(valueKey): _countedValue(value)},
+                '$min': {'firstResponse': updated},
+                '$max': {'lastResponse': updated}
+            }, upsert=True))
+            ops.append(UpdateOne({
+                **key,
+                'itemURI': itemURI,
+                'day': updated.date().isoformat()
+            }, {
+                '$push': {'responses': {'value': value, 'date': updated}},
+                '$max': {'expires': expires}
+            }, upsert=True))
+        try:
+            self._bulkUpsert(ops)
+        except Exception:
+            ResponseItem().collection.update_one(
+                {'_id': response['_id']},
+                {'$unset': {'rolledUp': True}}
+            )
+            raise
+        return(True)
+
+    def aggregates(self, response, endDate, startDate):
+        """
+        Build a response's aggregates from the rollups of its key, in the
+        format of `girderformindlogger.utility.response.aggregate`.
+
+        :param response: response item
+        :type response: dict
+        :param endDate: end of both aggregates, naïve UTC
+        :type endDate: datetime
+        :param startDate: start of `last7Days`, naïve UTC
+        :type startDate: datetime
+        :returns: 2-tuple of (last7Days, allTime) dicts (or None if there
+            are no responses in range)
+        """
+        key = self.rollupKey(response)
+        rollups = list(self.find({
+            **key,
+            '$or': [
+                {'day': None},
+                {'day': {'$gte': startDate.date().isoformat()}}
+            ]
+        }))
+        allTime = [rollup for rollup in rollups if rollup.get('day') is None]
+        recent = {}
+        for rollup in rollups:
+            if rollup.get('day') is not None:
+                recent.setdefault(rollup['itemURI'], []).extend([
+                    entry for entry in rollup.get('responses', []) if (
+                        startDate <= entry['date'] < endDate
+                    )
+                ])
+        recent = {
+            itemURI: sorted(entries, key=lambda entry: entry['date'])
+            for itemURI, entries in recent.items() if entries
+        }
+        last7Days = {
+            "schema:startDate": startDate,
+            "schema:endDate": endDate,
+            "schema:duration": isodate.duration_isoformat(endDate - startDate),
+            "responses": recent
+        } if recent else None
+        firstResponse = min([
+            rollup['firstResponse'] for rollup in allTime
+        ], default=None)
+        allTimeAggregate = {
+            "schema:startDate": firstResponse,
+            "schema:endDate": endDate,
+            "schema:duration": isodate.duration_isoformat(
+                endDate - firstResponse
+            ),
+            "responses": {
+                rollup['itemURI']: [
+                    {
+                        "value": rollup.get('values', {}).get(valueKey),
+                        "count": count
+                    } for valueKey, count in sorted(
+                        rollup.get('counts', {}).items(),
+                        key=lambda valueCount: -valueCount[1]
+                    )
+                ] for rollup in allTime
+            }
+        } if firstResponse is not None else None
+        return(last7Days, allTimeAggregate)
+
+    def rebuild(self, appletId=None):
+        """
+        Recompute rollups from the stored responses.
+
+        :param appletId: only rebuild this applet's rollups, or all if None
+        :type appletId: str or ObjectId or None
+        :returns: int, number of responses rolled up
+        """
+        from girderformindlogger.models.response_folder import ResponseItem
+        from girderformindlogger.utility.response import string_or_ObjectID
+
+        query = {
+            'baseParentType': 'user',
+            'meta.responses': {'$exists': True}
+        }
+        if appletId is not None:
+            query['meta.applet.@id'] = {'$in': string_or_ObjectID(appletId)}
+            self.removeWithQuery({'appletId': str(appletId)})
+        else:
+            self.collection.delete_many({})
+        ResponseItem().update(query, {'$unset': {'rolledUp': True}})
+        count = 0
+        for response in ResponseItem().collection.find(query, {
+            'baseParentId': True,
+            'updated': True,
+            'meta.applet': True,
+            'meta.activity': True,
+            'meta.subject': True,
+            'meta.responses': True
+        }, no_cursor_timeout=True):
+            count += int(self.addResponse(response))
+        return(count)
+
+    def _bulkUpsert(self, ops):
+        try:
+            self.collection.bulk_write(ops, ordered=False)
+        except BulkWriteError as e:
+            # concurrent upserts of a new key collide on the unique index;
+            # the losing operations can simply be applied again
+            errors = e.details.get('writeErrors', [])
+            if not errors or any(error.get('code') != 11000 for error in errors):
+                raise
+            self.collection.bulk_write(
+                [ops[error['index']] for error in errors],
+                ordered=False
+            )
+
+
+def getRollupDays():
+    """
+    Function to get how many days of per-day rollups to keep from the
+    `rollup_days` option in the ``[aggregation]`` config section.
+
+    :returns: int
+    """
+    try:
+        return(max(8, int(config.getConfig().get('aggregation', {}).get(
+            'rollup_days',
+            DEFAULT_ROLLUP_DAYS
+        ))))
+    except (TypeError, ValueError):
+        return(DEFAULT_ROLLUP_DAYS)
+
+
+def _countedValue(value):
+    # `countResponseValues` counted numbers as numbers and anything else by
+    # its string form
+    return(value if isinstance(value, (int, float)) else str(value))
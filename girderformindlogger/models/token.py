@@ -2,10 +2,11 @@
 import datetime
 import six
 
-from girderformindlogger.constants import AccessType, TokenScope
+from girderformindlogger import events
+from girderformindlogger.constants import AccessType, CoreEventHandler, TokenScope
 from girderformindlogger.exceptions import AccessException
 from girderformindlogger.settings import SettingKey
-from girderformindlogger.utility import genToken
+from girderformindlogger.utility import auth_cache, genToken
 from .model_base import AccessControlledModel
 
 
@@ -19,11 +20,18 @@ class Token(AccessControlledModel):
         self.ensureIndex(('expires', {'expireAfterSeconds': 0}))
         self.ensureIndex('apiKeyId')
 
+        for eventName in ('model.token.save.after', 'model.token.remove'):
+            events.bind(eventName, CoreEventHandler.AUTH_CACHE_INVALIDATE,
+                        self._invalidateAuthCache)
+
     def validate(self, doc):
         # Remove any duplicate scopes
         doc['scope'] = list(set(doc['scope']))
         return doc
 
+    def _invalidateAuthCache(self, event):
+        auth_cache.getAuthCache().invalidateToken(event.info['_id'])
+
     def createToken(self, user=None, days=None, scope=None, apiKey=None):
         """
         Creates a new token. You can create an anonymous token
@@ -11,6 +11,9 @@ from girderformindlogger.settings import SettingKey
 from girderformindlogger.utility import RequestBodyStream
 from girderformindlogger.utility.progress import noProgress
 
+# Number of files that Upload.uploadFromFiles streams at once
+UPLOAD_WORKERS = 4
+
 
 class Upload(Model):
     """
@@ -96,6 +99,147 @@ class Upload(Model):
 
         return upload
 
+    def uploadFromFiles(self, files, parentType=None, parent=None, user=None,
+                        reference=None, assetstore=None, attachParent=False,
+                        workers=UPLOAD_WORKERS):
+        """
+        Batch version of :py:meth:`uploadFromFile` for several files going to
+        the same parent. The contents are streamed to the assetstore
+        concurrently, files no larger than one chunk are passed to the
+        assetstore without being copied into memory first, and the upload
+        records are never saved. The file documents are created with a single
+        insert, and sizes are propagated once per item rather than once per
+        file. Example:
+
+        .. code-block:: python
+
+            Upload().uploadFromFiles([
+                {'obj': f, 'size': size, 'name': name, 'mimeType': mimeType}
+                for (f, size, name, mimeType) in blobs
+            ], 'item', parentItem, user)
+
+        The "model.upload.finalize", "model.file.finalizeUpload.before",
+        "model.file.finalizeUpload.after" and "data.process" events are
+        triggered for each file; the "model.file.save" events are not.
+
+        :param files: The files to upload. Each is a dict with the file-like
+            'obj' to read, its 'size', the 'name' of the file to create and
+            optionally its 'mimeType'.
+        :type files: list of dict
+        :param parentType: The type of the parent: "folder" or "item".
+        :type parentType: str
+        :param parent: The parent (item or folder) to upload into.
+        :type parent: dict
+        :param user: The user who is creating the files.
+        :type user: dict
+        :param reference: An optional reference string that will be sent to the
+            data.process event.
+        :type reference: str
+        :param assetstore: An optional assetstore to use to store the files.
+            If unspecified, the current assetstore is used.
+        :param attachParent: see :py:meth:`uploadFromFile`.
+        :type attachParent: boolean
+        :param workers: The maximum number of files to stream at once.
+        :type workers: int
+        :returns: The created file documents, in the order of `files`.
+        """
+        from concurrent.futures import ThreadPoolExecutor
+        from .assetstore import Assetstore
+        from .file import File
+        from .item import Item
+        from girderformindlogger.utility import assetstore_utilities
+
+        if not files:
+            return []
+
+        uploads = [self.createUpload(
+            user=user, name=f['name'], parentType=parentType, parent=parent,
+            size=f['size'], mimeType=f.get('mimeType'), reference=reference,
+            assetstore=assetstore, attachParent=attachParent, save=False
+        ) for f in files]
+        assetstores = {
+            assetstoreId: Assetstore().load(assetstoreId)
+            for assetstoreId in set(upload['assetstoreId'] for upload in uploads)
+        }
+        # The greater of 32 MB or the the upload minimum chunk size.
+        chunkSize = self._getChunkSize()
+
+        def stream(upload, obj):
+            adapter = assetstore_utilities.getAssetstoreAdapter(
+                assetstores[upload['assetstoreId']])
+            if 0 < upload['size'] <= chunkSize:
+                # A single chunk can be read straight from the source.
+                return adapter.uploadChunk(
+                    upload, RequestBodyStream(obj, upload['size']))
+            while upload['received'] < upload['size']:
+                data = obj.read(chunkSize)
+                if not data:
+                    break
+                upload = adapter.uploadChunk(
+                    upload, RequestBodyStream(six.BytesIO(data), len(data)))
+            return upload
+
+        try:
+            with ThreadPoolExecutor(max_workers=max(
+                    1, min(workers, len(uploads)))) as pool:
+                uploads = list(pool.map(
+                    stream, uploads, [f['obj'] for f in files]))
+            for upload in uploads:
+                if upload['received'] != upload['size']:
+                    raise ValidationException(
+                        'Received too few bytes for %s.' % upload['name'])
+        except Exception:
+            for upload in uploads:
+                assetstore_utilities.getAssetstoreAdapter(
+                    assetstores[upload['assetstoreId']]).cancelUpload(upload)
+            raise
+
+        items = {}
+        finalized = []
+        for upload in uploads:
+            events.trigger('model.upload.finalize', upload)
+            assetstore = assetstores[upload['assetstoreId']]
+            file = self._createUploadFile(upload, assetstore, items)
+            file = assetstore_utilities.getAssetstoreAdapter(
+                assetstore).finalizeUpload(upload, file)
+            event_document = {'file': file, 'upload': upload}
+            events.trigger('model.file.finalizeUpload.before', event_document)
+            finalized.append(event_document)
+
+        fileModel = File()
+        fileModel.collection.insert_many([
+            fileModel.validate(doc['file']) for doc in finalized])
+
+        sizes = {}
+        for doc in finalized:
+            if doc['file'].get('itemId') and doc['file'].get('size'):
+                itemId = doc['file']['itemId']
+                sizes[itemId] = sizes.get(itemId, 0) + doc['file']['size']
+        for itemId, size in six.viewitems(sizes):
+            item = items.get(itemId) or Item().load(itemId, force=True)
+            fileModel.propagateSizeChange(item, size)
+
+        currentToken = rest.getCurrentToken()
+        currentUser = rest.getCurrentUser()
+        for doc in finalized:
+            file, upload = doc['file'], doc['upload']
+            events.trigger('model.file.finalizeUpload.after', doc)
+            logger.info('Upload complete. File=%s User=%s' % (
+                file['_id'], upload['userId']))
+
+            # Add an async event for handlers that wish to process this file.
+            eventParams = {
+                'file': file,
+                'assetstore': assetstores[upload['assetstoreId']],
+                'currentToken': currentToken,
+                'currentUser': currentUser
+            }
+            if 'reference' in upload:
+                eventParams['reference'] = upload['reference']
+            events.daemon.trigger('data.process', eventParams)
+
+        return [doc['file'] for doc in finalized]
+
     def validate(self, doc):
         if doc['size'] < 0:
             raise ValidationException('File size must not be negative.')
@@ -200,26 +344,7 @@ class Upload(Model):
                 file['imported'] = False
 
         else:  # Creating a new file record
-            if upload.get('attachParent'):
-                item = None
-            elif upload['parentType'] == 'folder':
-                # Create a new item with the name of the file.
-                item = Item().createItem(
-                    name=upload['name'], creator={'_id': upload['userId']},
-                    folder={'_id': upload['parentId']})
-            elif upload['parentType'] == 'item':
-                item = Item().load(id=upload['parentId'], force=True)
-            else:
-                item = None
-
-            file = File().createFile(
-                item=item, name=upload['name'], size=upload['size'],
-                creator={'_id': upload['userId']}, assetstore=assetstore,
-                mimeType=upload['mimeType'], saveFile=False)
-            if upload.get('attachParent'):
-                if upload['parentType'] and upload['parentId']:
-                    file['attachedToType'] = upload['parentType']
-                    file['attachedToId'] = upload['parentId']
+            file = self._createUploadFile(upload, assetstore)
 
         adapter = assetstore_utilities.getAssetstoreAdapter(assetstore)
         file = adapter.finalizeUpload(upload, file)
@@ -247,6 +372,50 @@ class Upload(Model):
 
         return file
 
+    def _createUploadFile(self, upload, assetstore, items=None):
+        """
+        Create (without saving) the file record of a new upload, creating its
+        item first if the upload is into a folder.
+
+        :param upload: The upload document.
+        :type upload: dict
+        :param assetstore: The containing assetstore for the upload.
+        :type assetstore: dict
+        :param items: Optional cache of parent items by ID, shared by the
+            uploads of a batch.
+        :type items: dict or None
+        :returns: The unsaved file document.
+        """
+        from .file import File
+        from .item import Item
+
+        if upload.get('attachParent'):
+            item = None
+        elif upload['parentType'] == 'folder':
+            # Create a new item with the name of the file.
+            item = Item().createItem(
+                name=upload['name'], creator={'_id': upload['userId']},
+                folder={'_id': upload['parentId']})
+        elif upload['parentType'] == 'item':
+            if items is not None and upload['parentId'] in items:
+                item = items[upload['parentId']]
+            else:
+                item = Item().load(id=upload['parentId'], force=True)
+                if items is not None:
+                    items[upload['parentId']] = item
+        else:
+            item = None
+
+        file = File().createFile(
+            item=item, name=upload['name'], size=upload['size'],
+            creator={'_id': upload['userId']}, assetstore=assetstore,
+            mimeType=upload['mimeType'], saveFile=False)
+        if upload.get('attachParent'):
+            if upload['parentType'] and upload['parentId']:
+                file['attachedToType'] = upload['parentType']
+                file['attachedToId'] = upload['parentId']
+        return file
+
     def getTargetAssetstore(self, modelType, resource, assetstore=None):
         """
         Get the assetstore for a particular target resource, i.e. where new
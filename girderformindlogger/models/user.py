@@ -10,7 +10,7 @@ from girderformindlogger import events
 from girderformindlogger.constants import AccessType, CoreEventHandler, TokenScope
 from girderformindlogger.exceptions import AccessException, ValidationException
 from girderformindlogger.settings import SettingKey
-from girderformindlogger.utility import config, mail_utils
+from girderformindlogger.utility import auth_cache, config, mail_utils
 from girderformindlogger.utility._cache import rateLimitBuffer
 from .model_base import AccessControlledModel
 from .setting import Setting
@@ -53,6 +53,9 @@ class User(AccessControlledModel):
         events.bind('model.user.save.created',
                     CoreEventHandler.USER_DEFAULT_FOLDERS,
                     self._addDefaultFolders)
+        for eventName in ('model.user.save.after', 'model.user.remove'):
+            events.bind(eventName, CoreEventHandler.AUTH_CACHE_INVALIDATE,
+                        self._invalidateAuthCache)
 
     def validate(self, doc):
         """
@@ -277,15 +280,11 @@ class User(AccessControlledModel):
         :param sort: The sort structure to pass to pymongo.
         :returns: Iterable of users.
         """
-        # Perform the find; we'll do access-based filtering of the result set
-        # afterward.
         if text is not None:
-            cursor = self.textSearch(text, sort=sort)
-        else:
-            cursor = self.find({}, sort=sort)
-
-        return self.filterResultsByPermission(
-            cursor=cursor, user=user, level=AccessType.READ, limit=limit,
+            return self.textSearch(
+                text, user=user, limit=limit, offset=offset, sort=sort)
+        return self.findWithPermissions(
+            {}, sort=sort, user=user, level=AccessType.READ, limit=limit,
             offset=offset)
 
     def hasPassword(self, user):
@@ -522,6 +521,9 @@ class User(AccessControlledModel):
             text,
             [user.get('email')])
 
+    def _invalidateAuthCache(self, event):
+        auth_cache.getAuthCache().invalidateUser(event.info['_id'])
+
     def _grantSelfAccess(self, event):
         """
         This callback grants a user admin access to itself.
@@ -0,0 +1,218 @@
+# -*- coding: utf-8 -*-
+import datetime
+
+from bson.objectid import ObjectId
+from girderformindlogger.models.model_base import Model
+from pymongo import DeleteMany, UpdateOne
+from pymongo.errors import BulkWriteError
+
+BATCH_SIZE = 100
+
+
+class UserAppletCache(Model):
+    """
+    Formatted applets for `GET /user/applets`, one document per (user, role,
+    applet), so that refreshing one applet doesn't rewrite a user's whole
+    list and loading a user doesn't load the list.
+
+    Each entry has a `position` in the user's list for that role, the stored
+    `formatted` applet (see `girderformindlogger.utility.cache_storage`), a
+    `version` counting its writes and `computed`, when the formatting that
+    produced it started. A write only replaces an entry computed no later
+    than itself, so a slow refresh can't overwrite a newer one.
+
+    When an applet changes, its entries are marked `stale` rather than
+    rebuilt for every user at once (see
+    `girderformindlogger.utility.applet_cache_queue`). Marking an entry
+    also moves its `computed` forward, so a refresh that started before the
+    change can't clear the mark.
+    """
+
+    def initialize(self):
+        self.name = 'userAppletCache'
+        self.ensureIndex(([
+            ('userId', 1),
+            ('role', 1),
+            ('appletId', 1)
+        ], {'unique': True}))
+        self.ensureIndex(([('userId', 1), ('role', 1), ('position', 1)], {}))
+        self.ensureIndex(([('appletId', 1), ('role', 1)], {}))
+
+    def validate(self, doc):
+        return(doc)
+
+    def getApplets(self, userId, role):
+        """
+        Get a user's cached applets for a role, in order.
+
+        :param userId: the user's ID
+        :type userId: ObjectId or str
+        :param role: role
+        :type role: str
+        :returns: generator of formatted applets
+        """
+        from girderformindlogger.utility.cache_storage import parseCache
+
+        for entry in self.find(
+            {'userId': ObjectId(userId), 'role': role},
+            fields={'formatted': True},
+            sort=[('position', 1)]
+        ):
+            yield(parseCache(entry['formatted']))
+
+    def hasApplets(self, userId, role):
+        """
+        :returns: bool, whether a user has any cached applets for a role
+        """
+        return(self.findOne(
+            {'userId': ObjectId(userId), 'role': role},
+            fields={'_id': True}
+        ) is not None)
+
+    def setApplets(self, userId, role, formatted, computed, complete=True):
+        """
+        Store formatted applets for a user and role, `BATCH_SIZE` at a time,
+        so the applets being formatted don't all have to be held at once.
+
+        :param userId: the user's ID
+        :type userId: ObjectId or str
+        :param role: role
+        :type role: str
+        :param formatted: (applet ID, position, formatted applet) tuples
+        :type formatted: iterable
+        :param computed: when the formatting started, naïve UTC
+        :type computed: datetime
+        :param complete: whether `formatted` is the whole list for the role,
+            so any other applets cached for it are removed
+        :type complete: bool
+        :returns: int, the number of applets stored
+        """
+        from girderformindlogger.utility.export import chunked
+
+        userId = ObjectId(userId)
+        appletIds = []
+        for batch in chunked(formatted, BATCH_SIZE):
+            self._bulkWrite(self._upserts([
+                (userId, role, appletId, position, applet)
+                for appletId, position, applet in batch
+            ], computed))
+            appletIds += [ObjectId(appletId) for appletId, _, _ in batch]
+        if complete:
+            self._bulkWrite([DeleteMany({
+                'userId': userId,
+                'role': role,
+                'appletId': {'$nin': appletIds},
+                'computed': {'$lte': computed}
+            })])
+        return(len(appletIds))
+
+    def setEntries(self, entries, computed):
+        """
+        Store formatted applets for any users and roles.
+
+        :param entries: (user ID, role, applet ID, position, formatted applet)
+            tuples
+        :type entries: list
+        :param computed: when the formatting started, naïve UTC
+        :type computed: datetime
+        """
+        self._bulkWrite(self._upserts(entries, computed))
+
+    def markStale(self, appletId):
+        """
+        Mark every cached entry of an applet stale.
+
+        :param appletId: the applet's ID
+        :type appletId: ObjectId or str
+        :returns: int, the number of entries marked
+        """
+        return(self.collection.update_many(
+            {'appletId': ObjectId(appletId)},
+            {'$set': {
+                'stale': True,
+                'computed': datetime.datetime.utcnow()
+            }}
+        ).modified_count)
+
+    def getStaleAppletIds(self, userId, role):
+        """
+        :returns: list of the IDs of a user's stale applets for a role
+        """
+        return([entry['appletId'] for entry in self.find(
+            {'userId': ObjectId(userId), 'role': role, 'stale': True},
+            fields={'appletId': True}
+        )])
+
+    def nextPositions(self, userIds, role):
+        """
+        Get the position after the last cached applet of each of some users
+        for a role.
+
+        :param userIds: the users' IDs
+        :type userIds: list
+        :param role: role
+        :type role: str
+        :returns: dict of position by user ID, for the users that have any
+            applets cached for the role
+        """
+        return({
+            group['_id']: group['position'] + 1
+            for group in self.collection.aggregate([
+                {'$match': {
+                    'userId': {'$in': [ObjectId(userId) for userId in userIds]},
+                    'role': role
+                }},
+                {'$group': {'_id': '$userId', 'position': {'$max': '$position'}}}
+            ])
+        })
+
+    def removeApplet(self, appletId, userId=None, role=None):
+        """
+        Remove the cached entries of an applet.
+
+        :param appletId: the applet's ID
+        :type appletId: ObjectId or str
+        :param userId: only remove this user's entries
+        :type userId: ObjectId, str or None
+        :param role: only remove the entries for this role
+        :type role: str or None
+        """
+        query = {'appletId': ObjectId(appletId)}
+        if userId is not None:
+            query['userId'] = ObjectId(userId)
+        if role is not None:
+            query['role'] = role
+        self.removeWithQuery(query)
+
+    def _upserts(self, entries, computed):
+        from girderformindlogger.utility.cache_storage import dumpCache
+
+        now = datetime.datetime.utcnow()
+        return([UpdateOne({
+            'userId': ObjectId(userId),
+            'role': role,
+            'appletId': ObjectId(appletId),
+            'computed': {'$lte': computed}
+        }, {
+            '$set': {
+                'position': position,
+                'formatted': dumpCache(applet),
+                'computed': computed,
+                'updated': now,
+                'stale': False
+            },
+            '$inc': {'version': 1}
+        }, upsert=True) for userId, role, appletId, position, applet in entries])
+
+    def _bulkWrite(self, ops):
+        if not ops:
+            return
+        try:
+            self.collection.bulk_write(ops, ordered=False)
+        except BulkWriteError as e:
+            # An upsert whose filter doesn't match because the entry was
+            # computed later collides with it on the unique index; the newer
+            # entry stays
+            errors = e.details.get('writeErrors', [])
+            if not errors or any(error.get('code') != 11000 for error in errors):
+                raise
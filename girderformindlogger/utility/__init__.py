@@ -7,7 +7,6 @@ import json
 import os
 import pytz
 import re
-import requests
 import string
 import six
 
@@ -101,11 +100,11 @@ def firstLower(value):
 
 def loadJSON(url, urlType='protocol'):
     from girderformindlogger.exceptions import ValidationException
+    from girderformindlogger.utility.document_loader import getDocumentLoader
 
     print("Loading {} from {}".format(urlType, url))
     try:
-        r = requests.get(url)
-        data = r.json()
+        data = getDocumentLoader().loadJSON(url)
     except:
         return({})
         raise ValidationException(
@@ -0,0 +1,151 @@
+# -*- coding: utf-8 -*-
+"""
+Background computation of the ``last7Days`` and ``allTime`` aggregates that
+are saved on each response.
+
+``POST /response`` used to call ``aggregateAndSave`` before returning, which
+rescans the respondent's whole history for the activity. Responses are now
+handed to :py:func:`getAggregationQueue`, whose worker threads aggregate them
+after the request has returned. Submissions for the same (informant, applet,
+activity, subject) that arrive before a worker gets to them are coalesced:
+the aggregates of the newest response of a burst are computed once and saved
+on every response of the burst.
+
+Options are read from the ``[aggregation]`` config section:
+
+- ``background``: aggregate on worker threads (``False`` aggregates inline)
+- ``workers``: number of worker threads
+"""
+import threading
+
+from girderformindlogger.utility import config
+from girderformindlogger.utility.coalescing_queue import CoalescingQueue
+
+DEFAULT_WORKERS = 2
+
+_queue = None
+_queueLock = threading.Lock()
+
+
+def aggregationKey(item):
+    """
+    :param item: response item
+    :type item: dict
+    :returns: tuple of (informant, applet, activity URL, subject) strings
+    """
+    metadata = item.get('meta', {})
+    return(tuple(str(value) for value in (
+        item.get('baseParentId'),
+        metadata.get('applet', {}).get('@id'),
+        metadata.get('activity', {}).get('url'),
+        metadata.get('subject', {}).get('@id')
+    )))
+
+
+def aggregateResponses(task):
+    """
+    Compute the aggregates of the newest of a burst of queued responses and
+    save them on each of them.
+
+    :param task: the response items' IDs, oldest first, and the informant's
+        ID
+    :type task: dict
+    """
+    from girderformindlogger.models.response_folder import ResponseItem
+    from girderformindlogger.models.response_rollup import ResponseRollup
+    from girderformindlogger.utility.response import aggregateAndSave
+
+    items = {item['_id']: item for item in ResponseItem().find({
+        '_id': {'$in': task['itemIds']}
+    })}
+    items = [items[itemId] for itemId in task['itemIds'] if itemId in items]
+    if not items:
+        return
+    for item in items[:-1]:
+        # no-op unless rolling it up failed when it was submitted
+        ResponseRollup().addResponse(item)
+    metadata = aggregateAndSave(items[-1], task['informantId']).get('meta', {})
+    if len(items) > 1:
+        ResponseItem().update({
+            '_id': {'$in': [item['_id'] for item in items[:-1]]}
+        }, {'$set': {
+            'meta.last7Days': metadata.get('last7Days'),
+            'meta.allTime': metadata.get('allTime')
+        }})
+
+
+class AggregationQueue(CoalescingQueue):
+    """
+    Coalescing work queue of responses to aggregate.
+    """
+
+    def __init__(self, workers=DEFAULT_WORKERS, background=True):
+        """
+        :param workers: number of worker threads
+        :type workers: int
+        :param background: aggregate on worker threads rather than inline
+        :type background: bool
+        """
+        super(AggregationQueue, self).__init__(
+            aggregateResponses,
+            'response aggregation',
+            workers=workers,
+            background=background
+        )
+
+    def enqueue(self, item, informant):
+        """
+        Schedule the aggregates of a response to be computed and saved.
+
+        :param item: response item, with its metadata already saved
+        :type item: dict
+        :param informant: User who responded, or their ID
+        :type informant: dict or ObjectId
+        """
+        self.put(aggregationKey(item), {
+            'itemIds': [item['_id']],
+            'informantId': informant.get('_id') if isinstance(
+                informant,
+                dict
+            ) else informant
+        })
+
+    def coalesce(self, pending, task):
+        """
+        Aggregate the newest response once, for every response queued so far.
+        """
+        return(dict(
+            task,
+            itemIds=pending['itemIds'] + task['itemIds'],
+            enqueued=pending['enqueued']
+        ))
+
+
+def getAggregationQueue():
+    """
+    Get the process-wide AggregationQueue, configured from the
+    ``[aggregation]`` config section on first use.
+
+    :returns: AggregationQueue
+    """
+    global _queue
+
+    if _queue is None:
+        with _queueLock:
+            if _queue is None:
+                from girderformindlogger.utility import toBool
+
+                cfg = config.getConfig().get('aggregation', {})
+                _queue = AggregationQueue(
+                    workers=int(cfg.get('workers', DEFAULT_WORKERS)),
+                    background=toBool(cfg.get('background', True))
+                )
+    return(_queue)
+
+
+def stopAggregationQueue():
+    """
+    Aggregate any queued responses and stop the workers, e.g. at shutdown.
+    """
+    if _queue is not None:
+        _queue.stop()
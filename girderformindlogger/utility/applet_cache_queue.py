@@ -0,0 +1,110 @@
+# -*- coding: utf-8 -*-
+"""
+Background rebuilding of the UserAppletCache entries of changed applets.
+
+Changing an applet used to reformat it for every active user of the applet,
+in every role, one user at a time. ``Applet().updateUserCacheAllUsersAllRoles``
+now only marks the applet's entries stale and hands the applet to
+:py:func:`getAppletCacheQueue`, whose worker threads rebuild the entries with
+``Applet().refreshUserCacheForApplet``, formatting the applet once per role.
+Changes to the same applet that arrive before a worker gets to it are
+coalesced. Stale entries are also rebuilt when their user reads them, so a
+user never gets an applet that changed after it was cached.
+
+Options are read from the ``[user_applet_cache]`` config section:
+
+- ``background``: rebuild on worker threads (``False`` rebuilds inline)
+- ``workers``: number of worker threads
+- ``batch_size``: number of entries to write at a time
+"""
+import threading
+
+from girderformindlogger.utility import config
+from girderformindlogger.utility.coalescing_queue import CoalescingQueue
+
+DEFAULT_WORKERS = 1
+DEFAULT_BATCH_SIZE = 100
+
+_queue = None
+_queueLock = threading.Lock()
+
+
+class AppletCacheQueue(CoalescingQueue):
+    """
+    Coalescing work queue of applets whose cached entries are stale. Applets
+    still queued at shutdown are dropped; their entries stay stale and are
+    rebuilt when they are read.
+    """
+
+    def __init__(
+        self,
+        workers=DEFAULT_WORKERS,
+        background=True,
+        batchSize=DEFAULT_BATCH_SIZE
+    ):
+        """
+        :param workers: number of worker threads
+        :type workers: int
+        :param background: rebuild on worker threads rather than inline
+        :type background: bool
+        :param batchSize: number of entries to write at a time
+        :type batchSize: int
+        """
+        super(AppletCacheQueue, self).__init__(
+            self._refresh,
+            'user applet cache',
+            workers=workers,
+            background=background,
+            drainOnStop=False,
+            counters=('entries',)
+        )
+        self.batchSize = max(1, int(batchSize))
+
+    def enqueue(self, appletId):
+        """
+        Schedule the stale entries of an applet to be rebuilt. One rebuild
+        covers every change queued so far.
+
+        :param appletId: the applet's ID
+        :type appletId: ObjectId or str
+        """
+        self.put(str(appletId), {'appletId': appletId})
+
+    def _refresh(self, task):
+        from girderformindlogger.models.applet import Applet
+
+        return({'entries': Applet().refreshUserCacheForApplet(
+            task['appletId'],
+            batchSize=self.batchSize
+        )})
+
+
+def getAppletCacheQueue():
+    """
+    Get the process-wide AppletCacheQueue, configured from the
+    ``[user_applet_cache]`` config section on first use.
+
+    :returns: AppletCacheQueue
+    """
+    global _queue
+
+    if _queue is None:
+        with _queueLock:
+            if _queue is None:
+                from girderformindlogger.utility import toBool
+
+                cfg = config.getConfig().get('user_applet_cache', {})
+                _queue = AppletCacheQueue(
+                    workers=int(cfg.get('workers', DEFAULT_WORKERS)),
+                    background=toBool(cfg.get('background', True)),
+                    batchSize=int(cfg.get('batch_size', DEFAULT_BATCH_SIZE))
+                )
+    return(_queue)
+
+
+def stopAppletCacheQueue():
+    """
+    Stop the workers, e.g. at shutdown.
+    """
+    if _queue is not None:
+        _queue.stop()
@@ -0,0 +1,178 @@
+# -*- coding: utf-8 -*-
+"""
+Short-lived, process-wide cache of request authentication.
+
+Every authenticated request loads its token, and access checks need the
+requesting user's ``admin``, ``groups`` and ``status``. The user document
+also holds large fields (such as ``cached``) that access checks never read,
+so :py:func:`girderformindlogger.api.rest.getCurrentUserCore` resolves a
+token to just :py:data:`AUTH_USER_FIELDS` through an :py:class:`AuthCache`.
+
+Entries are keyed by token ID. They are dropped when their token or user is
+saved or removed, when any group is saved or removed, and in any case after
+``auth_cache_ttl`` seconds (``[server]`` config section), which bounds how
+long another server process can act on a stale entry. Setting the TTL or
+``auth_cache_size`` to 0 disables the cache.
+"""
+import threading
+import time
+
+from collections import OrderedDict
+from copy import deepcopy
+from girderformindlogger.utility import config
+
+# Fields of a user document that access checks read, besides `_id`; Group's
+# access checks also read `groupInvites`
+AUTH_USER_FIELDS = ('admin', 'groups', 'groupInvites', 'status',
+                    'emailVerified', 'login')
+DEFAULT_TTL = 10
+DEFAULT_SIZE = 10000
+
+_cache = None
+_cacheLock = threading.Lock()
+
+
+class AuthCache(object):
+    """
+    Thread-safe LRU cache of (token, user core) pairs by token ID, whose
+    entries expire after `ttl` seconds. Values are copied in and out so
+    callers can mutate what they get back.
+    """
+
+    def __init__(self, ttl=DEFAULT_TTL, maxSize=DEFAULT_SIZE):
+        """
+        :param ttl: seconds an entry is used for
+        :type ttl: float
+        :param maxSize: entry limit
+        :type maxSize: int
+        """
+        self.ttl = float(ttl)
+        self.maxSize = int(maxSize)
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+
+    @property
+    def enabled(self):
+        return(self.ttl > 0 and self.maxSize > 0)
+
+    def get(self, tokenId):
+        """
+        :param tokenId: token ID
+        :type tokenId: str
+        :returns: dict with 'token' and, once resolved, 'user' (None for
+            tokens without a user), or None if there's no live entry
+        """
+        tokenId = str(tokenId)
+        with self._lock:
+            entry = self._entries.get(tokenId)
+            if entry is None or time.time() - entry['time'] >= self.ttl:
+                self._entries.pop(tokenId, None)
+                self.misses += 1
+                return(None)
+            self._entries.move_to_end(tokenId)
+            self.hits += 1
+            return({
+                key: deepcopy(value) for key, value in entry.items() if key != 'time'
+            })
+
+    def setToken(self, token):
+        """
+        Cache a token, without its user.
+
+        :param token: token document
+        :type token: dict
+        """
+        if not self.enabled:
+            return
+        entry = {'token': deepcopy(token), 'time': time.time()}
+        with self._lock:
+            self._entries[str(token['_id'])] = entry
+            self._entries.move_to_end(str(token['_id']))
+            while len(self._entries) > self.maxSize:
+                self._entries.popitem(last=False)
+
+    def setUser(self, tokenId, user):
+        """
+        Cache the user core of a cached token.
+
+        :param tokenId: token ID
+        :type tokenId: str
+        :param user: user core, or None
+        :type user: dict or None
+        """
+        if not self.enabled:
+            return
+        user = deepcopy(user)
+        with self._lock:
+            entry = self._entries.get(str(tokenId))
+            if entry is not None:
+                entry['user'] = user
+
+    def invalidateToken(self, tokenId):
+        with self._lock:
+            self._entries.pop(str(tokenId), None)
+
+    def invalidateUser(self, userId):
+        """
+        Drop the entries of a user's tokens.
+        """
+        userId = str(userId)
+        with self._lock:
+            for tokenId in [
+                tokenId for tokenId, entry in self._entries.items()
+                if str(entry['token'].get('userId')) == userId
+            ]:
+                del self._entries[tokenId]
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def info(self):
+        with self._lock:
+            return({
+                'hits': self.hits,
+                'misses': self.misses,
+                'size': len(self._entries),
+                'maxSize': self.maxSize,
+                'ttl': self.ttl
+            })
+
+
+def getAuthCache():
+    """
+    Get the process-wide AuthCache, configured from the ``[server]`` config
+    section on first use.
+
+    :returns: AuthCache
+    """
+    global _cache
+
+    if _cache is None:
+        with _cacheLock:
+            if _cache is None:
+                cfg = config.getConfig().get('server', {})
+                try:
+                    _cache = AuthCache(
+                        ttl=float(cfg.get('auth_cache_ttl', DEFAULT_TTL)),
+                        maxSize=int(cfg.get('auth_cache_size', DEFAULT_SIZE))
+                    )
+                except (TypeError, ValueError):
+                    _cache = AuthCache()
+    return(_cache)
+
+
+def userCore(user):
+    """
+    :param user: user document, or None
+    :type user: dict or None
+    :returns: the `_id` and AUTH_USER_FIELDS of the user, or None
+    """
+    if user is None:
+        return(None)
+    return({
+        key: user[key] for key in ('_id', ) + AUTH_USER_FIELDS if key in user
+    })
+
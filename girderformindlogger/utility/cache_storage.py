@@ -0,0 +1,202 @@
+# -*- coding: utf-8 -*-
+"""
+Storage format of the formatted JSON-LD caches kept in the `cached` field of
+applets, protocols, activities, screens and users.
+
+Caches used to be stored as ``bson.json_util`` strings, which have to be
+parsed in full to read any part of them. In "native" mode (the default, set
+by the ``cache_storage`` option in the ``[jsonld]`` config section) a cache
+is stored as a subdocument instead, so readers can project just
+``cached.applet`` or ``cached.activities.<IRI>``. MongoDB field names can't
+contain "." or start with "$", so those characters are escaped in keys with
+their fullwidth forms, and the empty key, which MongoDB can't address in an
+update path, is stored as "\u2205". String caches are escaped the same way,
+so that keys such as "$ref" aren't read back as ``bson.json_util`` types.
+
+Readers accept either format, so string caches keep working until they are
+converted with ``girderformindlogger cache migrate``.
+"""
+from bson import json_util
+from girderformindlogger.utility import config
+
+CACHE_STORAGE_MODES = ('native', 'string')
+DEFAULT_CACHE_STORAGE = 'native'
+
+_DOT = '.'
+_DOLLAR = '$'
+_ESCAPED_DOT = '\uff0e'
+_ESCAPED_DOLLAR = '\uff04'
+_EMPTY = '\u2205'
+
+
+def getCacheStorage():
+    """
+    Function to get the storage mode for new caches from the `cache_storage`
+    option in the ``[jsonld]`` config section.
+
+    :returns: 'native' or 'string'
+    """
+    mode = str(config.getConfig().get('jsonld', {}).get(
+        'cache_storage',
+        DEFAULT_CACHE_STORAGE
+    )).lower()
+    return(mode if mode in CACHE_STORAGE_MODES else DEFAULT_CACHE_STORAGE)
+
+
+def encodeKey(key):
+    """
+    :param key: key of a cached Object
+    :type key: str
+    :returns: str, safe to use as a MongoDB field name
+    """
+    if not isinstance(key, str):
+        return(key)
+    if not key:
+        return(_EMPTY)
+    key = key.replace(_DOT, _ESCAPED_DOT)
+    return(
+        _ESCAPED_DOLLAR + key[1:] if key.startswith(_DOLLAR) else key
+    )
+
+
+def decodeKey(key):
+    """
+    :param key: MongoDB field name from `encodeKey`
+    :type key: str
+    :returns: str, the original key
+    """
+    if not isinstance(key, str):
+        return(key)
+    if key == _EMPTY:
+        return('')
+    key = key.replace(_ESCAPED_DOT, _DOT)
+    return(
+        _DOLLAR + key[1:] if key.startswith(_ESCAPED_DOLLAR) else key
+    )
+
+
+def encodeKeys(obj):
+    """
+    Function to escape every key in a nested Object with `encodeKey`.
+
+    :param obj: Object to encode
+    :type obj: dict, list or scalar
+    :returns: copy of `obj`
+    """
+    if isinstance(obj, dict):
+        return({encodeKey(k): encodeKeys(v) for k, v in obj.items()})
+    if isinstance(obj, list):
+        return([encodeKeys(v) for v in obj])
+    return(obj)
+
+
+def decodeKeys(obj):
+    """
+    Function to unescape every key in a nested Object with `decodeKey`.
+
+    :param obj: Object to decode
+    :type obj: dict, list or scalar
+    :returns: copy of `obj`
+    """
+    if isinstance(obj, dict):
+        return({decodeKey(k): decodeKeys(v) for k, v in obj.items()})
+    if isinstance(obj, list):
+        return([decodeKeys(v) for v in obj])
+    return(obj)
+
+
+def dumpCache(obj, mode=None):
+    """
+    Function to convert a cache to its stored form.
+
+    :param obj: cache to store
+    :type obj: dict
+    :param mode: 'native' or 'string', defaults to `getCacheStorage()`
+    :type mode: str or None
+    :returns: dict or str
+    """
+    mode = getCacheStorage() if mode is None else mode
+    obj = encodeKeys(obj)
+    return(json_util.dumps(obj) if mode == 'string' else obj)
+
+
+def parseCache(cached):
+    """
+    Function to read a stored cache in either format.
+
+    :param cached: stored cache
+    :type cached: dict or str
+    :returns: dict
+    """
+    if isinstance(cached, str):
+        cached = json_util.loads(cached)
+    return(decodeKeys(cached))
+
+
+def cachedField(cached, *path, decode=True):
+    """
+    Function to read one subtree of a stored cache. A native cache is walked
+    without decoding anything outside `path`; a string cache has to be parsed
+    in full.
+
+    :param cached: stored cache
+    :type cached: dict or str
+    :param path: unescaped keys, e.g. ('activities', activityIRI)
+    :type path: str
+    :param decode: unescape the keys of the subtree?
+    :type decode: bool
+    :returns: the subtree, or None if `path` isn't cached
+    """
+    if isinstance(cached, str):
+        value = decodeKeys(json_util.loads(cached))
+        for key in path:
+            if not isinstance(value, dict) or key not in value:
+                return(None)
+            value = value[key]
+        return(encodeKeys(value) if not decode else value)
+    value = cached
+    for key in path:
+        key = encodeKey(key)
+        if not isinstance(value, dict) or key not in value:
+            return(None)
+        value = value[key]
+    return(decodeKeys(value) if decode else value)
+
+
+def cacheFieldPath(*path, field='cached'):
+    """
+    Function to build the dotted MongoDB path of a subtree of a native cache,
+    for projections and queries.
+
+    :param path: unescaped keys, e.g. ('items', itemIRI)
+    :type path: str
+    :param field: name of the field the cache is stored in
+    :type field: str
+    :returns: str, e.g. 'cached.items.<escaped itemIRI>'
+    """
+    return('.'.join([field, *[encodeKey(key) for key in path]]))
+
+
+def findCached(model, query, paths, fields=None):
+    """
+    Function to find one document with only part of its cache. Native caches
+    are projected to `paths`; a document whose cache is still a string is
+    read again with the whole cache.
+
+    :param model: model to query
+    :type model: Model
+    :param query: query for the document
+    :type query: dict
+    :param paths: cache subtrees to fetch, each a key or tuple of keys
+    :type paths: list
+    :param fields: other fields to fetch
+    :type fields: list or None
+    :returns: dict or None
+    """
+    fields = list(fields) if fields else []
+    doc = model.findOne(query, fields=[*fields, *[cacheFieldPath(
+        *(path if isinstance(path, (list, tuple)) else [path])
+    ) for path in paths]])
+    if doc is not None and not isinstance(doc.get('cached'), dict):
+        doc = model.findOne(query, fields=[*fields, 'cached'])
+    return(doc)
@@ -0,0 +1,235 @@
+# -*- coding: utf-8 -*-
+"""
+A coalescing work queue run by background worker threads.
+
+Tasks are queued under a key. A task queued while another with the same key
+is still waiting is combined with it (by default, replaces it), so a burst of
+changes to one thing is processed once. Tasks with the same key are never
+processed by two workers at once. See :py:mod:`girderformindlogger.utility.aggregation_queue`
+and :py:mod:`girderformindlogger.utility.applet_cache_queue`.
+"""
+import threading
+import time
+
+from collections import OrderedDict
+from girderformindlogger import logger, logprint
+
+
+class CoalescingQueue(object):
+    """
+    Coalescing work queue. Instances are thread-safe; worker threads are
+    started on first use.
+    """
+
+    def __init__(
+        self,
+        process,
+        name,
+        workers=1,
+        background=True,
+        drainOnStop=True,
+        counters=()
+    ):
+        """
+        :param process: called with each task (a dict); may return a dict of
+            amounts to add to the queue's counters
+        :type process: callable
+        :param name: what the queue does, e.g. 'response aggregation', used
+            in thread names and log messages
+        :type name: str
+        :param workers: number of worker threads
+        :type workers: int
+        :param background: process on worker threads rather than inline
+        :type background: bool
+        :param drainOnStop: process the queued tasks when stopping rather than
+            dropping them
+        :type drainOnStop: bool
+        :param counters: names of extra counters reported by `process`
+        :type counters: iterable of str
+        """
+        self.process = process
+        self.name = name
+        self.workers = max(1, int(workers))
+        self.background = background
+        self.drainOnStop = drainOnStop
+        self._pending = OrderedDict()
+        self._inFlight = set()
+        self._threads = []
+        self._terminate = False
+        self._condition = threading.Condition()
+        self.counts = {
+            'enqueued': 0,
+            'coalesced': 0,
+            'processed': 0,
+            'failed': 0,
+            **{counter: 0 for counter in counters}
+        }
+        self.lastDuration = None
+        self.maxLag = 0.0
+
+    def put(self, key, task):
+        """
+        Queue a task, combining it with any task with the same key that is
+        still waiting (see :py:meth:`coalesce`). The combined task keeps the
+        waiting task's place in the queue.
+
+        :param key: what the task is about
+        :type key: hashable
+        :param task: argument to `process`
+        :type task: dict
+        """
+        task = dict(task, enqueued=time.time())
+        if not self.background:
+            self._run(task)
+            return
+        with self._condition:
+            self.counts['enqueued'] += 1
+            if key in self._pending:
+                self.counts['coalesced'] += 1
+                task = self.coalesce(self._pending[key], task)
+            self._pending[key] = task
+            self._startWorkers()
+            self._condition.notify_all()
+
+    def coalesce(self, pending, task):
+        """
+        Combine a newly queued task with the waiting task of the same key.
+        By default the new task replaces the waiting one, keeping its enqueue
+        time. Called with the lock held.
+
+        :param pending: the waiting task
+        :type pending: dict
+        :param task: the new task
+        :type task: dict
+        :returns: dict, the task to run
+        """
+        return(dict(task, enqueued=pending['enqueued']))
+
+    def flush(self, timeout=None):
+        """
+        Wait until every queued task has been processed. With no workers
+        (e.g. after stop), the tasks are processed on this thread.
+
+        :param timeout: seconds to wait, or None to wait indefinitely
+        :type timeout: float or None
+        :returns: bool, False if the timeout expired first
+        """
+        deadline = None if timeout is None else time.time() + timeout
+        while True:
+            with self._condition:
+                if not (self._pending or self._inFlight):
+                    return(True)
+                key, task = (None, None) if self._threads else self._next()
+                if task is None:
+                    remaining = None if deadline is None else (
+                        deadline - time.time()
+                    )
+                    if remaining is not None and remaining <= 0:
+                        return(False)
+                    self._condition.wait(remaining)
+                    continue
+                self._inFlight.add(key)
+            # run without the lock so enqueueing isn't blocked meanwhile
+            self._runInFlight(key, task)
+
+    def stop(self):
+        """
+        Stop the workers, e.g. at shutdown, after processing or dropping the
+        tasks that are still queued.
+        """
+        if self.drainOnStop:
+            self.flush()
+        with self._condition:
+            if not self.drainOnStop:
+                self._pending.clear()
+            self._terminate = True
+            self._condition.notify_all()
+            threads, self._threads = self._threads, []
+        for thread in threads:
+            thread.join()
+        self._terminate = False
+
+    def metrics(self):
+        """
+        :returns: dict of backlog size, lag in seconds and counters
+        """
+        now = time.time()
+        with self._condition:
+            oldest = min(
+                [task['enqueued'] for task in self._pending.values()],
+                default=None
+            )
+            return({
+                'background': self.background,
+                'workers': len(self._threads),
+                'backlog': len(self._pending),
+                'inFlight': len(self._inFlight),
+                'lag': round(now - oldest, 3) if oldest is not None else 0.0,
+                'maxLag': round(self.maxLag, 3),
+                'lastDuration': self.lastDuration,
+                **self.counts
+            })
+
+    def _startWorkers(self):
+        while len(self._threads) < self.workers:
+            thread = threading.Thread(
+                target=self._work,
+                name='{}-{}'.format(
+                    self.name.replace(' ', '-'),
+                    len(self._threads)
+                )
+            )
+            thread.daemon = True
+            self._threads.append(thread)
+            thread.start()
+
+    def _next(self):
+        """
+        Pop the oldest task whose key isn't already being processed, so one
+        key is never processed by two threads at once. Must hold the lock.
+        """
+        for key in self._pending:
+            if key not in self._inFlight:
+                return(key, self._pending.pop(key))
+        return(None, None)
+
+    def _work(self):
+        logprint.info('Started {} thread.'.format(self.name))
+        while True:
+            with self._condition:
+                key, task = self._next()
+                while task is None and not self._terminate:
+                    self._condition.wait()
+                    key, task = self._next()
+                if task is None:
+                    break
+                self._inFlight.add(key)
+            self._runInFlight(key, task)
+        logprint.info('Stopped {} thread.'.format(self.name))
+
+    def _runInFlight(self, key, task):
+        try:
+            self._run(task)
+        finally:
+            with self._condition:
+                self._inFlight.discard(key)
+                self._condition.notify_all()
+
+    def _run(self, task):
+        start = time.time()
+        outcome = 'processed'
+        added = None
+        try:
+            added = self.process(task)
+        except Exception:
+            outcome = 'failed'
+            logger.exception('{} failed for {}'.format(
+                self.name.capitalize(),
+                {k: v for k, v in task.items() if k != 'enqueued'}
+            ))
+        with self._condition:
+            self.counts[outcome] += 1
+            for counter, amount in (added or {}).items():
+                self.counts[counter] += amount
+            self.maxLag = max(self.maxLag, start - task['enqueued'])
+            self.lastDuration = round(time.time() - start, 3)
@@ -0,0 +1,319 @@
+# -*- coding: utf-8 -*-
+"""
+A shared HTTP loader for JSON-LD documents and contexts.
+
+Every ``requests.get`` made while importing or expanding JSON-LD goes through
+:py:func:`getDocumentLoader`, which keeps one pooled ``requests.Session``,
+caches response bodies in memory and on disk keyed by URL, revalidates stale
+entries with ``If-None-Match``/``If-Modified-Since`` and, in offline mode,
+serves only from that cache. The loader is also a pyld document loader, so it
+can be passed to ``jsonld.expand`` as ``options['documentLoader']``.
+
+Options are read from the ``[jsonld]`` config section:
+
+- ``cache_dir``: where to keep cached bodies (``None`` for memory only)
+- ``max_age``: seconds a cached body is served without revalidating
+- ``offline``: only serve documents that are already cached
+- ``timeout``: seconds to wait for a remote server
+"""
+import hashlib
+import json
+import os
+import requests
+import threading
+import time
+
+from collections import OrderedDict
+from girderformindlogger import logger
+from girderformindlogger.constants import JSONLD_CACHE_ROOT
+from girderformindlogger.utility import config, mkdir
+from requests.adapters import HTTPAdapter
+
+DEFAULT_MAX_AGE = 300
+DEFAULT_TIMEOUT = 30
+MEMORY_CACHE_SIZE = 1024
+LINK_HEADER_REL = 'http://www.w3.org/ns/json-ld#context'
+
+_loader = None
+_loaderLock = threading.Lock()
+
+
+class DocumentNotCached(Exception):
+    """
+    Raised in offline mode when a URL has never been fetched.
+    """
+
+    def __init__(self, url):
+        self.url = url
+        super(DocumentNotCached, self).__init__(
+            'Document is not cached and the loader is offline: {}'.format(url)
+        )
+
+
+class CachedDocument(object):
+    """
+    A fetched (or cached) HTTP response body.
+    """
+
+    __slots__ = ('url', 'status', 'text', 'etag', 'lastModified',
+                 'contentType', 'link', 'fetched')
+
+    def __init__(self, url, status, text='', etag=None, lastModified=None,
+                 contentType=None, link=None, fetched=None):
+        self.url = url
+        self.status = status
+        self.text = text
+        self.etag = etag
+        self.lastModified = lastModified
+        self.contentType = contentType
+        self.link = link
+        self.fetched = time.time() if fetched is None else fetched
+
+    def json(self):
+        return(json.loads(self.text))
+
+    def toDict(self):
+        return({k: getattr(self, k) for k in self.__slots__})
+
+
+class DocumentLoader(object):
+    """
+    Pooled, caching HTTP loader. Instances are thread-safe.
+    """
+
+    def __init__(self, cacheDir=None, maxAge=DEFAULT_MAX_AGE, offline=False,
+                 timeout=DEFAULT_TIMEOUT, poolSize=10):
+        """
+        :param cacheDir: directory for cached bodies, or None for memory only
+        :type cacheDir: str or None
+        :param maxAge: seconds to trust a cached body before revalidating
+        :type maxAge: int
+        :param offline: only serve from the cache
+        :type offline: bool
+        :param timeout: seconds to wait for a remote server
+        :type timeout: int
+        :param poolSize: connections kept alive per host
+        :type poolSize: int
+        """
+        self.cacheDir = cacheDir
+        self.maxAge = maxAge
+        self.offline = offline
+        self.timeout = timeout
+        self._lock = threading.Lock()
+        self._memory = OrderedDict()
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=poolSize, pool_maxsize=poolSize)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+        if cacheDir:
+            mkdir(cacheDir)
+
+    def get(self, url):
+        """
+        Get a URL, from the cache if the cached copy is fresh, revalidating it
+        if it is stale. Only successful responses are cached; if revalidating
+        fails, the stale copy keeps being served.
+
+        :param url: URL to load
+        :type url: str
+        :returns: CachedDocument
+        :raises DocumentNotCached: if offline and `url` has not been cached
+        :raises requests.exceptions.RequestException: if the request fails
+        """
+        cached = self._lookup(url)
+        if cached is not None and (
+            self.offline or time.time() - cached.fetched < self.maxAge
+        ):
+            return(cached)
+        if self.offline:
+            raise DocumentNotCached(url)
+        headers = {}
+        if cached is not None and cached.status == 200:
+            if cached.etag:
+                headers['If-None-Match'] = cached.etag
+            if cached.lastModified:
+                headers['If-Modified-Since'] = cached.lastModified
+        try:
+            r = self.session.get(url, headers=headers, timeout=self.timeout)
+        except requests.exceptions.RequestException as e:
+            if cached is None:
+                raise
+            logger.warning('Serving stale {}: {}'.format(url, e))
+            return(cached)
+        if r.status_code == 304 and cached is not None:
+            cached.fetched = time.time()
+            self._store(cached)
+            return(cached)
+        if r.status_code != 200 and cached is not None:
+            logger.warning('Serving stale {}: HTTP {}'.format(
+                url,
+                r.status_code
+            ))
+            return(cached)
+        doc = CachedDocument(
+            url=url,
+            status=r.status_code,
+            text=r.text,
+            etag=r.headers.get('ETag'),
+            lastModified=r.headers.get('Last-Modified'),
+            contentType=r.headers.get('Content-Type'),
+            link=r.headers.get('Link')
+        )
+        self._store(doc)
+        return(doc)
+
+    def loadJSON(self, url):
+        """
+        :param url: URL of a JSON document
+        :type url: str
+        :returns: parsed JSON
+        """
+        return(self.get(url).json())
+
+    def __call__(self, url, options=None):
+        """
+        pyld document loader interface.
+
+        :param url: URL of a JSON-LD document or context
+        :type url: str
+        :param options: pyld loader options (ignored)
+        :returns: dict with 'contextUrl', 'documentUrl' and 'document'
+        """
+        from pyld.jsonld import JsonLdError, parse_link_header
+
+        if not isinstance(url, str) or not (
+            url.startswith('http://') or url.startswith('https://')
+        ):
+            raise JsonLdError(
+                'URL could not be dereferenced; only "http" and "https" '
+                'URLs are supported.',
+                'jsonld.InvalidUrl', {'url': url},
+                code='loading document failed')
+        try:
+            cached = self.get(url)
+            if cached.status >= 400:
+                raise IOError('HTTP {}'.format(cached.status))
+            doc = {
+                'contextUrl': None,
+                'documentUrl': url,
+                'document': cached.json()
+            }
+        except Exception as cause:
+            raise JsonLdError(
+                'Could not retrieve a JSON-LD document from the URL.',
+                'jsonld.LoadDocumentError', {'url': url},
+                code='loading document failed', cause=cause)
+        contentType = (cached.contentType or '').split(';')[0].strip()
+        if contentType != 'application/ld+json' and cached.link:
+            link = parse_link_header(cached.link).get(LINK_HEADER_REL)
+            if isinstance(link, list):
+                raise JsonLdError(
+                    'URL could not be dereferenced, it has more than one '
+                    'associated HTTP Link Header.',
+                    'jsonld.LoadDocumentError', {'url': url},
+                    code='multiple context link headers')
+            if link:
+                doc['contextUrl'] = link['target']
+        return(doc)
+
+    def check(self, url):
+        """
+        :param url: URL
+        :type url: str
+        :returns: bool, False if `url` can't be loaded or is a 404
+        """
+        try:
+            return(self.get(url).status != 404)
+        except Exception:
+            return(False)
+
+    def clear(self):
+        """
+        Empty the in-memory cache. Entries on disk are kept.
+        """
+        with self._lock:
+            self._memory.clear()
+
+    def _path(self, url):
+        return(os.path.join(
+            self.cacheDir,
+            '{}.json'.format(hashlib.sha256(url.encode('utf-8')).hexdigest())
+        ))
+
+    def _lookup(self, url):
+        with self._lock:
+            if url in self._memory:
+                self._memory.move_to_end(url)
+                return(self._memory[url])
+        if not self.cacheDir:
+            return(None)
+        try:
+            with open(self._path(url)) as f:
+                doc = CachedDocument(**json.load(f))
+        except (IOError, OSError, TypeError, ValueError):
+            return(None)
+        self._remember(doc)
+        return(doc)
+
+    def _remember(self, doc):
+        with self._lock:
+            self._memory[doc.url] = doc
+            self._memory.move_to_end(doc.url)
+            while len(self._memory) > MEMORY_CACHE_SIZE:
+                self._memory.popitem(last=False)
+
+    def _store(self, doc):
+        if doc.status != 200:
+            # errors are retried on the next request rather than cached
+            return
+        self._remember(doc)
+        if not self.cacheDir:
+            return
+        path = self._path(doc.url)
+        tmp = '{}.{}.tmp'.format(path, threading.get_ident())
+        try:
+            with open(tmp, 'w') as f:
+                json.dump(doc.toDict(), f)
+            os.replace(tmp, path)
+        except (IOError, OSError):
+            logger.exception('Could not cache {}'.format(doc.url))
+
+
+def getDocumentLoader():
+    """
+    Get the process-wide DocumentLoader, configured from the ``[jsonld]``
+    config section on first use.
+
+    :returns: DocumentLoader
+    """
+    global _loader
+
+    if _loader is None:
+        with _loaderLock:
+            if _loader is None:
+                from girderformindlogger.utility.protocol_import import      \
+                    getImportWorkers
+                from girderformindlogger.utility import toBool
+
+                cfg = config.getConfig().get('jsonld', {})
+                _loader = DocumentLoader(
+                    cacheDir=cfg.get('cache_dir', JSONLD_CACHE_ROOT),
+                    maxAge=int(cfg.get('max_age', DEFAULT_MAX_AGE)),
+                    offline=toBool(cfg.get('offline', False)),
+                    timeout=int(cfg.get('timeout', DEFAULT_TIMEOUT)),
+                    poolSize=max(10, getImportWorkers())
+                )
+    return(_loader)
+
+
+def setDocumentLoader(loader):
+    """
+    Replace the process-wide DocumentLoader, e.g. to go offline in tests.
+
+    :param loader: the new loader, or None to reconfigure on next use
+    :type loader: DocumentLoader or None
+    """
+    global _loader
+
+    with _loaderLock:
+        _loader = loader
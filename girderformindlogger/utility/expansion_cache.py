@@ -0,0 +1,279 @@
+# -*- coding: utf-8 -*-
+"""
+Bounded, process-wide memoization of JSON-LD expansion.
+
+``jsonld_expander.expand`` and ``jsonld_expander.expandOneLevel`` are wrapped
+with :py:func:`memoizeExpansion`, so identical documents (e.g. a screen shared
+by several activities or applets) are expanded once per process. Entries are
+keyed by a hash of the canonical JSON of the input, which includes its
+``@context``; a URL input is keyed by the URL and the validator (ETag,
+Last-Modified or fetch time) of the copy the document loader currently holds,
+so a changed remote document is expanded again. :py:func:`sourceHash` hashes a
+compact document together with its linked contexts, to tell whether an
+imported document has to be expanded again.
+
+Only the outermost call is memoized: the recursive calls an expansion makes
+run uncached, so a miss costs one hash and one copy rather than one per
+level.
+"""
+import functools
+import hashlib
+import json
+import threading
+
+from collections import OrderedDict
+from copy import deepcopy
+from girderformindlogger.utility import config
+
+DEFAULT_CACHE_SIZE = 4096
+
+_caches = {}
+_MISSING = object()
+_expanding = threading.local()
+
+
+def canonicalHash(obj):
+    """
+    Function to hash a JSON-serializable object independently of key order.
+
+    :param obj: object to hash
+    :type obj: dict, list, str, or scalar
+    :returns: hex digest
+    """
+    return(hashlib.sha256(json.dumps(
+        obj,
+        sort_keys=True,
+        separators=(',', ':'),
+        ensure_ascii=False,
+        default=str
+    ).encode('utf-8')).hexdigest())
+
+
+def _contextURLs(obj, base=None):
+    """
+    Function to list the remote contexts an Object links to, in order.
+
+    :param obj: JSON-LD Object, or the value of an `@context`
+    :type obj: dict, list, str, or scalar
+    :param base: URL to resolve relative context references against
+    :type base: str or None
+    :returns: list of absolute URLs
+    """
+    from urllib.parse import urljoin
+
+    urls = []
+
+    def walk(value, inContext):
+        if isinstance(value, str):
+            if inContext:
+                url = urljoin(base, value) if base else value
+                if url.startswith(('http://', 'https://')):
+                    urls.append(url)
+        elif isinstance(value, list):
+            for v in value:
+                walk(v, inContext)
+        elif isinstance(value, dict):
+            for k, v in value.items():
+                if k == '@context' or (inContext and k == '@import'):
+                    walk(v, True)
+                elif not inContext:
+                    walk(v, False)
+                elif isinstance(v, dict) and '@context' in v:
+                    # scoped context of a term
+                    walk(v['@context'], True)
+
+    walk(obj, False)
+    return(urls)
+
+
+def sourceHash(compact, url=None):
+    """
+    Function to hash a compact JSON-LD document together with the remote
+    contexts it links to (and the contexts those link to), so that a change
+    to a linked context changes the hash. Contexts are loaded through the
+    document loader, so recently fetched ones aren't requested again. Other
+    documents the document refers to (e.g. the items of an activity) are
+    imported, and hashed, separately.
+
+    :param compact: compact JSON-LD document
+    :type compact: dict
+    :param url: URL `compact` was loaded from, to resolve relative contexts
+    :type url: str or None
+    :returns: hex digest
+    """
+    from girderformindlogger.utility.document_loader import getDocumentLoader
+
+    loader = getDocumentLoader()
+    contexts = OrderedDict()
+    queue = _contextURLs(compact, url)
+    while queue:
+        contextURL = queue.pop(0)
+        if contextURL in contexts:
+            continue
+        try:
+            doc = loader.get(contextURL)
+        except Exception as e:
+            contexts[contextURL] = [None, type(e).__name__]
+            continue
+        contexts[contextURL] = [doc.status, doc.text]
+        try:
+            queue.extend(_contextURLs(doc.json(), contextURL))
+        except ValueError:
+            pass
+    return(canonicalHash([compact, contexts]))
+
+
+class ExpansionCache(object):
+    """
+    Thread-safe LRU cache that counts hits and misses. Values are copied out
+    so callers can mutate what they get back.
+    """
+
+    def __init__(self, name, maxSize=None):
+        """
+        :param name: name to report counters under
+        :type name: str
+        :param maxSize: entry limit, defaults to the ``[jsonld]
+            expansion_cache_size`` config option
+        :type maxSize: int or None
+        """
+        self.name = name
+        self._maxSize = maxSize
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+
+    @property
+    def maxSize(self):
+        if self._maxSize is None:
+            self._maxSize = getExpansionCacheSize()
+        return(self._maxSize)
+
+    def get(self, key):
+        with self._lock:
+            value = self._entries.get(key, _MISSING)
+            if value is _MISSING:
+                self.misses += 1
+                return(_MISSING)
+            self._entries.move_to_end(key)
+            self.hits += 1
+        return(deepcopy(value))
+
+    def set(self, key, value, copy=True):
+        """
+        :param copy: copy `value` on the way in; pass False if nothing else
+            holds a reference to it
+        :type copy: bool
+        """
+        if self.maxSize <= 0:
+            return
+        if copy:
+            value = deepcopy(value)
+        with self._lock:
+            self._entries[key] = value
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxSize:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.hits = 0
+            self.misses = 0
+
+    def info(self):
+        maxSize = self.maxSize
+        with self._lock:
+            return({
+                'hits': self.hits,
+                'misses': self.misses,
+                'size': len(self._entries),
+                'maxSize': maxSize
+            })
+
+
+def getExpansionCacheSize():
+    """
+    Function to get the per-function entry limit from the
+    ``expansion_cache_size`` option in the ``[jsonld]`` config section.
+
+    :returns: int, 0 disables memoization
+    """
+    try:
+        return(int(config.getConfig().get('jsonld', {}).get(
+            'expansion_cache_size',
+            DEFAULT_CACHE_SIZE
+        )))
+    except (TypeError, ValueError):
+        return(DEFAULT_CACHE_SIZE)
+
+
+def _expansionKey(obj, args):
+    if isinstance(obj, str):
+        from girderformindlogger.utility.document_loader import \
+            getDocumentLoader
+
+        # Key a URL by the version of the document it currently dereferences
+        # to. A document without validators is replaced on every refetch, so
+        # its fetch time identifies the body.
+        doc = getDocumentLoader().get(obj)
+        return(canonicalHash([
+            obj,
+            doc.status,
+            doc.etag or doc.lastModified or doc.fetched,
+            list(args)
+        ]))
+    return(canonicalHash([obj, list(args)]))
+
+
+def memoizeExpansion(fun):
+    """
+    Decorator to memoize an expansion function whose first argument is the
+    JSON-LD input. Inputs that can't be keyed (e.g. an unloadable URL) are
+    passed straight through, and exceptions are never cached. Calls made
+    while another memoized expansion is running on the same thread are not
+    memoized.
+    """
+    cache = _caches[fun.__name__] = ExpansionCache(fun.__name__)
+
+    @functools.wraps(fun)
+    def wrapped(obj, *args, **kwargs):
+        if obj is None or cache.maxSize <= 0 or getattr(
+            _expanding, 'active', False
+        ):
+            return(fun(obj, *args, **kwargs))
+        try:
+            key = _expansionKey(obj, [*args, *sorted(kwargs.items())])
+        except Exception:
+            return(_outermost(fun, obj, *args, **kwargs))
+        value = cache.get(key)
+        if value is _MISSING:
+            value = _outermost(fun, obj, *args, **kwargs)
+            # the result is ours alone, so store it and hand out the copy
+            cache.set(key, value, copy=False)
+            value = deepcopy(value)
+        return(value)
+
+    wrapped.cache = cache
+    return(wrapped)
+
+
+def _outermost(fun, *args, **kwargs):
+    _expanding.active = True
+    try:
+        return(fun(*args, **kwargs))
+    finally:
+        _expanding.active = False
+
+
+def expansionCacheInfo():
+    """
+    :returns: dict of hit/miss counters and sizes, per memoized function
+    """
+    return({name: cache.info() for name, cache in _caches.items()})
+
+
+def clearExpansionCaches():
+    for cache in _caches.values():
+        cache.clear()
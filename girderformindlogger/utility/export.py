@@ -0,0 +1,169 @@
+# -*- coding: utf-8 -*-
+"""
+Serializers that stream rows of exported data to the client in chunks, for
+use as the generator function a streaming endpoint returns.
+"""
+import csv
+import io
+import json
+
+EXPORT_CHUNK_SIZE = 1000
+
+
+def _jsonDefault(obj):
+    if hasattr(obj, 'isoformat'):
+        return(obj.isoformat())
+    return(str(obj))
+
+
+def _cell(value):
+    if value is None:
+        return('')
+    if isinstance(value, (dict, list)):
+        return(json.dumps(value, default=_jsonDefault))
+    if hasattr(value, 'isoformat'):
+        return(value.isoformat())
+    return(value)
+
+
+def streamNDJSON(rows, chunkSize=EXPORT_CHUNK_SIZE):
+    """
+    Generator of newline-delimited JSON, one row per line.
+
+    :param rows: rows to serialize
+    :type rows: iterable of dicts
+    :param chunkSize: rows per yielded chunk
+    :type chunkSize: int
+    :returns: generator of str
+    """
+    buf = []
+    for row in rows:
+        buf.append(json.dumps(row, default=_jsonDefault))
+        if len(buf) >= chunkSize:
+            yield '\n'.join(buf) + '\n'
+            buf = []
+    if buf:
+        yield '\n'.join(buf) + '\n'
+
+
+def streamCSV(rows, columns, chunkSize=EXPORT_CHUNK_SIZE):
+    """
+    Generator of CSV with a header row. Nested values are written as JSON.
+
+    :param rows: rows to serialize
+    :type rows: iterable of dicts
+    :param columns: column names, in order; keys of a row not in `columns`
+        are dropped
+    :type columns: list of str
+    :param chunkSize: rows per yielded chunk
+    :type chunkSize: int
+    :returns: generator of str
+    """
+    buf = io.StringIO()
+    writer = csv.writer(buf)
+    writer.writerow(columns)
+    count = 0
+    for row in rows:
+        writer.writerow([_cell(row.get(column)) for column in columns])
+        count += 1
+        if count % chunkSize == 0:
+            yield buf.getvalue()
+            buf.seek(0)
+            buf.truncate()
+    yield buf.getvalue()
+
+
+def chunked(iterable, chunkSize=EXPORT_CHUNK_SIZE):
+    """
+    Generator of lists of up to `chunkSize` consecutive items of `iterable`.
+    """
+    chunk = []
+    for item in iterable:
+        chunk.append(item)
+        if len(chunk) >= chunkSize:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def arrowAvailable():
+    """
+    :returns: bool, whether Parquet and Arrow exports can be written
+    """
+    try:
+        import pyarrow  # noqa: F401
+        import pyarrow.parquet  # noqa: F401
+    except ImportError:
+        return(False)
+    return(True)
+
+
+class _ChunkSink(object):
+    """
+    Write-only file object that keeps what's written until it's drained.
+    """
+
+    def __init__(self):
+        self.closed = False
+        self._chunks = []
+        self._position = 0
+
+    def write(self, data):
+        data = bytes(data)
+        self._chunks.append(data)
+        self._position += len(data)
+        return(len(data))
+
+    def tell(self):
+        return(self._position)
+
+    def flush(self):
+        pass
+
+    def close(self):
+        self.closed = True
+
+    def drain(self):
+        data = b''.join(self._chunks)
+        self._chunks = []
+        return(data)
+
+
+def _text(value):
+    return(None if value is None else str(_cell(value)))
+
+
+def streamArrow(rows, columns, format='parquet', chunkSize=EXPORT_CHUNK_SIZE):
+    """
+    Generator of a Parquet file or an Arrow IPC stream, written one row group
+    (or record batch) per chunk of rows. Every column is a string column;
+    nested values are written as JSON. Requires pyarrow.
+
+    :param rows: rows to serialize
+    :type rows: iterable of dicts
+    :param columns: column names, in order
+    :type columns: list of str
+    :param format: 'parquet' or 'arrow'
+    :type format: str
+    :param chunkSize: rows per row group
+    :type chunkSize: int
+    :returns: generator of bytes
+    """
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    schema = pa.schema([(column, pa.string()) for column in columns])
+    sink = _ChunkSink()
+    writer = pq.ParquetWriter(
+        sink,
+        schema
+    ) if format == 'parquet' else pa.RecordBatchStreamWriter(sink, schema)
+    for chunk in chunked(rows, chunkSize):
+        writer.write_table(pa.Table.from_arrays([
+            pa.array([_text(row.get(column)) for row in chunk], pa.string())
+            for column in columns
+        ], schema=schema))
+        yield sink.drain()
+    writer.close()
+    yield sink.drain()
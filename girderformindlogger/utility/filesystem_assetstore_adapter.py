@@ -6,26 +6,72 @@ import psutil
 import shutil
 import six
 from six import BytesIO
+from six.moves import urllib
 import stat
+import sys
 import tempfile
 
 from girderformindlogger import events, logger
-from girderformindlogger.api.rest import setResponseHeader
+from girderformindlogger.api.rest import setContentDisposition, setResponseHeader
 from girderformindlogger.exceptions import ValidationException, GirderException
 from girderformindlogger.models.file import File
 from girderformindlogger.models.folder import Folder
 from girderformindlogger.models.item import Item
 from girderformindlogger.models.upload import Upload
-from girderformindlogger.utility import mkdir, progress
+from girderformindlogger.utility import config, mkdir, progress
 from . import _hash_state
 from .abstract_assetstore_adapter import AbstractAssetstoreAdapter
 
 BUF_SIZE = 65536
+# Size of the reads and writes that still go through Python in zero-copy mode
+ZERO_COPY_BUF_SIZE = 1024 ** 2
+# Directory, under the root, of files whose hash hasn't been computed yet
+PENDING_DIR = 'pending'
 
 # Default permissions for the files written to the filesystem
 DEFAULT_PERMS = stat.S_IRUSR | stat.S_IWUSR
 
 
+def getZeroCopyConfig():
+    """
+    Function to read the ``[filesystem_assetstore]`` config section.
+
+    :returns: dict with 'zeroCopy' (bool), 'sendfileHeader' (str or None) and
+        'accelRedirectPrefix' (str)
+    """
+    from girderformindlogger.utility import toBool
+
+    cfg = config.getConfig().get('filesystem_assetstore', {})
+    return {
+        'zeroCopy': toBool(cfg.get('zero_copy', False)),
+        'sendfileHeader': cfg.get('sendfile_header') or None,
+        'accelRedirectPrefix': cfg.get('accel_redirect_prefix') or '/assetstore/'
+    }
+
+
+def _copyFileRange(src, dst, count, srcOffset, dstOffset):
+    """
+    Copy up to `count` bytes between two file descriptors in the kernel.
+
+    :returns: The number of bytes copied, or None if neither
+        ``os.copy_file_range`` nor file-to-file ``os.sendfile`` is available.
+    """
+    copied = 0
+    while copied < count:
+        if hasattr(os, 'copy_file_range'):
+            size = os.copy_file_range(
+                src, dst, count - copied, srcOffset + copied, dstOffset + copied)
+        elif hasattr(os, 'sendfile') and sys.platform.startswith('linux'):
+            os.lseek(dst, dstOffset + copied, os.SEEK_SET)
+            size = os.sendfile(dst, src, srcOffset + copied, count - copied)
+        else:
+            return None
+        if not size:
+            break
+        copied += size
+    return copied
+
+
 class FilesystemAssetstoreAdapter(AbstractAssetstoreAdapter):
     """
     This assetstore type stores files on the filesystem underneath a root
@@ -81,7 +127,8 @@ class FilesystemAssetstoreAdapter(AbstractAssetstoreAdapter):
     def fileIndexFields():
         """
         File documents should have an index on their sha512 field, as well as
-        whether or not they are imported.
+        whether or not they are imported. Files still waiting to be hashed
+        have a sparse index of their own on hashPending.
         """
         return ['sha512', 'imported']
 
@@ -103,6 +150,7 @@ class FilesystemAssetstoreAdapter(AbstractAssetstoreAdapter):
             self.unavailable = True
             logger.error('Could not write to assetstore root: %s',
                          self.assetstore['root'])
+        self.zeroCopy = getZeroCopyConfig()
 
     def capacityInfo(self):
         """
@@ -130,7 +178,11 @@ class FilesystemAssetstoreAdapter(AbstractAssetstoreAdapter):
         fd, path = tempfile.mkstemp(dir=self.tempDir)
         os.close(fd)  # Must close this file descriptor or it will leak
         upload['tempFile'] = path
-        upload['sha512state'] = _hash_state.serializeHex(sha512())
+        if self.zeroCopy['zeroCopy']:
+            # The hash is computed in the background once the file is stored
+            upload['hashPending'] = True
+        else:
+            upload['sha512state'] = _hash_state.serializeHex(sha512())
         return upload
 
     def uploadChunk(self, upload, chunk):
@@ -146,6 +198,9 @@ class FilesystemAssetstoreAdapter(AbstractAssetstoreAdapter):
         if isinstance(chunk, six.binary_type):
             chunk = BytesIO(chunk)
 
+        if upload.get('hashPending'):
+            return self._uploadChunkZeroCopy(upload, chunk)
+
         # Restore the internal state of the streaming SHA-512 checksum
         checksum = _hash_state.restoreHex(upload['sha512state'], 'sha512')
 
@@ -184,6 +239,57 @@ class FilesystemAssetstoreAdapter(AbstractAssetstoreAdapter):
         upload['received'] += size
         return upload
 
+    def _uploadChunkZeroCopy(self, upload, chunk):
+        """
+        Appends the chunk into the temporary file without hashing it. A chunk
+        backed by a regular file (such as a spooled multipart upload) is
+        copied by the kernel; anything else is copied in large blocks.
+        """
+        # Copy at most one byte more than expected so that oversized uploads
+        # are still detected.
+        remaining = upload['size'] - upload['received'] + 1
+        # Discard anything past what was recorded, e.g. if the server died
+        # while writing the last chunk.
+        offset = upload['received']
+        os.truncate(upload['tempFile'], offset)
+        source = getattr(chunk, 'stream', chunk)
+        size = None
+        try:
+            sourceFd = source.fileno()
+            if stat.S_ISREG(os.fstat(sourceFd).st_mode):
+                sourceOffset = source.tell()
+                fd = os.open(upload['tempFile'], os.O_WRONLY)
+                try:
+                    size = _copyFileRange(
+                        sourceFd, fd, remaining, sourceOffset, offset)
+                finally:
+                    os.close(fd)
+                if size is not None:
+                    source.seek(sourceOffset + size)
+        except (AttributeError, OSError, ValueError):
+            size = None
+        if size is None:
+            size = 0
+            with open(upload['tempFile'], 'r+b') as tempFile:
+                tempFile.seek(offset)
+                while size < remaining:
+                    data = chunk.read(min(ZERO_COPY_BUF_SIZE, remaining - size))
+                    if not data:
+                        break
+                    size += len(data)
+                    tempFile.write(data)
+        chunk.close()
+
+        try:
+            self.checkUploadSize(upload, size)
+        except ValidationException:
+            with open(upload['tempFile'], 'a+b') as tempFile:
+                tempFile.truncate(upload['received'])
+            raise
+
+        upload['received'] += size
+        return upload
+
     def requestOffset(self, upload):
         """
         Returns the size of the temp file.
@@ -194,7 +300,14 @@ class FilesystemAssetstoreAdapter(AbstractAssetstoreAdapter):
         """
         Moves the file into its permanent content-addressed location within the
         assetstore. Directory hierarchy yields 256^2 buckets.
+
+        An upload written in zero-copy mode hasn't been hashed yet, so it is
+        moved under the pending directory instead, and later moved to its
+        content-addressed location by :py:meth:`hashPendingFile`.
         """
+        if upload.get('hashPending'):
+            return self._finalizePendingUpload(upload, file)
+
         hash = _hash_state.restoreHex(upload['sha512state'], 'sha512').hexdigest()
         dir = os.path.join(hash[0:2], hash[2:4])
         absdir = os.path.join(self.assetstore['root'], dir)
@@ -233,6 +346,115 @@ class FilesystemAssetstoreAdapter(AbstractAssetstoreAdapter):
 
         return file
 
+    def _finalizePendingUpload(self, upload, file):
+        path = os.path.join(PENDING_DIR, os.path.basename(upload['tempFile']))
+        abspath = os.path.join(self.assetstore['root'], path)
+        mkdir(os.path.dirname(abspath))
+        shutil.move(upload['tempFile'], abspath)
+        try:
+            os.chmod(abspath, self.assetstore.get('perms', DEFAULT_PERMS))
+        except OSError:
+            # some filesystems may not support POSIX permissions
+            pass
+
+        file['path'] = path
+        file['hashPending'] = True
+        return file
+
+    def hashPendingFile(self, file):
+        """
+        Compute the SHA-512 of a file that was stored in zero-copy mode and
+        move it into its content-addressed location. This is done in the
+        background for each new file, when the "data.process" event is
+        handled.
+
+        :param file: The file document.
+        :type file: dict
+        :returns: The updated file document.
+        """
+        if not file.get('hashPending'):
+            return file
+        pendingPath = self.fullPath(file)
+        checksum = sha512()
+        with open(pendingPath, 'rb') as f:
+            while True:
+                data = f.read(ZERO_COPY_BUF_SIZE)
+                if not data:
+                    break
+                checksum.update(data)
+        hash = checksum.hexdigest()
+        dir = os.path.join(hash[0:2], hash[2:4])
+        absdir = os.path.join(self.assetstore['root'], dir)
+
+        path = os.path.join(dir, hash)
+        abspath = os.path.join(self.assetstore['root'], path)
+
+        mkdir(absdir)
+        linked = False
+        with filelock.FileLock(abspath + '.deleteLock'):
+            if not os.path.exists(abspath):
+                try:
+                    os.link(pendingPath, abspath)
+                except OSError:
+                    shutil.copy2(pendingPath, abspath)
+                linked = True
+
+        result = File().update({
+            '_id': file['_id'],
+            'hashPending': True
+        }, {
+            '$set': {'sha512': hash, 'path': path},
+            '$unset': {'hashPending': True}
+        }, multi=False)
+        os.unlink(pendingPath)
+        file = dict(file, sha512=hash, path=path)
+        file.pop('hashPending', None)
+        if linked and not result.matched_count:
+            # The file was deleted while it was being hashed.
+            self.deleteFile(file)
+        return file
+
+    def hashPendingFiles(self):
+        """
+        Hash every file in this assetstore that is still waiting to be
+        hashed, e.g. after the server stopped before the background pass ran.
+        See :py:func:`hashAllPendingFiles`.
+
+        :returns: The number of files hashed.
+        """
+        count = 0
+        for file in File().find({
+            'assetstoreId': self.assetstore['_id'],
+            'hashPending': True
+        }):
+            try:
+                self.hashPendingFile(file)
+                count += 1
+            except OSError:
+                logger.exception('Failed to hash file %s' % file['_id'])
+        return count
+
+    def copyFile(self, srcFile, destFile):
+        """
+        Copies of a file share its stored data. A file that hasn't been
+        hashed yet is hashed first, so that the copy points at the
+        content-addressed data rather than at the pending file, which is
+        moved away once the source is hashed.
+        """
+        if srcFile.get('hashPending'):
+            try:
+                srcFile = self.hashPendingFile(srcFile)
+            except (IOError, OSError):
+                # It may have been hashed in the meantime, e.g. by the
+                # background pass
+                srcFile = File().load(srcFile['_id'], force=True)
+                if srcFile is None or srcFile.get('hashPending'):
+                    raise
+            destFile.pop('hashPending', None)
+            destFile['sha512'] = srcFile['sha512']
+            destFile['path'] = srcFile['path']
+        return destFile
+
     def fullPath(self, file):
         """
         Utility method for constructing the full (absolute) path to the given
@@ -260,10 +482,32 @@ class FilesystemAssetstoreAdapter(AbstractAssetstoreAdapter):
                 'girderformindlogger.utility.filesystem_assetstore_adapter.'
                 'file-does-not-exist')
 
+        if headers and self._offloadDownload(file, offset, endByte):
+            setResponseHeader('Accept-Ranges', 'bytes')
+            setResponseHeader(
+                'Content-Type',
+                file.get('mimeType') or 'application/octet-stream')
+            setContentDisposition(file['name'], contentDisposition or 'attachment')
+            if self.zeroCopy['sendfileHeader'].lower() == 'x-accel-redirect':
+                setResponseHeader('X-Accel-Redirect', urllib.parse.quote(
+                    self.zeroCopy['accelRedirectPrefix'].rstrip('/') + '/'
+                    + file['path']))
+            else:
+                setResponseHeader(self.zeroCopy['sendfileHeader'], path)
+
+            def offloaded():
+                # The web server in front of Girder sends the body.
+                return
+                yield
+
+            return offloaded
+
         if headers:
             setResponseHeader('Accept-Ranges', 'bytes')
             self.setContentHeaders(file, offset, endByte, contentDisposition)
 
+        bufSize = ZERO_COPY_BUF_SIZE if self.zeroCopy['zeroCopy'] else BUF_SIZE
+
         def stream():
             bytesRead = offset
             with open(path, 'rb') as f:
@@ -271,7 +515,7 @@ class FilesystemAssetstoreAdapter(AbstractAssetstoreAdapter):
                     f.seek(offset)
 
                 while True:
-                    readLen = min(BUF_SIZE, endByte - bytesRead)
+                    readLen = min(bufSize, endByte - bytesRead)
                     if readLen <= 0:
                         break
 
@@ -284,6 +528,25 @@ class FilesystemAssetstoreAdapter(AbstractAssetstoreAdapter):
 
         return stream
 
+    def _offloadDownload(self, file, offset, endByte):
+        """
+        Whether a download should be handed to the web server in front of
+        Girder with the configured sendfile header. The web server applies
+        the request's Range header itself, so partial downloads are only
+        offloaded when they were requested that way rather than with the
+        offset and endByte parameters.
+        """
+        import cherrypy
+
+        header = self.zeroCopy['sendfileHeader']
+        if not header:
+            return False
+        if header.lower() == 'x-accel-redirect' and file.get('imported'):
+            # Only the assetstore root is exposed to the web server
+            return False
+        wholeFile = offset == 0 and endByte >= file['size']
+        return wholeFile or 'Range' in cherrypy.request.headers
+
     def deleteFile(self, file):
         """
         Deletes the file from disk if it is the only File in this assetstore
@@ -294,6 +557,16 @@ class FilesystemAssetstoreAdapter(AbstractAssetstoreAdapter):
         if file.get('imported') or 'path' not in file:
             return
 
+        if file.get('hashPending'):
+            # Files that haven't been hashed yet are never shared
+            path = os.path.join(self.assetstore['root'], file['path'])
+            if os.path.isfile(path):
+                try:
+                    os.unlink(path)
+                except Exception:
+                    logger.exception('Failed to delete file %s' % path)
+            return
+
         q = {
             'sha512': file['sha512'],
             'assetstoreId': self.assetstore['_id']
@@ -482,3 +755,24 @@ class FilesystemAssetstoreAdapter(AbstractAssetstoreAdapter):
         if path and os.path.exists(path):
             return path
         return super(FilesystemAssetstoreAdapter, self).getLocalFilePath(file)
+
+
+def hashAllPendingFiles():
+    """
+    Function to hash the files of every filesystem assetstore that are still
+    waiting to be hashed. Files are hashed when their "data.process" event is
+    handled, but events still queued when the server stops are dropped, so
+    this runs in the background whenever the server starts, and from
+    ``girderformindlogger assetstore hash-pending``.
+
+    :returns: The number of files hashed.
+    """
+    from girderformindlogger.constants import AssetstoreType
+    from girderformindlogger.models.assetstore import Assetstore
+
+    count = 0
+    for assetstore in Assetstore().find({'type': AssetstoreType.FILESYSTEM}):
+        adapter = FilesystemAssetstoreAdapter(assetstore)
+        if not getattr(adapter, 'unavailable', False):
+            count += adapter.hashPendingFiles()
+    return count
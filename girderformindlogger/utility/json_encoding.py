@@ -0,0 +1,143 @@
+# -*- coding: utf-8 -*-
+"""
+JSON encoding of REST responses.
+
+The backend is chosen by the ``json_encoder`` option in the ``[server]``
+config section:
+
+- ``stdlib``: ``json.dumps`` with :py:class:`girderformindlogger.utility.JsonEncoder`
+- ``orjson``: `orjson <https://github.com/ijl/orjson>`_, which serializes
+  datetimes itself and only calls back into Python for other types such as
+  ObjectIds
+- ``auto`` (the default): orjson if it is installed, otherwise stdlib
+
+``json_sort_keys`` controls whether object keys are sorted. Both backends
+encode the documents Girder returns to the same JSON values, but orjson omits
+the whitespace after separators and writes NaN and infinity as ``null``
+rather than refusing them. Values orjson
+can't encode (such as integers wider than 64 bits) fall back to stdlib.
+"""
+import json
+import time
+
+import girderformindlogger
+from bson.objectid import ObjectId
+from girderformindlogger.utility import config, JsonEncoder, toBool
+
+JSON_ENCODERS = ('auto', 'stdlib', 'orjson')
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+_warnedMissing = False
+
+
+def getJsonEncoder():
+    """
+    Function to get the JSON backend in use from the `json_encoder` option in
+    the ``[server]`` config section.
+
+    :returns: 'stdlib' or 'orjson'
+    """
+    encoder = str(config.getConfig().get('server', {}).get(
+        'json_encoder',
+        'auto'
+    )).lower()
+    if encoder not in JSON_ENCODERS:
+        encoder = 'auto'
+    if encoder == 'auto':
+        encoder = 'orjson' if orjson is not None else 'stdlib'
+    if encoder == 'orjson' and orjson is None:
+        global _warnedMissing
+        if not _warnedMissing:
+            _warnedMissing = True
+            girderformindlogger.logger.warning(
+                'json_encoder is "orjson" but orjson is not installed.')
+        encoder = 'stdlib'
+    return encoder
+
+
+def getSortKeys():
+    """
+    :returns: bool, the `json_sort_keys` option in the ``[server]`` config
+        section
+    """
+    return toBool(config.getConfig().get('server', {}).get(
+        'json_sort_keys',
+        True
+    ))
+
+
+def _orjsonDefault(obj):
+    if type(obj) is ObjectId:
+        return str(obj)
+    # Same as JsonEncoder.default, for the types orjson doesn't know
+    event = girderformindlogger.events.trigger('rest.json_encode', obj)
+    if len(event.responses):
+        return event.responses[-1]
+    if isinstance(obj, (set, frozenset)):
+        return tuple(obj)
+    return str(obj)
+
+
+def dumps(val, encoder=None, sortKeys=None):
+    """
+    Function to encode a REST response as JSON.
+
+    :param val: the value to encode
+    :param encoder: 'stdlib' or 'orjson', defaults to `getJsonEncoder()`
+    :type encoder: str or None
+    :param sortKeys: sort object keys? Defaults to `getSortKeys()`
+    :type sortKeys: bool or None
+    :returns: UTF-8 encoded bytes
+    """
+    encoder = getJsonEncoder() if encoder is None else encoder
+    sortKeys = getSortKeys() if sortKeys is None else sortKeys
+    if encoder == 'orjson' and orjson is not None:
+        option = orjson.OPT_NAIVE_UTC | orjson.OPT_NON_STR_KEYS
+        if sortKeys:
+            option |= orjson.OPT_SORT_KEYS
+        try:
+            return orjson.dumps(val, default=_orjsonDefault, option=option)
+        except TypeError:
+            # orjson.JSONEncodeError, e.g. an integer wider than 64 bits
+            pass
+    return json.dumps(val, sort_keys=sortKeys, allow_nan=False,
+                      cls=JsonEncoder).encode('utf8')
+
+
+def benchmark(values, repeat=5):
+    """
+    Function to time each available backend, with and without key sorting,
+    encoding the same values.
+
+    :param values: values to encode, e.g. formatted applets
+    :type values: list
+    :param repeat: number of times to encode every value
+    :type repeat: int
+    :returns: list of dicts with 'encoder', 'sortKeys', 'seconds' (the best
+        of `repeat` runs over all the values) and 'bytes'
+    """
+    encoders = ['stdlib'] + (['orjson'] if orjson is not None else [])
+    results = []
+    for encoder in encoders:
+        for sortKeys in (True, False):
+            best = None
+            for _ in range(max(1, repeat)):
+                start = time.perf_counter()
+                size = sum(len(dumps(
+                    value,
+                    encoder=encoder,
+                    sortKeys=sortKeys
+                )) for value in values)
+                elapsed = time.perf_counter() - start
+                best = elapsed if best is None else min(best, elapsed)
+            results.append({
+                'encoder': encoder,
+                'sortKeys': sortKeys,
+                'seconds': best,
+                'bytes': size
+            })
+    return results
@@ -1,4 +1,3 @@
-from bson import json_util
 from copy import deepcopy
 from datetime import datetime
 from girderformindlogger.constants import AccessType, DEFINED_RELATIONS,       \
@@ -15,6 +14,11 @@ from girderformindlogger.models.protocol import Protocol as ProtocolModel
 from girderformindlogger.models.screen import Screen as ScreenModel
 from girderformindlogger.models.user import User as UserModel
 from girderformindlogger.utility import loadJSON
+from girderformindlogger.utility.cache_storage import dumpCache, parseCache
+from girderformindlogger.utility.document_loader import DocumentNotCached,     \
+    getDocumentLoader
+from girderformindlogger.utility.expansion_cache import canonicalHash,         \
+    memoizeExpansion, sourceHash
 from girderformindlogger.utility.response import responseDateList
 from pyld import jsonld
 
@@ -42,9 +46,34 @@ def getModelCollection(modelType):
     return(collection)
 
 
-def importAndCompareModelType(model, url, user, modelType):
-    import threading
+def importAndCompareModelType(
+    model,
+    url,
+    user,
+    modelType,
+    expanded=None,
+    timer=None
+):
+    """
+    Function to save a loaded JSON-LD document to the database, format it and
+    cache the formatted document.
+
+    :param model: compact JSON-LD document as loaded from `url`
+    :type model: dict
+    :param url: URL of the document
+    :type url: str
+    :param user: User making the call
+    :type user: dict
+    :param modelType: 'activity', 'screen', etc.
+    :type modelType: str
+    :param expanded: `url` already expanded, if available
+    :type expanded: dict or None
+    :param timer: timer to charge 'expand' and 'persist' phases to
+    :type timer: girderformindlogger.utility.protocol_import.ImportTimer
+    :returns: 2-tuple: (formatted document, modelType)
+    """
     from girderformindlogger.utility import firstLower
+    from girderformindlogger.utility.protocol_import import timedPhase
 
     if model is None:
         return(None, None)
@@ -64,9 +93,29 @@ def importAndCompareModelType(model, url, user, modelType):
     )=='activityset' else modelType
     modelClass = MODELS()[modelType]()
     prefName = modelClass.preferredName(model)
-    cachedDocObj = {}
-    model = expand(url)
+    compact = model
+    if expanded is None:
+        with timedPhase(timer, 'expand'):
+            expanded = expand(url)
+    model = expanded
     print("Loaded {}".format(": ".join([modelType, prefName])))
+    with timedPhase(timer, 'persist'):
+        newModel = _saveImportedModel(model, url, user, modelType, modelClass,
+                                      prefName)
+    with timedPhase(timer, 'expand'):
+        formatted = _fixUpFormat(formatLdObject(
+            newModel,
+            mesoPrefix=modelType,
+            user=user,
+            refreshCache=True
+        ))
+    with timedPhase(timer, 'persist'):
+        createCache(newModel, formatted, modelType, user,
+                    sourceHash=sourceHash(compact, url))
+    return(formatted, modelType)
+
+
+def _saveImportedModel(model, url, user, modelType, modelClass, prefName):
     docCollection=getModelCollection(modelType)
     if modelClass.name in ['folder', 'item']:
         docFolder = FolderModel().createFolder(
@@ -114,14 +163,7 @@ def importAndCompareModelType(model, url, user, modelType):
                     }
                 }
             )
-    formatted = _fixUpFormat(formatLdObject(
-        newModel,
-        mesoPrefix=modelType,
-        user=user,
-        refreshCache=True
-    ))
-    createCache(newModel, formatted, modelType, user)
-    return(formatted, modelType)
+    return(newModel)
 
 
 def _createContextForStr(s):
@@ -314,16 +356,18 @@ def delanguageTag(obj):
     return((obj if len(obj) else [{}])[-1].get("@value", ""))
 
 
+@memoizeExpansion
 def expandOneLevel(obj):
     if obj is None:
         # We only want to catch `None`s here, not other falsy objects
         return(obj)
+    options = {'documentLoader': getDocumentLoader()}
     try:
-        newObj = jsonld.expand(obj)
+        newObj = jsonld.expand(obj, options)
     except jsonld.JsonLdError as e: # 👮 Catch illegal JSON-LD
         if e.type == "jsonld.InvalidUrl":
             try:
-                newObj = jsonld.expand(reprolibCanonize(obj))
+                newObj = jsonld.expand(reprolibCanonize(obj), options)
             except:
                 print("Invalid URL: {}".format(e.details.get("url")))
                 print(obj)
@@ -411,6 +455,7 @@ def dereference(prefixed):
         return(prefixed)
 
 
+@memoizeExpansion
 def expand(obj, keepUndefined=False):
     """
     Function to take an unexpanded JSON-LD Object and return it expandeds.
@@ -462,11 +507,10 @@ def fileObjectToStr(obj):
     :type obj: dict
     :returns: String from loaded file
     """
-    import requests
-    from requests.exceptions import ConnectionError, MissingSchema
+    from requests.exceptions import RequestException
     try:
-        r = requests.get(obj.get('@id'))
-    except (AttributeError, ConnectionError, MissingSchema):
+        r = getDocumentLoader().get(obj.get('@id'))
+    except (AttributeError, DocumentNotCached, RequestException):
         r = obj.get("@id") if isinstance(obj, dict) else ""
         raise ResourcePathNotFound("Could not load {}".format(r))
     return(r.text)
@@ -480,14 +524,7 @@ def checkURL(s):
     :type s: string
     :returns: bool
     """
-    import requests
-    try:
-        if (requests.get(s).status_code==404):
-            return(False)
-        else:
-            return(True)
-    except:
-        return(False)
+    return(getDocumentLoader().check(s))
 
 
 def compactKeys(obj):
@@ -542,52 +579,99 @@ def _createContext(key):
     return({key.split('://')[-1].replace('.', '_dot_'): key}, k)
 
 
-def createCache(obj, formatted, modelType, user):
+def getCacheHistory():
+    """
+    Function to get how many superseded caches to keep in a document's
+    `oldCache`, from the ``cache_history`` option in the ``[jsonld]`` config
+    section.
+
+    :returns: int ≥ 0
+    """
+    from girderformindlogger.utility import config
+    try:
+        return(max(0, int(config.getConfig().get('jsonld', {}).get(
+            'cache_history',
+            3
+        ))))
+    except (TypeError, ValueError):
+        return(3)
+
+
+def createCache(obj, formatted, modelType, user, sourceHash=None):
+    """
+    Function to cache a formatted JSON-LD Object on its document. The cache
+    is stamped with `prov:generatedAtTime` and a content hash, and is only
+    rewritten if that hash (or the hash of the source document) changed; the
+    superseded cache moves to `oldCache`, which keeps at most
+    `getCacheHistory()` entries.
+
+    :param obj: document to cache on
+    :type obj: dict
+    :param formatted: formatted JSON-LD Object
+    :type formatted: dict
+    :param modelType: 'applet', 'protocol', 'activity', 'screen', etc.
+    :type modelType: str
+    :param user: User making the call
+    :type user: dict
+    :param sourceHash: `expansion_cache.sourceHash` of the compact document
+        `formatted` was built from (and its linked contexts), if it was
+        loaded from a URL
+    :type sourceHash: str or None
+    :returns: saved document
+    """
     obj = MODELS()[modelType]().load(obj['_id'], force=True)
-    if "cached" in obj:
-        oc = obj.get("oldCache", [])
-        obj["oldCache"] = (oc if oc is not None else []).append(obj["cached"])
     if modelType in NONES:
         print("No modelType!")
         print(obj)
     if formatted is None:
         print("formatting failed!")
         print(obj)
-    obj["cached"] = json_util.dumps({
+    cachedHash = canonicalHash(formatted)
+    if "cached" in obj and obj.get("cachedHash")==cachedHash and (
+        sourceHash is None or obj.get("cachedSourceHash")==sourceHash
+    ):
+        return(obj)
+    if "cached" in obj and obj.get("cachedHash")!=cachedHash:
+        history = getCacheHistory()
+        oc = obj.get("oldCache")
+        oc = oc if isinstance(oc, list) else []
+        obj["oldCache"] = (oc + [obj["cached"]])[-history:] if history else []
+    obj["cached"] = dumpCache({
         **formatted,
         "prov:generatedAtTime": xsdNow()
     })
+    obj["cachedHash"] = cachedHash
+    if sourceHash is not None:
+        obj["cachedSourceHash"] = sourceHash
     return(MODELS()[modelType]().save(obj, validate=False))
 
 
 def loadCache(obj, user=None):
-    if isinstance(obj, dict):
-        if 'applet' in obj:
-            try:
-                obj["applet"]["responseDates"] = responseDateList(
-                    obj['applet'].get('_id', '').split('applet/')[-1],
-                    user.get('_id'),
-                    user
-                )
-            except:
-                obj["applet"]["responseDates"] = []
-        return(obj)
-    else:
-        cache = json_util.loads(obj)
-        if 'applet' in cache:
-            try:
-                cache["applet"]["responseDates"] = responseDateList(
-                    cache['applet'].get('_id', '').split('applet/')[-1],
-                    user.get('_id'),
-                    user
-                )
-            except:
-                cache["applet"]["responseDates"] = []
-        return(
-            {
-                k: v for k, v in cache.items() if k!="prov:generatedAtTime"
-            } if isinstance(cache, dict) else cache
-        )
+    """
+    Function to read a cache stored by `createCache`, in either storage
+    format, with the requesting User's response dates filled in.
+
+    :param obj: stored cache
+    :type obj: dict or str
+    :param user: User making the call
+    :type user: dict
+    :returns: dict
+    """
+    cache = parseCache(obj)
+    if isinstance(cache, dict) and 'applet' in cache:
+        try:
+            cache["applet"]["responseDates"] = responseDateList(
+                cache['applet'].get('_id', '').split('applet/')[-1],
+                user.get('_id'),
+                user
+            )
+        except:
+            cache["applet"]["responseDates"] = []
+    return(
+        {
+            k: v for k, v in cache.items() if k!="prov:generatedAtTime"
+        } if isinstance(cache, dict) else cache
+    )
 
 
 def _fixUpFormat(obj):
@@ -756,93 +840,12 @@ def formatLdObject(
                     applet["applet"]["responseDates"] = []
             return(applet)
         elif mesoPrefix=='protocol':
-            protocol = {
-                'protocol': newObj,
-                'activities': {},
-                "items": {}
-            }
-            activitiesNow = set()
-            itemsNow = set()
-            try:
-                protocol = componentImport(
-                    newObj,
-                    deepcopy(protocol),
-                    user,
-                    refreshCache=refreshCache
-                )
-            except:
-                print("636")
-                protocol = componentImport(
-                    newObj,
-                    deepcopy(protocol),
-                    user,
-                    refreshCache=True
-                )
-            newActivities = [
-                a for a in protocol.get('activities', {}).keys(
-                ) if a not in activitiesNow
-            ]
-            newItems = [
-                i for i in protocol.get('items', {}).keys(
-                ) if i not in itemsNow
-            ]
-            while(any([len(newActivities), len(newItems)])):
-                activitiesNow = set(
-                    protocol.get('activities', {}).keys()
-                )
-                itemsNow = set(protocol.get('items', {}).keys())
-                for activityURL in newActivities:
-                    activity = protocol['activities'][activityURL]
-                    activity = activity.get(
-                        'meta',
-                        {}
-                    ).get('activity', activity)
-                    try:
-                        protocol = componentImport(
-                            deepcopy(activity),
-                            deepcopy(protocol),
-                            user,
-                            refreshCache=refreshCache
-                        )
-                    except:
-                        print("670")
-                        protocol = componentImport(
-                            deepcopy(activity),
-                            deepcopy(protocol),
-                            user,
-                            refreshCache=True
-                        )
-                for itemURL in newItems:
-                    activity = protocol['items'][itemURL]
-                    activity = activity.get(
-                        'meta',
-                        {}
-                    ).get('screen', activity)
-                    try:
-                        protocol = componentImport(
-                            deepcopy(activity),
-                            deepcopy(protocol),
-                            user,
-                            refreshCache=refreshCache
-                        )
-                    except:
-                        print("691")
-                        protocol = componentImport(
-                            deepcopy(activity),
-                            deepcopy(protocol),
-                            user,
-                            refreshCache=True
-                        )
-                newActivities = list(
-                    set(
-                        protocol.get('activities', {}).keys()
-                    ) - activitiesNow
-                )
-                newItems = list(
-                    set(
-                        protocol.get('items', {}).keys()
-                    ) - itemsNow
-                )
+            from girderformindlogger.utility.protocol_import import           \
+                ProtocolImporter
+            protocol = ProtocolImporter(
+                user=user,
+                refreshCache=refreshCache
+            ).importProtocol(newObj)
             return(_fixUpFormat(protocol))
         else:
             return(_fixUpFormat(newObj))
@@ -862,90 +865,6 @@ def formatLdObject(
         print(traceback.print_tb(sys.exc_info()[2]))
 
 
-def componentImport(
-    obj,
-    protocol,
-    user=None,
-    refreshCache=False,
-    modelType=['activity', 'item']
-):
-    """
-    :param modelType: model or models to search
-    :type modelType: str or iterable
-    :returns: protocol (updated)
-    """
-    import itertools
-    from girderformindlogger.models import pluralize, smartImport
-    from girderformindlogger.utility import firstLower
-
-    updatedProtocol = deepcopy(protocol)
-    obj2 = {k: v for k, v in expand(deepcopy(obj)).items() if v is not None}
-    try:
-        for order in obj2.get(
-            "reprolib:terms/order",
-            {}
-        ):
-            for activity in order.get("@list", []):
-                IRI = activity.get(
-                    'url',
-                    activity.get('@id')
-                )
-                if reprolibPrefix(IRI) not in list(
-                    itertools.chain.from_iterable([
-                        protocol.get(mt, {}).keys() for mt in [
-                            "activities",
-                            "items"
-                        ]
-                    ])
-                ):
-                    activityComponent, activityContent, canonicalIRI =         \
-                        smartImport(
-                            IRI,
-                            user=user,
-                            refreshCache=refreshCache
-                        ) if (IRI is not None and not IRI.startswith(
-                            "Document not found"
-                        )) else (None, None, None)
-                    activity["url"] = activity["schema:url"] = canonicalIRI if(
-                        canonicalIRI is not None
-                    ) else IRI
-                    activityComponent = pluralize(firstLower(
-                        activityContent.get(
-                            '@type',
-                            ['']
-                        )[0].split('/')[-1].split(':')[-1]
-                    )) if (activityComponent is None and isinstance(
-                        activityContent,
-                        dict
-                    )) else activityComponent
-                    if activityComponent is not None:
-                        activityComponents = (
-                            pluralize(
-                                activityComponent
-                            ) if activityComponent != 'screen' else 'items'
-                        )
-                        updatedProtocol[activityComponents][
-                            canonicalIRI
-                        ] = deepcopy(formatLdObject(
-                            activityContent,
-                            activityComponent,
-                            user,
-                            refreshCache=refreshCache
-                        ))
-        return(updatedProtocol.get(
-            'meta',
-            updatedProtocol
-        ).get(modelType if isinstance(
-            modelType,
-            str
-        ) else modelType[0], updatedProtocol))
-    except:
-        import sys, traceback
-        print("error!")
-        print(sys.exc_info())
-        print(traceback.print_tb(sys.exc_info()[2]))
-
-
 def getByLanguage(object, tag=None):
     """
     Function to get a value or IRI by a language tag following
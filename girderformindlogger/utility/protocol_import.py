@@ -0,0 +1,320 @@
+# -*- coding: utf-8 -*-
+"""
+Breadth-first, concurrent import of the activity/item graph of a protocol.
+
+``formatLdObject(..., mesoPrefix='protocol')`` hands the expanded protocol to a
+:py:class:`ProtocolImporter`, which walks ``reprolib:terms/order`` level by
+level, fetches every document that is not already cached on a bounded thread
+pool, and assembles the ``{'protocol', 'activities', 'items'}`` Object once.
+"""
+import contextlib
+import threading
+import time
+
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from girderformindlogger import logger, logprint
+from girderformindlogger.utility import config
+
+DEFAULT_IMPORT_WORKERS = 8
+ORDER_KEY = "reprolib:terms/order"
+
+
+def getImportWorkers():
+    """
+    Function to get the number of threads used to fetch JSON-LD documents
+    from the ``import_workers`` option in the ``[jsonld]`` config section.
+
+    :returns: int ≥ 1
+    """
+    try:
+        return(max(1, int(config.getConfig().get('jsonld', {}).get(
+            'import_workers',
+            DEFAULT_IMPORT_WORKERS
+        ))))
+    except (TypeError, ValueError):
+        return(DEFAULT_IMPORT_WORKERS)
+
+
+@contextlib.contextmanager
+def _noPhase():
+    yield
+
+
+def timedPhase(timer, phase):
+    """
+    Function to time a block against one phase of an ImportTimer, or to do
+    nothing if no timer is given.
+
+    :param timer: timer to charge, or None
+    :type timer: ImportTimer or None
+    :param phase: 'fetch', 'expand' or 'persist'
+    :type phase: str
+    :returns: context manager
+    """
+    return(timer.phase(phase) if timer is not None else _noPhase())
+
+
+def orderEntries(obj):
+    """
+    Function to list the entries of every ``reprolib:terms/order`` list in an
+    expanded JSON-LD Object.
+
+    :param obj: expanded protocol or activity
+    :type obj: dict
+    :returns: list of dicts, each with a 'url' or '@id'
+    """
+    if not isinstance(obj, dict):
+        return([])
+    orders = obj.get(ORDER_KEY, [])
+    return([
+        entry for order in (
+            orders if isinstance(orders, list) else [orders]
+        ) if isinstance(order, dict) for entry in order.get(
+            "@list",
+            []
+        ) if isinstance(entry, dict)
+    ])
+
+
+class ImportTimer(object):
+    """
+    Thread-safe accumulator of the time a protocol import spends in each
+    phase. Phase totals are summed across worker threads, so they can exceed
+    the wall-clock time of the import.
+    """
+
+    PHASES = ('fetch', 'expand', 'persist')
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._started = time.time()
+        self.timings = {phase: 0.0 for phase in self.PHASES}
+        self.counts = {'fetched': 0, 'cached': 0, 'unchanged': 0, 'failed': 0}
+
+    @contextlib.contextmanager
+    def phase(self, name):
+        start = time.time()
+        try:
+            yield
+        finally:
+            elapsed = time.time() - start
+            with self._lock:
+                self.timings[name] = self.timings.get(name, 0.0) + elapsed
+
+    def count(self, name):
+        with self._lock:
+            self.counts[name] = self.counts.get(name, 0) + 1
+
+    def report(self):
+        """
+        :returns: dict of seconds per phase, wall-clock seconds and counts
+        """
+        with self._lock:
+            return({
+                **{k: round(v, 3) for k, v in self.timings.items()},
+                'wall': round(time.time() - self._started, 3),
+                **self.counts
+            })
+
+
+class ProtocolImporter(object):
+    """
+    Imports every activity and item reachable from a protocol's
+    ``reprolib:terms/order``. Documents are fetched and expanded on worker
+    threads; persisting to the database happens on the calling thread so
+    folder and item creation stays serial.
+    """
+
+    def __init__(self, user=None, refreshCache=False, workers=None):
+        """
+        :param user: User making the call
+        :type user: dict
+        :param refreshCache: Refresh from Dereferencing URLs?
+        :type refreshCache: bool
+        :param workers: size of the fetch pool, defaults to the
+            ``[jsonld] import_workers`` config option
+        :type workers: int or None
+        """
+        self.user = user
+        self.refreshCache = bool(refreshCache)
+        self.workers = workers if workers else getImportWorkers()
+        self.timer = ImportTimer()
+
+    def importProtocol(self, protocolObj):
+        """
+        :param protocolObj: expanded protocol
+        :type protocolObj: dict
+        :returns: dict with 'protocol', 'activities' and 'items'
+        """
+        from girderformindlogger.utility.jsonld_expander import reprolibPrefix
+
+        protocol = {
+            'protocol': protocolObj,
+            'activities': {},
+            'items': {}
+        }
+        entries = {}
+        inFlight = {}
+
+        def schedule(pool, parent):
+            for entry in orderEntries(parent):
+                IRI = entry.get('url', entry.get('@id'))
+                if not isinstance(IRI, str) or IRI.startswith(
+                    "Document not found"
+                ):
+                    continue
+                key = reprolibPrefix(IRI)
+                if key not in entries:
+                    entries[key] = []
+                    inFlight[pool.submit(self._fetch, IRI)] = key
+                entries[key].append(entry)
+
+        with ThreadPoolExecutor(max_workers=self.workers) as pool:
+            schedule(pool, protocolObj)
+            while inFlight:
+                done, _ = wait(list(inFlight), return_when=FIRST_COMPLETED)
+                for future in done:
+                    key = inFlight.pop(future)
+                    try:
+                        component, content, canonicalIRI = self._persist(
+                            future.result()
+                        )
+                    except Exception:
+                        self.timer.count('failed')
+                        logger.exception('Could not import {}'.format(key))
+                        continue
+                    for entry in entries[key]:
+                        entry['url'] = entry['schema:url'] = canonicalIRI
+                    if component is None:
+                        continue
+                    protocol[component][canonicalIRI] = content
+                    schedule(pool, content)
+
+        logprint.info(
+            'Imported {} from {} documents ({cached} cached, {unchanged} '
+            'unchanged, {failed} failed): fetch {fetch}s, expand {expand}s, '
+            'persist {persist}s; {wall}s elapsed'.format(
+                protocolObj.get('_id', protocolObj.get('@id', 'protocol')),
+                len(entries),
+                **self.timer.report()
+            )
+        )
+        return(protocol)
+
+    def _fetch(self, IRI):
+        """
+        Worker: resolve one IRI to either its cached document or its freshly
+        loaded and expanded JSON-LD. When refreshing, a cached document is
+        still reused if the source it was built from has not changed.
+
+        :returns: dict
+        """
+        from girderformindlogger.models import cycleModels
+        from girderformindlogger.utility import loadJSON
+        from girderformindlogger.utility.expansion_cache import sourceHash
+        from girderformindlogger.utility.jsonld_expander import expand,        \
+            reprolibCanonize
+
+        with self.timer.phase('fetch'):
+            canonicalIRI = reprolibCanonize(IRI)
+            url = canonicalIRI if canonicalIRI is not None else IRI
+            modelType, cachedDoc = None, None
+            try:
+                modelType, cachedDoc = cycleModels({url, IRI})
+            except Exception:
+                logger.exception('Could not look up {}'.format(url))
+            if cachedDoc is not None and 'cached' not in cachedDoc:
+                cachedDoc = None
+            if cachedDoc is not None and not self.refreshCache:
+                record = self._cachedRecord(url, modelType, cachedDoc)
+                if record is not None:
+                    self.timer.count('cached')
+                    return(record)
+            compact = loadJSON(url, 'screen')
+        if not compact:
+            return({'url': url, 'modelType': None, 'content': None})
+        if cachedDoc is not None and cachedDoc.get(
+            'cachedSourceHash'
+        ) == sourceHash(compact, url):
+            record = self._cachedRecord(url, modelType, cachedDoc)
+            if record is not None:
+                self.timer.count('unchanged')
+                return(record)
+        self.timer.count('fetched')
+        with self.timer.phase('expand'):
+            expanded = expand(url)
+        return({
+            'url': url,
+            'compact': compact,
+            'expanded': expanded
+        })
+
+    def _cachedRecord(self, url, modelType, cachedDoc):
+        from girderformindlogger.utility.jsonld_expander import loadCache
+
+        try:
+            return({
+                'url': url,
+                'modelType': modelType,
+                'content': loadCache(cachedDoc['cached'])
+            })
+        except Exception:
+            logger.exception('Bad cache for {}; refetching'.format(url))
+            return(None)
+
+    def _persist(self, record):
+        """
+        Save a fetched document (if it was not already cached) and format it
+        for the protocol.
+
+        :param record: return value of `_fetch`
+        :type record: dict
+        :returns: 3-tuple: ('activities' or 'items' or None, formatted
+            document, canonical IRI)
+        """
+        from girderformindlogger.exceptions import AccessException
+        from girderformindlogger.models import pluralize
+        from girderformindlogger.utility import firstLower
+        from girderformindlogger.utility.jsonld_expander import                \
+            formatLdObject, importAndCompareModelType
+
+        url = record['url']
+        if 'compact' in record:
+            if self.user is None:
+                raise AccessException(
+                    "You must be logged in to load a screen by url"
+                )
+            content, modelType = importAndCompareModelType(
+                record['compact'],
+                url=url,
+                user=self.user,
+                modelType='screen',
+                expanded=record['expanded'],
+                timer=self.timer
+            )
+        else:
+            content, modelType = record['content'], record['modelType']
+        if not isinstance(content, dict):
+            return(None, None, url)
+        if modelType is None:
+            atType = content.get('@type', '')
+            atType = atType[0] if isinstance(atType, list) and len(
+                atType
+            ) else atType if isinstance(atType, str) else ''
+            atType = atType.split('/')[-1].split(':')[-1]
+            modelType = firstLower(atType) if len(atType) else None
+        component = 'items' if modelType in [
+            'screen',
+            'field',
+            'item'
+        ] else pluralize(modelType) if modelType else None
+        if component not in ['activities', 'items']:
+            return(None, None, url)
+        with self.timer.phase('expand'):
+            content = formatLdObject(
+                content,
+                modelType,
+                self.user,
+                refreshCache=self.refreshCache
+            )
+        return(component, content, url)
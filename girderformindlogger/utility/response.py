@@ -18,14 +18,29 @@ MonkeyPatch.patch_fromisoformat()
 
 
 def getSchedule(currentUser, timezone=None):
-    from .jsonld_expander import formatLdObject
+    from .jsonld_expander import formatLdObject, reprolibPrefix
+    applets = [
+        formatLdObject(
+            applet,
+            'applet',
+            currentUser
+        ) for applet in AppletModel().getAppletsForUser(
+            user=currentUser,
+            role='user'
+        )
+    ]
+    latestResponses = getLatestResponses(
+        currentUser['_id'],
+        [applet['applet']['_id'].split('applet/')[-1] for applet in applets]
+    )
     return({
         applet['applet'].get('_id', ''): {
             applet['activities'][activity].get('_id', ''): {
-                'lastResponse': getLatestResponseTime(
-                    currentUser['_id'],
-                    applet['applet']['_id'].split('applet/')[-1],
-                    activity,
+                'lastResponse': _responseTime(
+                    latestResponses.get((
+                        applet['applet']['_id'].split('applet/')[-1],
+                        reprolibPrefix(activity)
+                    )),
                     tz=timezone
                 ) #,
                 # 'nextScheduled': None,
@@ -33,22 +48,135 @@ def getSchedule(currentUser, timezone=None):
             } for activity in list(
                 applet.get('activities', {}).keys()
             )
-        } for applet in [
-            formatLdObject(
-                applet,
-                'applet',
-                currentUser
-            ) for applet in AppletModel().getAppletsForUser(
-                user=currentUser,
-                role='user'
-            )
-        ]
+        } for applet in applets
     })
 
 
+def canonicalActivityURL(activityURL):
+    """
+    Function to get the one spelling of an activity URL that responses are
+    stored under. Reprolib URLs are rewritten to REPROLIB_CANONICAL without
+    dereferencing them.
+
+    :param activityURL: activity URL in any known spelling
+    :type activityURL: str
+    :returns: str
+    """
+    from girderformindlogger.constants import REPROLIB_CANONICAL
+    from .jsonld_expander import reprolibPrefix
+    prefixed = reprolibPrefix(activityURL)
+    if isinstance(prefixed, str) and prefixed.startswith('reprolib:'):
+        return(prefixed.replace('reprolib:', REPROLIB_CANONICAL, 1))
+    return(activityURL)
+
+
+def activityURLSpellings(activityURL):
+    """
+    Function to list every spelling an activity URL may have been stored
+    under before URLs were canonicalized at write time.
+
+    :param activityURL: activity URL in any known spelling
+    :type activityURL: str
+    :returns: list of str
+    """
+    from girderformindlogger.constants import REPROLIB_CANONICAL,              \
+        REPROLIB_PREFIXES
+    from .jsonld_expander import reprolibPrefix
+    prefixed = reprolibPrefix(activityURL)
+    if not isinstance(prefixed, str) or not prefixed.startswith('reprolib:'):
+        return([activityURL])
+    return(list({
+        activityURL,
+        prefixed,
+        *[prefixed.replace('reprolib:', prefix, 1) for prefix in [
+            REPROLIB_CANONICAL,
+            *REPROLIB_PREFIXES
+        ]]
+    }))
+
+
+def getLatestResponses(
+    informantId,
+    appletIds,
+    activityURLs=None,
+    referenceDate=None,
+    fields=('updated',)
+):
+    """
+    Function to find a user's latest response to each activity of the given
+    applets in one aggregation.
+
+    :param informantId: ID of the responding user
+    :type informantId: ObjectId or str
+    :param appletIds: IDs of the applets
+    :type appletIds: list
+    :param activityURLs: only these activities, or every activity if None
+    :type activityURLs: list or None
+    :param referenceDate: ignore responses updated after this date
+    :type referenceDate: datetime or None
+    :param fields: top-level fields of each response to return
+    :type fields: iterable of str
+    :returns: dict of {(appletId, reprolibPrefix(activityURL)): response}
+    """
+    from bson.son import SON
+    from .jsonld_expander import reprolibPrefix
+    query = {
+        "baseParentType": 'user',
+        "baseParentId": informantId if isinstance(
+            informantId,
+            ObjectId
+        ) else ObjectId(informantId),
+        "meta.applet.@id": {
+            "$in": list(itertools.chain.from_iterable([
+                string_or_ObjectID(appletId) for appletId in appletIds
+            ]))
+        }
+    }
+    if activityURLs is not None:
+        query["meta.activity.url"] = {
+            "$in": list(set(itertools.chain.from_iterable([
+                activityURLSpellings(activityURL) for activityURL in (
+                    activityURLs
+                )
+            ])))
+        }
+    if referenceDate is not None:
+        query["updated"] = {"$lte": referenceDate}
+    fields = set(fields) | {'updated'}
+    latestResponses = {}
+    for response in ResponseItem().collection.aggregate([
+        {"$match": query},
+        # follows the (user, applet, activity, updated) index
+        {"$sort": SON([
+            ("baseParentId", ASCENDING),
+            ("meta.applet.@id", ASCENDING),
+            ("meta.activity.url", ASCENDING),
+            ("updated", DESCENDING)
+        ])},
+        {"$group": {
+            "_id": {
+                "applet": "$meta.applet.@id",
+                "activity": "$meta.activity.url"
+            },
+            "responseId": {"$first": "$_id"},
+            **{field: {"$first": "${}".format(field)} for field in fields}
+        }}
+    ], allowDiskUse=True):
+        key = (
+            str(response['_id']['applet']),
+            reprolibPrefix(response['_id']['activity'])
+        )
+        response['_id'] = response.pop('responseId')
+        # several spellings of one activity URL can share a key
+        if key not in latestResponses or response['updated'] > (
+            latestResponses[key]['updated']
+        ):
+            latestResponses[key] = response
+    return(latestResponses)
+
+
 def getLatestResponse(informantId, appletId, activityURL):
-    from .jsonld_expander import reprolibCanonize, reprolibPrefix
-    responses = list(ResponseItem().find(
+    return(next(iter(ResponseItem().find(
         query={
             "baseParentType": 'user',
             "baseParentId": informantId if isinstance(
@@ -62,34 +190,23 @@ def getLatestResponse(informantId, appletId, activityURL):
                 ]
             },
             "meta.activity.url": {
-                "$in": [
-                    activityURL,
-                    reprolibPrefix(activityURL),
-                    reprolibCanonize(activityURL)
-                ]
+                "$in": activityURLSpellings(activityURL)
             }
         },
         force=True,
-        sort=[("updated", DESCENDING)]
-    ))
-    if len(responses):
-        return(responses[0])
-    return(None)
+        sort=[("updated", DESCENDING)],
+        limit=1
+    )), None))
 
 
 def getLatestResponseTime(informantId, appletId, activityURL, tz=None):
-    latestResponse = getLatestResponse(informantId, appletId, activityURL)
-    try:
-        latestResponse['updated'].isoformat(
-        ) if tz is None else latestResponse['updated'].astimezone(pytz.timezone(
-            tz
-        )).isoformat()
-    except TypeError:
-        pass
-    except:
-        import sys, traceback
-        print(sys.exc_info())
-        print(traceback.print_tb(sys.exc_info()[2]))
+    return(_responseTime(
+        getLatestResponse(informantId, appletId, activityURL),
+        tz=tz
+    ))
+
+
+def _responseTime(latestResponse, tz=None):
     return(
         (
             latestResponse['updated'].astimezone(pytz.timezone(
@@ -134,7 +251,9 @@ def aggregate(metadata, informant, startDate=None, endDate=None, getAll=False):
                 "$lt": endDate
             },
             "meta.applet.@id": metadata.get("applet", {}).get("@id"),
-            "meta.activity.url": metadata.get("activity", {}).get("url"),
+            "meta.activity.url": {"$in": activityURLSpellings(
+                metadata.get("activity", {}).get("url")
+            )},
             "meta.subject.@id": metadata.get("subject", {}).get("@id")
         }
 
@@ -251,6 +370,49 @@ def formatResponse(response):
     return(clean_empty(thisResponse))
 
 
+TIDY_COLUMNS = ['schema:startDate', 'schema:endDate', 'userId', 'itemURI',
+                'value']
+TIDY_FIELDS = ['created', 'updated', 'baseParentId', 'meta.responses',
+               'meta.responseStarted', 'meta.responseCompleted']
+
+
+def tidyResponses(responses, appletId):
+    """
+    Function to yield responses in tidy format, one row per item response,
+    without aggregating or otherwise writing anything.
+
+    :param responses: responses with at least the TIDY_FIELDS
+    :type responses: iterable of dicts
+    :param appletId: ID of the applet, used to encode respondents' IDs
+    :type appletId: str
+    :returns: generator of dicts with the TIDY_COLUMNS
+    """
+    import hashlib
+    encodedIds = {}
+    for response in responses:
+        metadata = response.get('meta', {})
+        if not isinstance(metadata.get('responses'), dict):
+            continue
+        userId = response.get('baseParentId')
+        if userId not in encodedIds:
+            # TODO: create a user cipher, which is the hash of an appletid
+            # concatenated with the user id
+            encodedIds[userId] = hashlib.md5(
+                (str(appletId) + str(userId)).encode()
+            ).hexdigest()
+        updated = response.get('updated', datetime.now())
+        startDate = isodatetime(metadata.get('responseStarted', updated))
+        endDate = isodatetime(metadata.get('responseCompleted', updated))
+        for itemURI, value in metadata['responses'].items():
+            yield({
+                'schema:startDate': startDate,
+                'schema:endDate': endDate,
+                'userId': encodedIds[userId],
+                'itemURI': itemURI,
+                'value': value
+            })
+
+
 def string_or_ObjectID(s):
     return([str(s), ObjectId(s)])
 
@@ -348,46 +510,38 @@ def delocalize(dt):
 
 
 def aggregateAndSave(item, informant):
+    """
+    Function to compute a response's `last7Days` and `allTime` aggregates
+    from the response rollups and save both with one metadata update. The
+    response is added to the rollups first if it hasn't been already.
+
+    :param item: response item, with its metadata already saved
+    :type item: dict
+    :param informant: User who responded, or their ID (unused; the informant
+        is the response's `baseParentId`)
+    :type informant: dict or ObjectId
+    :returns: updated response item
+    """
+    from girderformindlogger.models.response_rollup import ResponseRollup
     if item == {} or item is None:
         return({})
     metadata = item.get("meta", {})
-    # Save 1 (of 3)
-    if metadata and metadata != {}:
-        item = ResponseItem().setMetadata(item, metadata)
-    # sevenDay ...
-    metadata = item.get("meta", {})
+    if not metadata:
+        return(item)
     endDate = datetime.now(
         tzlocal.get_localzone()
     )
-    startDate = (endDate - timedelta(days=7)).date()
-    print("From {} to {}".format(
-        startDate.strftime("%c"),
-        endDate.strftime("%c")
-    ))
-    metadata["last7Days"] = aggregate(
-        metadata,
-        informant,
-        startDate=startDate,
+    startDate = datetime.fromisoformat(
+        (endDate - timedelta(days=7)).date().isoformat()
+    ).astimezone(pytz.utc).replace(tzinfo=None)
+    endDate = endDate.astimezone(pytz.utc).replace(tzinfo=None)
+    ResponseRollup().addResponse(item)
+    metadata["last7Days"], metadata["allTime"] = ResponseRollup().aggregates(
+        item,
         endDate=endDate,
-        getAll=True
+        startDate=startDate
     )
-
-    # save (2 of 3)
-    if metadata and metadata != {}:
-        item = ResponseItem().setMetadata(item, metadata)
-    # allTime
-    metadata = item.get("meta", {})
-    metadata["allTime"] = aggregate(
-        metadata,
-        informant,
-        endDate=endDate,
-        getAll=False
-    )
-
-    # save (3 of 3)
-    if metadata and metadata != {}:
-        item = ResponseItem().setMetadata(item, metadata)
-    return(item)
+    return(ResponseItem().setMetadata(item, metadata))
 
 
 def last7Days(
@@ -398,8 +552,8 @@ def last7Days(
     subject=None,
     referenceDate=None
 ):
-    from bson import json_util
-    from .jsonld_expander import loadCache, reprolibCanonize, reprolibPrefix
+    from .cache_storage import cachedField, decodeKey
+    from .jsonld_expander import reprolibPrefix
     referenceDate = delocalize(
         datetime.now(
             tzlocal.get_localzone()
@@ -407,42 +561,21 @@ def last7Days(
     )
 
     # we need to get the activities
-    cachedApplet = loadCache(appletInfo['cached'])
     listOfActivities = [
-        reprolibPrefix(activity) for activity in list(
-            cachedApplet['activities'].keys()
-        )
+        reprolibPrefix(decodeKey(activity)) for activity in list((cachedField(
+            appletInfo['cached'],
+            'activities',
+            decode=False
+        ) or {}).keys())
     ]
 
-    getLatestResponsesByAct = lambda activityURI: list(ResponseItem().find(
-        query={
-            "baseParentType": 'user',
-            "baseParentId": informantId if isinstance(
-                informantId,
-                ObjectId
-            ) else ObjectId(informantId),
-            "updated": {
-                "$lte": referenceDate
-            },
-            "meta.applet.@id": {
-                "$in": [
-                    appletId,
-                    ObjectId(appletId)
-                ]
-            },
-            "meta.activity.url": {
-                "$in": [
-                    activityURI,
-                    reprolibPrefix(activityURI),
-                    reprolibCanonize(activityURI)
-                ]
-            }
-        },
-        force=True,
-        sort=[("updated", DESCENDING)]
-    ))
-
-    latestResponses = [getLatestResponsesByAct(act) for act in listOfActivities]
+    latestResponses = getLatestResponses(
+        informantId,
+        [appletId],
+        listOfActivities,
+        referenceDate=referenceDate,
+        fields=('updated', 'meta')
+    )
 
     # destructure the responses
     # TODO: we are assuming here that activities don't share items.
@@ -450,24 +583,21 @@ def last7Days(
 
     outputResponses = {}
 
-    for resp in latestResponses:
-        if len(resp):
-            latest = resp[0]
-
-            # the last 7 days for the most recent entry for the activity
-            l7 = latest.get('meta', {}).get('last7Days', {}).get('responses', {})
+    for latest in latestResponses.values():
+        # the last 7 days for the most recent entry for the activity
+        l7 = latest.get('meta', {}).get('last7Days', {}).get('responses', {})
 
-            # the current response for the most recent entry for the activity
-            currentResp = latest.get('meta', {}).get('responses', {})
+        # the current response for the most recent entry for the activity
+        currentResp = latest.get('meta', {}).get('responses', {})
 
-            # update the l7 with values from currentResp
-            for (key, val) in currentResp.items():
-                if key in l7.keys():
-                    l7[key].append(dict(date=latest['updated'], value=val))
-                else:
-                    l7[key] = [dict(date=latest['updated'], value=val)]
+        # update the l7 with values from currentResp
+        for (key, val) in currentResp.items():
+            if key in l7.keys():
+                l7[key].append(dict(date=latest['updated'], value=val))
+            else:
+                l7[key] = [dict(date=latest['updated'], value=val)]
 
-            outputResponses.update(l7)
+        outputResponses.update(l7)
 
     l7d = {}
     l7d["responses"] = _oneResponsePerDate(outputResponses)
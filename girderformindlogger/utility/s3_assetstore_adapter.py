@@ -274,7 +274,7 @@ class S3AssetstoreAdapter(AbstractAssetstoreAdapter):
             resp = requests.request(method='PUT', url=url, data=chunk, headers=headers)
             if resp.status_code not in (200, 201):
                 logger.error('S3 multipart upload failure %d (uploadId=%s):\n%s' % (
-                    resp.status_code, upload['_id'], resp.text))
+                    resp.status_code, upload.get('_id'), resp.text))
                 raise GirderException('Upload failed (bad gateway)')
 
             upload['received'] += size
@@ -289,7 +289,7 @@ class S3AssetstoreAdapter(AbstractAssetstoreAdapter):
                 headers=dict(reqInfo['headers'], **{'Content-Length': str(size)}))
             if resp.status_code not in (200, 201):
                 logger.error('S3 upload failure %d (uploadId=%s):\n%s' % (
-                    resp.status_code, upload['_id'], resp.text))
+                    resp.status_code, upload.get('_id'), resp.text))
                 raise GirderException('Upload failed (bad gateway)')
 
             upload['received'] = size
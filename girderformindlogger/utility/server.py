@@ -11,6 +11,8 @@ from girderformindlogger.models.setting import Setting
 from girderformindlogger import plugin
 from girderformindlogger.settings import SettingKey
 from girderformindlogger.utility import config
+from girderformindlogger.utility.aggregation_queue import stopAggregationQueue
+from girderformindlogger.utility.applet_cache_queue import stopAppletCacheQueue
 from girderformindlogger.constants import ServerMode
 from . import webroot
 
@@ -26,6 +28,15 @@ def _errorDefault(status, message, *args, **kwargs):
     return mako.template.Template(_errorTemplate).render(status=status, message=message)
 
 
+def _hashPendingFiles():
+    from girderformindlogger.utility.filesystem_assetstore_adapter import \
+        hashAllPendingFiles
+
+    # files whose "data.process" events were dropped when the server stopped
+    girderformindlogger.events.daemon.trigger(
+        info=None, callback=lambda event: hashAllPendingFiles())
+
+
 def getApiRoot():
     return config.getConfig()['server']['api_root']
 
@@ -83,6 +94,9 @@ def configureServer(mode=None, plugins=None, curConfig=None):
     girderformindlogger.events.setupDaemon()
     cherrypy.engine.subscribe('start', girderformindlogger.events.daemon.start)
     cherrypy.engine.subscribe('stop', girderformindlogger.events.daemon.stop)
+    cherrypy.engine.subscribe('stop', stopAggregationQueue)
+    cherrypy.engine.subscribe('stop', stopAppletCacheQueue)
+    cherrypy.engine.subscribe('start', _hashPendingFiles)
 
     routeTable = loadRouteTable()
     info = {
@@ -8,8 +8,12 @@ import threading
 import time
 
 import girderformindlogger
-from girderformindlogger import logger
+from girderformindlogger import events, logger
 from girderformindlogger.models import getDbConnection
+from girderformindlogger.utility.aggregation_queue import getAggregationQueue
+from girderformindlogger.utility.applet_cache_queue import getAppletCacheQueue
+from girderformindlogger.utility.auth_cache import getAuthCache
+from girderformindlogger.utility.expansion_cache import expansionCacheInfo
 
 
 def _objectToDict(obj):
@@ -131,6 +135,14 @@ def getStatus(mode='basic', user=None):
             True for threadId in cherrypy.tools.status.seenThreads
             if 'end' not in cherrypy.tools.status.seenThreads[threadId]])
         status['cherrypyThreadPoolSize'] = cherrypy.server.thread_pool
+        status['jsonldExpansionCache'] = expansionCacheInfo()
+        status['authCache'] = getAuthCache().info()
+        status['responseAggregation'] = getAggregationQueue().metrics()
+        status['userAppletCache'] = getAppletCacheQueue().metrics()
+        if callable(getattr(events.daemon, 'metrics', None)):
+            status['eventDaemon'] = events.daemon.metrics()
+        # Plugins can add their own metrics to the status
+        events.trigger('system.status', info=status)
 
     if mode == 'slow' and isAdmin:
         _computeSlowStatus(process, status, db)
@@ -1,26 +1,44 @@
 import cherrypy
 import datetime
 import logging
+import re
 import six
+import threading
+import time
 from six.moves import urllib
-from girderformindlogger import auditLogger
+from girderformindlogger import auditLogger, events, logger
 from girderformindlogger.models.model_base import Model
-from girderformindlogger.api.rest import getCurrentUser
+from girderformindlogger.api.rest import getCurrentUserCore
 from girderformindlogger.plugin import GirderPlugin
+from girderformindlogger.utility import config, toBool
+
+# Keys that urllib.parse.quote(key, safe='') leaves unchanged, and that contain no '.'
+_UNQUOTED_PARAM_KEY = re.compile(r'[A-Za-z0-9_~-]*\Z')
 
 
 class Record(Model):
     def initialize(self):
         self.name = 'audit_log_record'
-        self.ensureIndices(['type', 'when'])
+        self.ensureIndices(['type', 'when', ([
+            ('type', 1),
+            ('details.fileId', 1),
+            ('when', 1)
+        ], {})])
 
     def validate(self, doc):
         return doc
 
 
+def _encodeParamKey(paramKey):
+    if _UNQUOTED_PARAM_KEY.match(paramKey):
+        return paramKey
+    # 'urllib.parse.quote' alone doesn't replace '.'
+    return urllib.parse.quote(paramKey, safe='').replace('.', '%2E')
+
+
 class _AuditLogDatabaseHandler(logging.Handler):
     def handle(self, record):
-        user = getCurrentUser()
+        user = getCurrentUserCore()
 
         if record.msg == 'rest.request':
             # Some characters may not be stored as MongoDB Object keys
@@ -30,21 +48,162 @@ class _AuditLogDatabaseHandler(logging.Handler):
             # For MongoDB, '\x00', '.', and '$' must be encoded, and for invertibility, '%' must be
             # encoded too, but just encode everything for simplicity
             record.details['params'] = {
-                # 'urllib.parse.quote' alone doesn't replace '.'
-                urllib.parse.quote(paramKey, safe='').replace('.', '%2E'): paramValue
+                _encodeParamKey(paramKey): paramValue
                 for paramKey, paramValue in six.viewitems(record.details['params'])
             }
-        Record().save({
+        self.write({
             'type': record.msg,
             'details': record.details,
             'ip': cherrypy.request.remote.ip,
             'userId': user and user['_id'],
             'when': datetime.datetime.utcnow()
-        }, triggerEvents=False)
+        })
+
+    def write(self, doc):
+        Record().save(doc, triggerEvents=False)
+
+
+class _BufferedAuditLogDatabaseHandler(_AuditLogDatabaseHandler):
+    """
+    Audit log handler that keeps records in memory and writes them in batches
+    from a background thread, so requests don't wait for their audit record
+    to be inserted. When the buffer is full, new records are dropped and
+    counted rather than blocking requests.
+
+    :param capacity: Maximum number of records to hold.
+    :type capacity: int
+    :param flushRecords: Write a batch once this many records are waiting.
+    :type flushRecords: int
+    :param flushInterval: Write a batch after this many seconds otherwise.
+    :type flushInterval: float
+    """
+    def __init__(self, capacity=10000, flushRecords=500, flushInterval=1.0):
+        super(_BufferedAuditLogDatabaseHandler, self).__init__()
+        self.capacity = max(1, int(capacity))
+        self.flushRecords = max(1, min(int(flushRecords), self.capacity))
+        self.flushInterval = float(flushInterval)
+        self._buffer = []
+        self._condition = threading.Condition()
+        self._thread = None
+        self._stopped = False
+        self._warnedFull = False
+        self.counts = {
+            'written': 0,
+            'dropped': 0,
+            'failed': 0,
+            'batches': 0
+        }
+
+    def write(self, doc):
+        with self._condition:
+            if self._stopped:
+                # After shutdown, write directly so late records aren't lost
+                stopped = True
+            else:
+                stopped = False
+                if len(self._buffer) >= self.capacity:
+                    self.counts['dropped'] += 1
+                    warn, self._warnedFull = not self._warnedFull, True
+                else:
+                    warn = False
+                    self._buffer.append(doc)
+                    self._start()
+                    if len(self._buffer) >= self.flushRecords:
+                        self._condition.notify()
+        if stopped:
+            super(_BufferedAuditLogDatabaseHandler, self).write(doc)
+        elif warn:
+            logger.warning('Audit log buffer is full; dropping records.')
+
+    def flush(self):
+        """
+        Write every buffered record now.
+        """
+        with self._condition:
+            docs, self._buffer = self._buffer, []
+        self._insert(docs)
+
+    def start(self):
+        """
+        Buffer records again after :py:meth:`stop`, e.g. when the server is
+        restarted. The background thread starts with the next record.
+        """
+        with self._condition:
+            self._stopped = False
+
+    def stop(self):
+        """
+        Write the buffered records and stop the background thread, e.g. at
+        shutdown. Records written afterwards are inserted directly until
+        :py:meth:`start` is called.
+        """
+        with self._condition:
+            self._stopped = True
+            self._condition.notify()
+            thread, self._thread = self._thread, None
+        if thread is not None:
+            thread.join()
+        self.flush()
+
+    def metrics(self):
+        """
+        :returns: dict of the number of buffered records and counters
+        """
+        with self._condition:
+            return dict(self.counts, buffered=len(self._buffer), capacity=self.capacity)
+
+    def _start(self):
+        # Must hold the lock
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._work, name='audit-log-writer')
+            self._thread.daemon = True
+            self._thread.start()
+
+    def _work(self):
+        while True:
+            with self._condition:
+                deadline = time.time() + self.flushInterval
+                while len(self._buffer) < self.flushRecords and not self._stopped:
+                    remaining = deadline - time.time()
+                    if remaining <= 0:
+                        break
+                    self._condition.wait(remaining)
+                docs, self._buffer = self._buffer, []
+                stopped = self._stopped
+            self._insert(docs)
+            if stopped:
+                break
+
+    def _insert(self, docs):
+        if not docs:
+            return
+        try:
+            Record().collection.insert_many(docs, ordered=False)
+        except Exception:
+            logger.exception('Failed to write %d audit log records.' % len(docs))
+            with self._condition:
+                self.counts['failed'] += len(docs)
+            return
+        with self._condition:
+            self.counts['written'] += len(docs)
+            self.counts['batches'] += 1
+            self._warnedFull = False
 
 
 class AuditLogsPlugin(GirderPlugin):
     DISPLAY_NAME = 'Audit logging'
 
     def load(self, info):
-        auditLogger.addHandler(_AuditLogDatabaseHandler())
+        cfg = config.getConfig().get('audit_logs', {})
+        if toBool(cfg.get('buffered', True)):
+            handler = _BufferedAuditLogDatabaseHandler(
+                capacity=int(cfg.get('buffer_size', 10000)),
+                flushRecords=int(cfg.get('flush_records', 500)),
+                flushInterval=float(cfg.get('flush_interval', 1.0)))
+            cherrypy.engine.subscribe('start', handler.start)
+            cherrypy.engine.subscribe('stop', handler.stop)
+            events.bind('system.status', 'audit_logs', lambda event: event.info.update(
+                auditLogs=handler.metrics()))
+        else:
+            handler = _AuditLogDatabaseHandler()
+        auditLogger.addHandler(handler)
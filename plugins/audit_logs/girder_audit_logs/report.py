@@ -13,6 +13,7 @@ Examples:
 import click
 import csv
 import dateutil.parser
+import itertools
 import sys
 
 from bson.objectid import ObjectId
@@ -21,30 +22,75 @@ from girderformindlogger.models.item import Item
 from girderformindlogger.models.folder import Folder
 from girder_audit_logs import Record
 
+BATCH_SIZE = 1000
 
-def index_folder(folderId):
-    if Folder().load(folderId, force=True) is None:
+
+def _batches(iterable, size):
+    iterator = iter(iterable)
+    batch = list(itertools.islice(iterator, size))
+    while batch:
+        yield batch
+        batch = list(itertools.islice(iterator, size))
+
+
+def iter_folder_ids(folderId, batchSize=BATCH_SIZE):
+    """
+    Return an iterator of the ID of a folder and of every folder beneath it.
+    The tree is walked breadth-first with indexed parentId queries for a
+    batch of folders at a time, so only one level's IDs are held at once.
+    """
+    folderId = ObjectId(folderId)
+    if Folder().load(folderId, force=True, fields=['_id']) is None:
         raise ValueError('folderId={} was not a valid folder'.format(folderId))
-    items = Item().find({'folderId': ObjectId(folderId)})
-    subfolders = Folder().find({'parentId': ObjectId(folderId)})
 
-    files = []
-    for item in items:
-        for file in Item().childFiles(item, fields={'_id': True}):
-            fileId = file['_id']
-            files.append(fileId)
+    def walk():
+        level = [folderId]
+        while level:
+            children = []
+            for batch in _batches(level, batchSize):
+                for doc in Folder().collection.find({
+                    'parentId': {'$in': batch},
+                    'parentCollection': 'folder'
+                }, {'_id': True}):
+                    children.append(doc['_id'])
+                    yield doc['_id']
+            level = children
+
+    return itertools.chain([folderId], walk())
+
 
-    for folder in subfolders:
-        files += index_folder(folder['_id'])
+def iter_file_ids(folderIds, batchSize=BATCH_SIZE):
+    """
+    Yield the IDs of the files of the items in some folders, looking up a
+    batch of folders at a time.
+    """
+    from girderformindlogger.models.file import File
 
-    return files
+    for batch in _batches(folderIds, batchSize):
+        for doc in Item().collection.aggregate([
+            {'$match': {'folderId': {'$in': batch}}},
+            {'$project': {'_id': True}},
+            {'$lookup': {
+                'from': File().name,
+                'localField': '_id',
+                'foreignField': 'itemId',
+                'as': 'file'
+            }},
+            {'$unwind': '$file'},
+            {'$project': {'_id': '$file._id'}}
+        ], allowDiskUse=True):
+            yield doc['_id']
+
+
+def index_folder(folderId):
+    return list(iter_file_ids(iter_folder_ids(folderId)))
 
 
 def get_file_download_records(files, start=None, end=None):
     query = {
         'type': 'file.download',
         'details.fileId': {
-            '$in': files,
+            '$in': list(files),
         },
         'details.startByte': 0
     }
@@ -55,7 +101,20 @@ def get_file_download_records(files, start=None, end=None):
         if end is not None:
             whenClause['when']['$lt'] = dateutil.parser.parse(end)
         query.update(whenClause)
-    return Record().find(query)
+    return Record().find(query, fields={'details.fileId': True, 'ip': True, 'when': True})
+
+
+def iter_download_records(folderId, start=None, end=None, batchSize=BATCH_SIZE):
+    """
+    Return an iterator of the records of whole-file downloads of the files
+    beneath a folder. The (type, details.fileId, when) index is queried for
+    one batch of files at a time, so memory use doesn't grow with the size
+    of the tree.
+    """
+    fileIds = iter_file_ids(iter_folder_ids(folderId, batchSize), batchSize)
+    return itertools.chain.from_iterable(
+        get_file_download_records(batch, start=start, end=end).batch_size(batchSize)
+        for batch in _batches(fileIds, batchSize))
 
 
 @click.command(name='audit-logs-report')
@@ -64,9 +123,10 @@ def get_file_download_records(files, start=None, end=None):
 @click.option('--start-date', help='ISO 8601 format')
 @click.option('--end-date', help='ISO 8601 format')
 @click.option('-o', '--output', type=click.File('w'), default=sys.stdout, help='file to write out')
-def report(folder, start_date, end_date, output):
-    files = index_folder(folder)
-    records = get_file_download_records(files, start=start_date, end=end_date)
+@click.option('--batch-size', type=click.INT, default=BATCH_SIZE,
+              help='number of folders or files to look up per query')
+def report(folder, start_date, end_date, output, batch_size):
+    records = iter_download_records(folder, start=start_date, end=end_date, batchSize=batch_size)
     fieldnames = ['file_id', 'ip', 'timestamp']
     rows = ({
         'file_id': r['details']['fileId'],
@@ -1,33 +1,202 @@
 # -*- coding: utf-8 -*-
-from girderformindlogger import events
-from girderformindlogger.constants import AccessType
+import cherrypy
+import threading
+
+from bson.objectid import ObjectId
+from girderformindlogger import events, logger
+from girderformindlogger.constants import AccessType, ServerMode
 from girderformindlogger.models.file import File
 from girderformindlogger.plugin import GirderPlugin
+from girderformindlogger.utility import config
+from pymongo import UpdateOne
+from pymongo.errors import BulkWriteError
+
+
+class DownloadCounter(object):
+    """
+    Accumulates the ``downloadStatistics`` increments of each file in memory
+    and writes them with one ``bulk_write`` every ``interval`` seconds, so a
+    burst of range requests for a file costs one update. Counts that could
+    not be written are kept for the next write, and everything is written by
+    :py:meth:`stop`, so totals are exact after shutdown.
+
+    Each write is tagged with a batch ID that is stored on the files it
+    updates, and writes are made one at a time. If a write fails without
+    saying which updates were applied (e.g. the connection dropped), it is
+    retried with the same ID before anything else is written, and the files
+    that already carry that ID are skipped, so no count is added twice.
+
+    :param interval: Seconds between writes. If 0, every call to add is
+        written immediately.
+    :type interval: float
+    :param maxFiles: Write early once this many files have pending counts.
+    :type maxFiles: int
+    """
+    def __init__(self, interval=5.0, maxFiles=10000):
+        self.interval = float(interval)
+        self.maxFiles = max(1, int(maxFiles))
+        self._counts = {}
+        self._retry = None
+        self._condition = threading.Condition()
+        self._writeLock = threading.Lock()
+        self._thread = None
+        self._stopped = False
+        self.writes = 0
+
+    def add(self, fileId, **amounts):
+        """
+        Count downloads of a file.
+
+        :param fileId: The file's ID.
+        :param amounts: Amount to add to each ``downloadStatistics`` field,
+            e.g. ``requested=1``.
+        """
+        with self._condition:
+            self._merge({fileId: amounts})
+            immediate = self.interval <= 0 or self._stopped
+            if not immediate:
+                if self._thread is None:
+                    self._thread = threading.Thread(
+                        target=self._work, name='download-statistics')
+                    self._thread.daemon = True
+                    self._thread.start()
+                if len(self._counts) >= self.maxFiles:
+                    self._condition.notify()
+        if immediate:
+            # This also writes any counts kept from a failed write
+            self.flush()
+
+    def flush(self):
+        """
+        Write the pending counts now.
+        """
+        with self._writeLock:
+            with self._condition:
+                counts, self._counts = self._counts, {}
+            if self._retry is not None:
+                if not self._write(*self._retry):
+                    # Still unknown; the new counts wait for the retry
+                    with self._condition:
+                        self._merge(counts)
+                    return
+            if counts:
+                self._write(ObjectId(), counts)
+
+    def stop(self):
+        """
+        Write the pending counts and stop the background thread, e.g. at
+        shutdown. Counts added afterward are written immediately.
+        """
+        with self._condition:
+            self._stopped = True
+            self._condition.notify()
+            thread, self._thread = self._thread, None
+        if thread is not None:
+            thread.join()
+        self.flush()
+
+    def metrics(self):
+        """
+        :returns: dict of the number of files with pending counts, of bulk
+            writes so far and of files in a write being retried
+        """
+        with self._condition:
+            return {
+                'pendingFiles': len(self._counts),
+                'retryingFiles': len(self._retry[1]) if self._retry else 0,
+                'writes': self.writes
+            }
+
+    def _merge(self, counts):
+        # Must hold the lock
+        for fileId, amounts in counts.items():
+            pending = self._counts.setdefault(fileId, {})
+            for field, amount in amounts.items():
+                pending[field] = pending.get(field, 0) + amount
+
+    def _work(self):
+        while True:
+            with self._condition:
+                if not self._stopped:
+                    self._condition.wait(self.interval)
+                stopped = self._stopped
+            self.flush()
+            if stopped:
+                break
+
+    def _write(self, batchId, counts):
+        """
+        Write one batch of counts. Must hold the write lock.
+
+        :returns: Whether it is known which of the updates were applied.
+        """
+        counts = list(counts.items())
+        try:
+            File().collection.bulk_write([
+                UpdateOne({
+                    '_id': fileId,
+                    'downloadStatisticsBatch': {'$ne': batchId}
+                }, {
+                    '$inc': {
+                        'downloadStatistics.%s' % field: amount
+                        for field, amount in amounts.items()},
+                    '$set': {'downloadStatisticsBatch': batchId}
+                })
+                for fileId, amounts in counts
+            ], ordered=False)
+        except BulkWriteError as e:
+            if e.details.get('writeConcernErrors'):
+                return self._keepForRetry(batchId, counts)
+            # Only the updates listed as errors weren't applied
+            logger.exception('Failed to write some download statistics; will retry.')
+            with self._condition:
+                self._merge(dict(
+                    counts[error['index']] for error in e.details.get('writeErrors', [])))
+        except Exception:
+            return self._keepForRetry(batchId, counts)
+        self._retry = None
+        with self._condition:
+            self.writes += 1
+        return True
+
+    def _keepForRetry(self, batchId, counts):
+        logger.exception('Failed to write download statistics; will retry.')
+        self._retry = (batchId, dict(counts))
+        return False
+
+
+_counter = DownloadCounter(interval=0)
 
 
 def _onDownloadFileRequest(event):
+    amounts = {'requested': 1}
     if event.info['startByte'] == 0:
-        File().increment(
-            query={'_id': event.info['file']['_id']},
-            field='downloadStatistics.started',
-            amount=1)
-    File().increment(
-        query={'_id': event.info['file']['_id']},
-        field='downloadStatistics.requested',
-        amount=1)
+        amounts['started'] = 1
+    _counter.add(event.info['file']['_id'], **amounts)
 
 
 def _onDownloadFileComplete(event):
-    File().increment(
-        query={'_id': event.info['file']['_id']},
-        field='downloadStatistics.completed',
-        amount=1)
+    _counter.add(event.info['file']['_id'], completed=1)
 
 
 class DownloadStatisticsPlugin(GirderPlugin):
     DISPLAY_NAME = 'Download Statistics'
 
     def load(self, info):
+        global _counter
+
+        cfg = config.getConfig()
+        interval = float(cfg.get('download_statistics', {}).get('flush_interval', 5.0))
+        # Tests read the counts as soon as a download finishes
+        if cfg.get('server', {}).get('mode') == ServerMode.TESTING:
+            interval = 0
+        _counter = DownloadCounter(
+            interval=interval,
+            maxFiles=int(cfg.get('download_statistics', {}).get('max_pending_files', 10000)))
+        cherrypy.engine.subscribe('stop', _counter.stop)
+        events.bind('system.status', 'download_statistics', lambda event: event.info.update(
+            downloadStatistics=_counter.metrics()))
+
         # Bind REST events
         events.bind('model.file.download.request', 'download_statistics', _onDownloadFileRequest)
         events.bind('model.file.download.complete', 'download_statistics', _onDownloadFileComplete)
@@ -1,11 +1,12 @@
 # -*- coding: utf-8 -*-
-import importlib
+import cherrypy
 
 from girderformindlogger import events
 from girderformindlogger.plugin import GirderPlugin
 from girderformindlogger.utility.model_importer import ModelImporter
 
 from . import constants, job_rest
+from .local_executor import cancelProcess, runJob, scheduleProcess, stopLocalJobExecutor
 from .models.job import Job
 
 
@@ -17,16 +18,14 @@ def scheduleLocal(event):
     within that module should be executed. If no "function" field is specified,
     the function is assumed to be named "run". The function will be passed the
     args and kwargs of the job.
+
+    Jobs whose handler is "local_process" are run the same way, but on a pool
+    of worker processes; see :py:mod:`girder_jobs.local_executor`.
     """
     job = event.info
 
     if job['handler'] == constants.JOB_HANDLER_LOCAL:
-        if 'module' not in job:
-            raise Exception('Locally scheduled jobs must have a module field.')
-
-        module = importlib.import_module(job['module'])
-        fn = getattr(module, job.get('function', 'run'))
-        fn(job)
+        runJob(job)
 
 
 class JobsPlugin(GirderPlugin):
@@ -36,4 +35,7 @@ class JobsPlugin(GirderPlugin):
     def load(self, info):
         ModelImporter.registerModel('job', Job, 'jobs')
         info['apiRoot'].job = job_rest.Job()
-        events.bind('jobs.schedule', 'jobs', scheduleLocal)
+        events.bind('jobs.schedule', 'jobs', scheduleLocal, ordered=True)
+        events.bind('jobs.schedule', 'jobs.process', scheduleProcess)
+        events.bind('jobs.cancel', 'jobs.process', cancelProcess)
+        cherrypy.engine.subscribe('stop', stopLocalJobExecutor)
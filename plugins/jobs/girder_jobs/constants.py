@@ -3,6 +3,7 @@ from girderformindlogger import events
 from girderformindlogger.models.notification import ProgressState
 
 JOB_HANDLER_LOCAL = 'jobs._local'
+JOB_HANDLER_LOCAL_PROCESS = 'jobs._local_process'
 
 
 # Scope used allow RESTful creation of girderformindlogger job models
@@ -0,0 +1,343 @@
+# -*- coding: utf-8 -*-
+"""
+Process pool for CPU-bound local jobs.
+
+Local jobs normally run on the Girder server, where they share the GIL with
+request handling. Jobs created with ``Job().createLocalJob(..., process=True)``
+are instead run by a :py:class:`LocalJobExecutor`, which hands them to a
+``ProcessPoolExecutor``. Each worker process configures its own Girder
+environment (config, plugins and database connection) once when it starts,
+then runs the job's function exactly as the in-process handler would, so jobs
+report progress and status with ``Job().updateJob`` as usual.
+
+Options are read from the ``[local_jobs]`` config section:
+
+- ``processes``: number of worker processes (0 runs these jobs on the server)
+- ``type_limits``: maximum number of jobs of each type to run at once, e.g.
+  ``{"thumbnails.create": 1}``; other types share the whole pool
+
+Canceling a job that hasn't started yet drops it. A running job can't be
+interrupted safely, so long jobs should call :py:func:`checkCanceled`
+between steps.
+"""
+import importlib
+import multiprocessing
+import threading
+import traceback
+
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+from girderformindlogger import events, logger
+from girderformindlogger.constants import ServerMode
+from girderformindlogger.utility import config
+
+from .constants import JobStatus, JOB_HANDLER_LOCAL_PROCESS
+
+DEFAULT_PROCESSES = 2
+
+_executor = None
+_executorLock = threading.Lock()
+# Set in worker processes, which run their jobs inline
+_inWorker = False
+
+
+class JobCanceled(Exception):
+    """
+    Raised by :py:func:`checkCanceled` when a job has been canceled.
+    """
+
+
+def checkCanceled(job):
+    """
+    Raise JobCanceled if a job has been canceled since it started. Long
+    running job functions should call this between steps.
+
+    :param job: The job document.
+    :type job: dict
+    """
+    from .models.job import Job
+
+    current = Job().load(job['_id'], force=True, fields=['status'])
+    if current is None or current['status'] == JobStatus.CANCELED:
+        raise JobCanceled('Job %s was canceled.' % job['_id'])
+
+
+def runJob(job):
+    """
+    Import and call the function of a local job.
+
+    :param job: The job document, with "module" and optionally "function".
+    :type job: dict
+    """
+    if 'module' not in job:
+        raise Exception('Locally scheduled jobs must have a module field.')
+
+    module = importlib.import_module(job['module'])
+    fn = getattr(module, job.get('function', 'run'))
+    fn(job)
+
+
+def _initProcess(plugins):
+    """
+    Set up the Girder environment of a worker process.
+    """
+    global _inWorker
+
+    from girderformindlogger.utility.server import configureServer
+
+    _inWorker = True
+    configureServer(plugins=plugins)
+    # There is no event daemon thread in a worker; run its events inline
+    events.daemon = events.ForegroundEventsDaemon()
+
+
+def _runInProcess(jobId):
+    """
+    Entry point of a job in a worker process.
+
+    :returns: bool, whether the job ran (False if it was canceled or deleted
+        while queued)
+    """
+    from .models.job import Job
+
+    job = Job().load(jobId, force=True)
+    if job is None or job['status'] == JobStatus.CANCELED:
+        return False
+    try:
+        runJob(job)
+    except JobCanceled:
+        return False
+    return True
+
+
+class LocalJobExecutor(object):
+    """
+    Runs local jobs on a pool of worker processes, limiting how many jobs of
+    each type run at once. Instances are thread-safe; the pool is started on
+    first use.
+    """
+
+    def __init__(self, processes=DEFAULT_PROCESSES, typeLimits=None, plugins=None):
+        """
+        :param processes: number of worker processes
+        :type processes: int
+        :param typeLimits: maximum number of concurrent jobs of each type
+        :type typeLimits: dict or None
+        :param plugins: names of the plugins to load in worker processes,
+            defaulting to the plugins loaded on this server
+        :type plugins: list or None
+        """
+        self.processes = max(1, int(processes))
+        self.typeLimits = {
+            jobType: max(1, int(limit)) for jobType, limit in (typeLimits or {}).items()}
+        self.plugins = plugins
+        self._pool = None
+        self._lock = threading.RLock()
+        self._waiting = {}
+        self._running = {}
+        self._futures = {}
+        self.counts = {
+            'submitted': 0,
+            'succeeded': 0,
+            'failed': 0,
+            'canceled': 0
+        }
+
+    def schedule(self, job):
+        """
+        Queue a job to run in a worker process once its type is under its
+        concurrency limit.
+
+        :param job: The job document.
+        :type job: dict
+        """
+        jobType = job.get('type')
+        with self._lock:
+            self._waiting.setdefault(jobType, deque()).append(job['_id'])
+            self._submitReady(jobType)
+
+    def cancel(self, job):
+        """
+        Drop a job that hasn't started running yet.
+
+        :param job: The job document.
+        :type job: dict
+        :returns: bool, whether the job was dropped
+        """
+        with self._lock:
+            waiting = self._waiting.get(job.get('type'), ())
+            if job['_id'] in waiting:
+                waiting.remove(job['_id'])
+                self.counts['canceled'] += 1
+                return True
+            future = self._futures.get(job['_id'])
+        # _finished releases the job's slot when a queued future is canceled
+        return future is not None and future.cancel()
+
+    def stop(self, wait=True):
+        """
+        Stop the worker processes. Jobs that haven't started are dropped, and
+        stay QUEUED.
+
+        :param wait: wait for running jobs to finish
+        :type wait: bool
+        """
+        with self._lock:
+            pool, self._pool = self._pool, None
+            self._waiting = {}
+            futures = list(self._futures.values())
+        if pool is not None:
+            for future in futures:
+                future.cancel()
+            pool.shutdown(wait=wait)
+
+    def metrics(self):
+        """
+        :returns: dict of the pool size, counters, and the number of running
+            and waiting jobs of each type
+        """
+        with self._lock:
+            return {
+                'processes': self.processes,
+                'typeLimits': dict(self.typeLimits),
+                'running': {
+                    str(jobType): count for jobType, count in self._running.items() if count},
+                'waiting': {
+                    str(jobType): len(ids) for jobType, ids in self._waiting.items() if ids},
+                **self.counts
+            }
+
+    def _getPool(self):
+        if self._pool is None:
+            plugins = self.plugins
+            if plugins is None:
+                from girderformindlogger.plugin import loadedPlugins
+                plugins = loadedPlugins()
+            # Workers start from a fresh interpreter rather than a fork of
+            # this multithreaded server
+            self._pool = ProcessPoolExecutor(
+                max_workers=self.processes,
+                mp_context=multiprocessing.get_context('spawn'),
+                initializer=_initProcess,
+                initargs=(list(plugins),))
+        return self._pool
+
+    def _submitReady(self, jobType):
+        """
+        Submit the waiting jobs of a type that fit under its limit. Must hold
+        the lock.
+        """
+        limit = self.typeLimits.get(jobType, self.processes)
+        waiting = self._waiting.get(jobType)
+        while waiting and self._running.get(jobType, 0) < limit:
+            jobId = waiting.popleft()
+            try:
+                future = self._getPool().submit(_runInProcess, jobId)
+            except BrokenProcessPool:
+                # A worker died (e.g. killed by the OOM killer); start over
+                logger.warning('Local job process pool broke; restarting it.')
+                self._pool = None
+                future = self._getPool().submit(_runInProcess, jobId)
+            self._running[jobType] = self._running.get(jobType, 0) + 1
+            self._futures[jobId] = future
+            self.counts['submitted'] += 1
+            future.add_done_callback(
+                lambda future, jobId=jobId: self._finished(jobId, jobType, future))
+
+    def _finished(self, jobId, jobType, future):
+        with self._lock:
+            self._futures.pop(jobId, None)
+            self._running[jobType] -= 1
+            if future.cancelled():
+                self.counts['canceled'] += 1
+            elif future.exception() is not None:
+                self.counts['failed'] += 1
+            else:
+                self.counts['succeeded' if future.result() else 'canceled'] += 1
+            if self._pool is not None:
+                self._submitReady(jobType)
+        if not future.cancelled() and future.exception() is not None:
+            self._markFailed(jobId, future.exception())
+
+    def _markFailed(self, jobId, exc):
+        """
+        Record the error of a job that raised without setting its own status.
+        """
+        from .models.job import Job
+
+        logger.error('Local job %s failed: %r' % (jobId, exc))
+        job = Job().load(jobId, force=True)
+        if job is None or job['status'] not in (JobStatus.QUEUED, JobStatus.RUNNING):
+            return
+        log = ''.join(traceback.format_exception(type(exc), exc, exc.__traceback__))
+        try:
+            Job().updateJob(job, status=JobStatus.ERROR, log=log)
+        except Exception:
+            logger.exception('Could not set the status of local job %s' % jobId)
+
+
+def getLocalJobExecutor():
+    """
+    Get the process-wide LocalJobExecutor, configured from the
+    ``[local_jobs]`` config section on first use.
+
+    :returns: LocalJobExecutor, or None if jobs should run on the server
+    """
+    global _executor
+
+    if _inWorker:
+        return None
+    if _executor is None:
+        with _executorLock:
+            if _executor is None:
+                cfg = config.getConfig().get('local_jobs', {})
+                processes = int(cfg.get('processes', DEFAULT_PROCESSES))
+                # Tests expect local jobs to have finished when scheduleJob
+                # returns
+                if processes <= 0 or config.getConfig().get(
+                        'server', {}).get('mode') == ServerMode.TESTING:
+                    return None
+                _executor = LocalJobExecutor(
+                    processes=processes, typeLimits=cfg.get('type_limits') or {})
+    return _executor
+
+
+def stopLocalJobExecutor():
+    """
+    Stop the worker processes, e.g. at shutdown.
+    """
+    if _executor is not None:
+        _executor.stop()
+
+
+def scheduleProcess(event):
+    """
+    Handler of ``jobs.schedule`` for jobs whose handler is
+    JOB_HANDLER_LOCAL_PROCESS.
+    """
+    job = event.info
+
+    if job['handler'] == JOB_HANDLER_LOCAL_PROCESS:
+        executor = getLocalJobExecutor()
+        if executor is None:
+            try:
+                runJob(job)
+            except JobCanceled:
+                pass
+        else:
+            from .models.job import Job
+
+            job = Job().updateJob(job, status=JobStatus.QUEUED)
+            executor.schedule(job)
+
+
+def cancelProcess(event):
+    """
+    Handler of ``jobs.cancel`` that drops queued process jobs.
+    """
+    job = event.info
+
+    if job.get('handler') == JOB_HANDLER_LOCAL_PROCESS and _executor is not None:
+        _executor.cancel(job)
@@ -11,7 +11,7 @@ from girderformindlogger.models.notification import Notification
 from girderformindlogger.models.token import Token
 from girderformindlogger.models.user import User
 
-from ..constants import JobStatus, JOB_HANDLER_LOCAL
+from ..constants import JobStatus, JOB_HANDLER_LOCAL, JOB_HANDLER_LOCAL_PROCESS
 
 
 class Job(AccessControlledModel):
@@ -143,7 +143,7 @@ class Job(AccessControlledModel):
 
         return job
 
-    def createLocalJob(self, module, function=None, **kwargs):
+    def createLocalJob(self, module, function=None, process=False, **kwargs):
         """
         Takes the same keyword arguments as :py:func:`createJob`, except this
         sets the handler to the local handler and takes additional parameters
@@ -154,9 +154,13 @@ class Job(AccessControlledModel):
         :param function: Function name within the module to run. If not passed,
             the default name of "run" will be used.
         :type function: str or None
+        :param process: Run the job in a worker process rather than on the
+            server, for CPU-bound work. See
+            :py:mod:`girder_jobs.local_executor`.
+        :type process: bool
         :returns: The job that was created.
         """
-        kwargs['handler'] = JOB_HANDLER_LOCAL
+        kwargs['handler'] = JOB_HANDLER_LOCAL_PROCESS if process else JOB_HANDLER_LOCAL
         kwargs['save'] = False
 
         job = self.createJob(**kwargs)
@@ -583,7 +587,6 @@ class Job(AccessControlledModel):
         :type job: Job
         """
         query = {'parentId': job['_id']}
-        cursor = self.find(query)
         user = User().load(job['userId'], force=True)
-        for r in self.filterResultsByPermission(cursor=cursor, user=user, level=AccessType.READ):
+        for r in self.findWithPermissions(query, user=user, level=AccessType.READ):
             yield r
@@ -358,6 +358,19 @@ class JobsTestCase(base.TestCase):
         job = self.jobModel.load(job['_id'], force=True, includeLog=True)
         self.assertEqual(job['log'], ['job failed'])
 
+    def testLocalProcessJob(self):
+        # In testing mode, process jobs run on the server when scheduled
+        job = self.jobModel.createLocalJob(
+            title='local', type='local', user=self.users[0], kwargs={
+                'hello': 'world'
+            }, module='plugin_tests.local_job_impl', process=True)
+        self.assertEqual(job['handler'], 'jobs._local_process')
+
+        self.jobModel.scheduleJob(job)
+
+        job = self.jobModel.load(job['_id'], force=True, includeLog=True)
+        self.assertEqual(job['log'], ['job ran!'])
+
     def testValidateCustomStatus(self):
         job = self.jobModel.createJob(title='test', type='x', user=self.users[0])
 
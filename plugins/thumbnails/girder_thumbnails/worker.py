@@ -11,6 +11,7 @@ from girderformindlogger import events
 from girderformindlogger.models.file import File
 from girderformindlogger.models.upload import Upload
 from girder_jobs.constants import JobStatus
+from girder_jobs.local_executor import checkCanceled, JobCanceled
 from girder_jobs.models.job import Job
 from girderformindlogger.utility.model_importer import ModelImporter
 from PIL import Image
@@ -21,9 +22,11 @@ def run(job):
     jobModel.updateJob(job, status=JobStatus.RUNNING)
 
     try:
-        newFile = createThumbnail(**job['kwargs'])
+        newFile = createThumbnail(job=job, **job['kwargs'])
         log = 'Created thumbnail file %s.' % newFile['_id']
         jobModel.updateJob(job, status=JobStatus.SUCCESS, log=log)
+    except JobCanceled:
+        raise
     except Exception:
         t, val, tb = sys.exc_info()
         log = '%s: %s\n%s' % (t.__name__, repr(val), traceback.extract_tb(tb))
@@ -31,10 +34,11 @@ def run(job):
         raise
 
 
-def createThumbnail(width, height, crop, fileId, attachToType, attachToId):
+def createThumbnail(width, height, crop, fileId, attachToType, attachToId, job=None):
     """
     Creates the thumbnail. Validation and access control must be done prior
-    to the invocation of this method.
+    to the invocation of this method. If it is run by a job, it stops if the
+    job is canceled before the image is scaled.
     """
     fileModel = File()
     file = fileModel.load(fileId, force=True)
@@ -70,6 +74,8 @@ def createThumbnail(width, height, crop, fileId, attachToType, attachToId):
     stream = streamFn()
     data = b''.join(stream())
 
+    if job is not None:
+        checkCanceled(job)
     image = _getImage(file['mimeType'], file['exts'], data)
 
     if not width:
@@ -63,6 +63,12 @@ extrasReqs = {
     ],
     'mount': [
         'fusepy>=3.0'
+    ],
+    'parquet': [
+        'pyarrow'
+    ],
+    'orjson': [
+        'orjson'
     ]
 }
 
@@ -107,7 +113,11 @@ setup(
             'mount = girderformindlogger.cli.mount:main',
             'shell = girderformindlogger.cli.shell:main',
             'sftpd = girderformindlogger.cli.sftpd:main',
-            'build = girderformindlogger.cli.build:main'
+            'build = girderformindlogger.cli.build:main',
+            'cache = girderformindlogger.cli.cache:main',
+            'responses = girderformindlogger.cli.responses:main',
+            'benchmark = girderformindlogger.cli.benchmark:main',
+            'assetstore = girderformindlogger.cli.assetstore:main'
         ]
     }
 )
@@ -29,3 +29,742 @@ testOutput = {
 def testDereference(args):
     from girderformindlogger.utility.jsonld_expander import dereference
     assert dereference(testInput)==testOutput, 'Dereferencing failed.'
+
+
+def testOrderEntries():
+    from girderformindlogger.utility.protocol_import import orderEntries
+    activity = {"@id": "reprolib:activities/a1"}
+    protocol = {
+        "reprolib:terms/order": [
+            {"@list": [activity, {"url": "reprolib:activities/a2"}]}
+        ]
+    }
+    assert orderEntries(protocol)[0] is activity, 'Order entries were copied.'
+    assert len(orderEntries(protocol))==2, 'Order entries were dropped.'
+    assert orderEntries({})==[], 'Empty order was not empty.'
+
+
+def testImportTimer():
+    from girderformindlogger.utility.protocol_import import ImportTimer,      \
+        timedPhase
+    timer = ImportTimer()
+    with timedPhase(timer, 'fetch'):
+        pass
+    with timedPhase(None, 'fetch'):
+        pass
+    timer.count('cached')
+    report = timer.report()
+    assert set(ImportTimer.PHASES).issubset(report), 'Missing phases.'
+    assert report['cached']==1, 'Counter was not incremented.'
+
+
+def testOfflineDocumentLoader(tmpdir):
+    from girderformindlogger.utility.document_loader import CachedDocument, \
+        DocumentLoader, DocumentNotCached
+    url = "{}contexts/generic".format(REPROLIB_CANONICAL)
+    DocumentLoader(cacheDir=str(tmpdir))._store(
+        CachedDocument(url, 200, '{"@context": {}}', etag='"1"', fetched=0)
+    )
+    loader = DocumentLoader(cacheDir=str(tmpdir), offline=True)
+    assert loader(url)['document']=={"@context": {}}, 'Cache was not used.'
+    with pytest.raises(DocumentNotCached):
+        loader.get("{}contexts/missing".format(REPROLIB_CANONICAL))
+
+
+def testDocumentLoaderDoesNotCacheErrors():
+    from types import SimpleNamespace
+    from girderformindlogger.utility.document_loader import CachedDocument, \
+        DocumentLoader
+    url = "{}contexts/generic".format(REPROLIB_CANONICAL)
+    requested = []
+
+    def get(url, headers, timeout):
+        requested.append(url)
+        return(SimpleNamespace(status_code=503, text='', headers={}))
+
+    loader = DocumentLoader(maxAge=0)
+    loader.session = SimpleNamespace(get=get)
+    loader._store(CachedDocument(url, 200, '{"@context": {}}', fetched=0))
+    assert loader.get(url).json()=={"@context": {}}, 'Stale copy was lost.'
+    missing = "{}contexts/missing".format(REPROLIB_CANONICAL)
+    assert loader.get(missing).status==503
+    assert loader.get(missing).status==503
+    assert requested==[url, missing, missing], 'An error was cached.'
+
+
+def testExpansionCache():
+    from girderformindlogger.utility.expansion_cache import canonicalHash,  \
+        ExpansionCache
+    assert canonicalHash({"a": 1, "b": [2]})==canonicalHash(
+        {"b": [2], "a": 1}
+    ), 'Hash depends on key order.'
+    cache = ExpansionCache('test', maxSize=1)
+    cache.set('a', {"x": []})
+    hit = cache.get('a')
+    hit["x"].append(1)
+    assert cache.get('a')=={"x": []}, 'Cached value was mutated.'
+    cache.set('b', {})
+    cache.get('a')
+    assert cache.info()=={
+        'hits': 2, 'misses': 1, 'size': 1, 'maxSize': 1
+    }, 'LRU did not evict.'
+
+
+def testExpansionMemoizesOutermostCall():
+    from girderformindlogger.utility.expansion_cache import memoizeExpansion
+
+    @memoizeExpansion
+    def nest(obj):
+        return({"n": [nest(o) for o in obj.get("children", [])]})
+
+    nest.cache._maxSize = 8
+    doc = {"children": [{"children": [{}]}, {}]}
+    assert nest(doc)==nest(doc)=={"n": [{"n": [{"n": []}]}, {"n": []}]}
+    assert nest.cache.info()=={
+        'hits': 1, 'misses': 1, 'size': 1, 'maxSize': 8
+    }, 'Recursive calls were memoized.'
+
+
+def testSourceHashFollowsContexts(monkeypatch):
+    from types import SimpleNamespace
+    from girderformindlogger.utility import document_loader
+    from girderformindlogger.utility.expansion_cache import sourceHash
+    base = "https://example.org/contexts/"
+    contexts = {
+        base + "a": '{"@context": ["b", {"x": "http://schema.org/x"}]}',
+        base + "b": '{"@context": {"y": "http://schema.org/y"}}'
+    }
+
+    def get(url, headers, timeout):
+        return(SimpleNamespace(status_code=200, text=contexts[url], headers={}))
+
+    loader = document_loader.DocumentLoader(maxAge=0)
+    loader.session = SimpleNamespace(get=get)
+    monkeypatch.setattr(document_loader, 'getDocumentLoader', lambda: loader)
+    compact = {"@context": ["a"], "@id": "screen"}
+    before = sourceHash(compact, base + "screen")
+    assert sourceHash(compact, base + "screen")==before
+    contexts[base + "b"] = '{"@context": {"y": "http://schema.org/z"}}'
+    assert sourceHash(compact, base + "screen")!=before, \
+        'A change to an imported context was not detected.'
+
+
+def testCreateCacheKeepsUnchangedSource(db, monkeypatch):
+    from bson.objectid import ObjectId
+    from girderformindlogger.models.screen import Screen
+    from girderformindlogger.utility import jsonld_expander
+    from girderformindlogger.utility.cache_storage import parseCache
+    monkeypatch.setattr(jsonld_expander, 'getCacheHistory', lambda: 2)
+    screen = Screen().save({
+        'name': 'screen',
+        'lowerName': 'screen',
+        'folderId': ObjectId(),
+        'baseParentType': 'collection',
+        'baseParentId': ObjectId()
+    }, validate=False)
+    cached = jsonld_expander.createCache(
+        screen, {'n': 0}, 'screen', None, sourceHash='h0')
+    stamp = parseCache(cached['cached'])['prov:generatedAtTime']
+    again = jsonld_expander.createCache(
+        screen, {'n': 0}, 'screen', None, sourceHash='h0')
+    assert parseCache(again['cached'])['prov:generatedAtTime']==stamp, \
+        'An unchanged cache was rewritten.'
+    assert 'oldCache' not in again
+    for n in range(1, 5):
+        cached = jsonld_expander.createCache(
+            screen, {'n': n}, 'screen', None, sourceHash='h{}'.format(n))
+    assert [parseCache(old)['n'] for old in cached['oldCache']]==[2, 3], \
+        'oldCache was not bounded by cache_history.'
+    assert cached['cachedSourceHash']=='h4'
+
+
+def testImporterReusesUnchangedDocument(monkeypatch):
+    from girderformindlogger import models
+    from girderformindlogger import utility
+    from girderformindlogger.utility import expansion_cache, jsonld_expander
+    from girderformindlogger.utility.cache_storage import dumpCache
+    from girderformindlogger.utility.protocol_import import ProtocolImporter
+    url = "https://example.org/activities/a"
+    compact = {"@id": "a", "schema:name": "A"}
+    monkeypatch.setattr(
+        expansion_cache, 'sourceHash', lambda c, u=None: c['schema:name'])
+    cachedDoc = {
+        'cached': dumpCache({'@id': 'a', 'cached': True}),
+        'cachedSourceHash': 'A'
+    }
+    monkeypatch.setattr(
+        models, 'cycleModels', lambda IRIs: ('activity', cachedDoc))
+    monkeypatch.setattr(utility, 'loadJSON', lambda u, t: compact)
+
+    expanded = []
+    monkeypatch.setattr(
+        jsonld_expander, 'expand', lambda u: expanded.append(u) or {})
+    importer = ProtocolImporter(refreshCache=True, workers=1)
+    record = importer._fetch(url)
+    assert record['content']=={'@id': 'a', 'cached': True}
+    assert (importer.timer.report()['unchanged'], expanded)==(1, []), \
+        'An unchanged document was expanded again.'
+    compact['schema:name'] = 'B'
+    assert importer._fetch(url)['compact']==compact
+    assert expanded==[url], 'A changed document was not expanded.'
+
+
+def testCacheStorage():
+    from girderformindlogger.utility.cache_storage import cachedField, \
+        decodeKey, dumpCache, encodeKey, parseCache
+    url = "https://example.org/a.jsonld"
+    cache = {"activities": {url: {"$ref": "x"}}, "applet": {"@id": "y"}}
+    native = dumpCache(cache, mode='native')
+    keys = [*native['activities'], *list(native['activities'].values())[0]]
+    assert not any(
+        '.' in k or k.startswith('$') for k in keys
+    ), 'Keys were not escaped.'
+    assert [decodeKey(k) for k in keys]==[url, "$ref"]
+    assert decodeKey(encodeKey(''))=='', 'Empty key was not escaped.'
+    assert parseCache(native)==parseCache(
+        dumpCache(cache, mode='string')
+    )==cache, 'Storage formats differ.'
+    assert cachedField(native, 'activities', url)=={"$ref": "x"}
+
+
+def testActivityURLSpellings():
+    from girderformindlogger.utility.response import activityURLSpellings, \
+        canonicalActivityURL
+    url = "reprolib:activities/ema-morning/ema_morning_schema"
+    canonical = canonicalActivityURL(url)
+    assert canonical=="{}activities/ema-morning/ema_morning_schema".format(
+        REPROLIB_CANONICAL
+    )
+    assert url in activityURLSpellings(canonical)
+    assert canonical in activityURLSpellings(url)
+    assert activityURLSpellings("https://example.org/a")==[
+        "https://example.org/a"
+    ]
+
+
+def testCoalescingQueue():
+    from girderformindlogger.utility.coalescing_queue import CoalescingQueue
+    ran = []
+    queue = CoalescingQueue(
+        lambda task: ran.append(task['n']) or {'runs': 1},
+        'test',
+        counters=('runs',)
+    )
+    with queue._condition:
+        # hold the lock so the worker can't start before all are queued
+        queue.put('a', {'n': 1})
+        queue.put('b', {'n': 2})
+        queue.put('a', {'n': 3})
+    assert queue.flush(timeout=10), 'Queue did not drain.'
+    assert ran==[3, 2], 'Tasks were not coalesced.'
+    metrics = queue.metrics()
+    assert (metrics['coalesced'], metrics['runs'])==(1, 2)
+    queue.stop()
+
+
+def testCoalescingQueueFlushesWithoutLock():
+    import threading
+    from girderformindlogger.utility.coalescing_queue import CoalescingQueue
+    running, release = threading.Event(), threading.Event()
+
+    def process(task):
+        running.set()
+        release.wait(10)
+
+    queue = CoalescingQueue(process, 'test')
+    queue._pending['a'] = {'enqueued': 0}
+    flusher = threading.Thread(target=queue.flush)
+    flusher.start()
+    assert running.wait(10), 'Flush did not run the task.'
+    locked = queue._condition.acquire(timeout=1)
+    if locked:
+        queue._condition.release()
+    release.set()
+    flusher.join(10)
+    assert locked, 'Flush held the lock while running a task.'
+    assert queue.metrics()['processed']==1
+
+
+def testAggregationQueueKeys():
+    from girderformindlogger.utility.aggregation_queue import AggregationQueue
+    queue = AggregationQueue(background=False)
+    ran = []
+    queue.process = lambda task: ran.append(task)
+    queue.enqueue({'_id': 1, 'baseParentId': 'u'}, {'_id': 'v'})
+    assert [(t['itemIds'], t['informantId']) for t in ran]==[([1], 'v')]
+
+
+def _rollupResponse(responses, updated):
+    from bson.objectid import ObjectId
+    from girderformindlogger.models.response_folder import ResponseItem
+    response = {
+        'name': 'response',
+        'folderId': ObjectId(),
+        'baseParentId': 'u',
+        'baseParentType': 'user',
+        'updated': updated,
+        'meta': {
+            'applet': {'@id': 'applet'},
+            'activity': {'url': 'https://example.org/activity'},
+            'subject': {'@id': 's'},
+            'responses': responses
+        }
+    }
+    response['_id'] = ResponseItem().collection.insert_one(
+        response
+    ).inserted_id
+    return(response)
+
+
+def testResponseRollup(db):
+    from datetime import datetime, timedelta
+    from girderformindlogger.models.response_rollup import ResponseRollup
+    # recent enough that the day rollups haven't expired
+    now = datetime.utcnow().replace(microsecond=0)
+    first = _rollupResponse({'q1': 1, 'q2': ''}, now - timedelta(days=30))
+    second = _rollupResponse({'q1': 1, 'q2': 'x'}, now - timedelta(days=1))
+    assert ResponseRollup().addResponse(first)
+    assert ResponseRollup().addResponse(second)
+    assert not ResponseRollup().addResponse(second), 'Counted twice.'
+    last7Days, allTime = ResponseRollup().aggregates(
+        second,
+        now,
+        now - timedelta(days=7)
+    )
+    assert allTime['schema:startDate']==first['updated']
+    assert allTime['responses']['q1']==[{'value': 1, 'count': 2}]
+    assert sorted(
+        allTime['responses']['q2'],
+        key=lambda entry: entry['value']
+    )==[{'value': '', 'count': 1}, {'value': 'x', 'count': 1}]
+    assert last7Days['responses']=={
+        'q1': [{'value': 1, 'date': second['updated']}],
+        'q2': [{'value': 'x', 'date': second['updated']}]
+    }
+
+
+def testAggregationQueueSavesEveryResponse(db):
+    from datetime import datetime, timedelta
+    from girderformindlogger.models.response_folder import ResponseItem
+    from girderformindlogger.models.response_rollup import ResponseRollup
+    from girderformindlogger.utility.aggregation_queue import AggregationQueue
+    now = datetime.utcnow().replace(microsecond=0)
+    burst = [
+        _rollupResponse({'q1': n}, now - timedelta(minutes=n))
+        for n in (2, 1)
+    ]
+    for response in burst:
+        ResponseRollup().addResponse(response)
+    queue = AggregationQueue(workers=1)
+    with queue._condition:
+        # hold the lock so the worker can't start before both are queued
+        for response in burst:
+            queue.enqueue(response, 'u')
+    assert queue.flush(timeout=10), 'Queue did not drain.'
+    queue.stop()
+    assert queue.metrics()['coalesced']==1
+    saved = [
+        ResponseItem().collection.find_one({'_id': response['_id']})['meta']
+        for response in burst
+    ]
+    assert saved[0]['allTime']==saved[1]['allTime'], \
+        'The older response of the burst was not aggregated.'
+    assert sorted(
+        saved[0]['allTime']['responses']['q1'],
+        key=lambda entry: entry['value']
+    )==[{'value': 1, 'count': 1}, {'value': 2, 'count': 1}]
+
+
+def testResponseRollupReleasesFailedResponse(db, monkeypatch):
+    from datetime import datetime
+    from girderformindlogger.models.response_folder import ResponseItem
+    from girderformindlogger.models.response_rollup import ResponseRollup
+    response = _rollupResponse({'q1': 1}, datetime(2020, 1, 1))
+
+    def fail(ops):
+        raise RuntimeError('write failed')
+
+    monkeypatch.setattr(ResponseRollup(), '_bulkUpsert', fail)
+    with pytest.raises(RuntimeError):
+        ResponseRollup().addResponse(response)
+    assert 'rolledUp' not in ResponseItem().collection.find_one(
+        {'_id': response['_id']}
+    ), 'A failed response stayed claimed.'
+    monkeypatch.undo()
+    assert ResponseRollup().addResponse(response), 'Response was not retried.'
+
+
+def testTidyExport():
+    from datetime import datetime
+    from girderformindlogger.utility.export import streamCSV
+    from girderformindlogger.utility.response import TIDY_COLUMNS, \
+        tidyResponses
+    rows = list(tidyResponses([{
+        'baseParentId': 'u',
+        'updated': datetime(2020, 1, 1),
+        'meta': {'responses': {'a': 1, 'b': {'x': 2}}}
+    }], 'applet'))
+    assert [row['itemURI'] for row in rows]==['a', 'b'], 'Rows share a dict.'
+    csv = ''.join(streamCSV(rows, TIDY_COLUMNS)).splitlines()
+    assert csv[0]==','.join(TIDY_COLUMNS)
+    assert csv[2].endswith(',b,"{""x"": 2}"')
+
+
+def testResponseDataColumns(db):
+    from bson.objectid import ObjectId
+    from datetime import datetime
+    from girderformindlogger.models.applet import Applet
+    from girderformindlogger.models.response_folder import ResponseItem
+    applet = ObjectId()
+    ResponseItem().collection.insert_many([{
+        'baseParentType': 'user',
+        'created': datetime(2020, 1, day),
+        'meta': {'applet': {'@id': applet}, **meta}
+    } for day, meta in [
+        (3, {'responses': {}, 'allTime': {}}),
+        (2, {'subject': {}, 'responses': {}}),
+        (1, {'late': True})
+    ]])
+    assert Applet().responseDataColumns(applet)==[
+        'respondent', 'applet', 'responses', 'subject', 'late'
+    ], 'Columns were dropped or out of order.'
+
+
+def testArrowKeepsEmptyStrings():
+    from girderformindlogger.utility.export import _text
+    assert _text('')=='' and _text(None) is None
+    assert _text({'x': 1})=='{"x": 1}'
+
+
+def testCopyFileRange(tmp_path):
+    import os
+    from girderformindlogger.utility.filesystem_assetstore_adapter import \
+        _copyFileRange
+    source = tmp_path / 'source'
+    source.write_bytes(b'0123456789')
+    target = tmp_path / 'target'
+    target.write_bytes(b'ab')
+    with open(str(source), 'rb') as f:
+        fd = os.open(str(target), os.O_WRONLY)
+        try:
+            copied = _copyFileRange(f.fileno(), fd, 20, 3, 2)
+        finally:
+            os.close(fd)
+    assert copied in (7, None)
+    if copied:
+        assert target.read_bytes()==b'ab3456789'
+
+
+def testCopyPendingFile(db, tmp_path):
+    import os
+    from bson.objectid import ObjectId
+    from girderformindlogger.models.assetstore import Assetstore
+    from girderformindlogger.models.file import File
+    from girderformindlogger.utility.filesystem_assetstore_adapter import \
+        PENDING_DIR, hashAllPendingFiles
+    assetstore = Assetstore().createFilesystemAssetstore(
+        'zero-copy', str(tmp_path))
+    os.makedirs(str(tmp_path / PENDING_DIR))
+    (tmp_path / PENDING_DIR / 'upload').write_bytes(b'data')
+    source = File().save({
+        'name': 'a.txt',
+        'size': 4,
+        'assetstoreId': assetstore['_id'],
+        'path': os.path.join(PENDING_DIR, 'upload'),
+        'hashPending': True
+    })
+    copy = File().copyFile(source, {'_id': ObjectId()})
+    assert 'hashPending' not in copy, 'The copy shares the pending file.'
+    assert os.path.isfile(str(tmp_path / copy['path']))
+    assert File().load(source['_id'], force=True)['path']==copy['path']
+    assert hashAllPendingFiles()==0
+
+
+def testUploadFromFiles(db, tmp_path, monkeypatch):
+    import io
+    import os
+    from bson.objectid import ObjectId
+    from girderformindlogger.exceptions import ValidationException
+    from girderformindlogger.models.assetstore import Assetstore
+    from girderformindlogger.models.file import File
+    from girderformindlogger.models.item import Item
+    from girderformindlogger.models.upload import Upload
+    from girderformindlogger.utility.filesystem_assetstore_adapter import \
+        FilesystemAssetstoreAdapter
+    assetstore = Assetstore().createFilesystemAssetstore(
+        'batch', str(tmp_path))
+    item = Item().save({
+        'name': 'item',
+        'lowerName': 'item',
+        'folderId': ObjectId(),
+        'baseParentType': 'collection',
+        'baseParentId': ObjectId(),
+        'size': 0
+    }, validate=False)
+    user = {'_id': ObjectId()}
+    blobs = [(str(n), b'x' * n) for n in (5, 0, 3, 1)]
+    files = Upload().uploadFromFiles([
+        {'obj': io.BytesIO(data), 'size': len(data), 'name': name}
+        for name, data in blobs
+    ], 'item', item, user, assetstore=assetstore, workers=3)
+    assert [f['name'] for f in files]==[name for name, _ in blobs], \
+        'Files were not returned in order.'
+    for f, (_, data) in zip(files, blobs):
+        stored = File().load(f['_id'], force=True)
+        with File().open(stored) as fh:
+            assert fh.read()==data
+    assert Item().load(item['_id'], force=True)['size']==9
+
+    cancelled = []
+    cancelUpload = FilesystemAssetstoreAdapter.cancelUpload
+
+    def recordCancel(self, upload):
+        cancelled.append(upload['name'])
+        return cancelUpload(self, upload)
+
+    monkeypatch.setattr(
+        FilesystemAssetstoreAdapter, 'cancelUpload', recordCancel)
+    with pytest.raises(ValidationException):
+        Upload().uploadFromFiles([
+            {'obj': io.BytesIO(b'abc'), 'size': 3, 'name': 'whole'},
+            {'obj': io.BytesIO(b'ab'), 'size': 4, 'name': 'short'}
+        ], 'item', item, user, assetstore=assetstore)
+    assert sorted(cancelled)==['short', 'whole'], 'Uploads were not cancelled.'
+    assert File().find({'name': {'$in': ['whole', 'short']}}).count()==0
+    assert not os.listdir(str(tmp_path / 'temp'))
+
+
+def testJsonEncoders():
+    import datetime
+    import json
+    from bson.objectid import ObjectId
+    from girderformindlogger.utility import json_encoding
+    value = {
+        'b': ObjectId('5e1f5b2b8f6e2a0001a1b2c3'),
+        'a': [datetime.datetime(2020, 1, 2, 3, 4, 5), {'z': 1, 'y': None}]
+    }
+    expected = json.loads(json_encoding.dumps(value, encoder='stdlib'))
+    assert expected['a'][0]=='2020-01-02T03:04:05+00:00'
+    if json_encoding.orjson is not None:
+        encoded = json_encoding.dumps(value, encoder='orjson', sortKeys=True)
+        assert json.loads(encoded)==expected
+        assert encoded==json_encoding.dumps(value, encoder='stdlib').replace(
+            b', ', b',').replace(b': ', b':')
+
+
+def testJsonArrayStream():
+    import json
+    from girderformindlogger.api.rest import JsonArrayStream
+    stream = JsonArrayStream(iter([{'a': 1}, [2], 'x' * 70000, None]))
+    chunks = list(stream.encode())
+    assert len(chunks) > 1, 'The array was not streamed in chunks.'
+    assert json.loads(b''.join(chunks))==[{'a': 1}, [2], 'x' * 70000, None]
+    assert b''.join(JsonArrayStream([]).encode())==b'[]'
+
+    def failing():
+        yield 1
+        raise ValueError('lost the cursor')
+    streamed = json.loads(b''.join(JsonArrayStream(failing()).encode()))
+    assert streamed[0]==1 and streamed[1]['type']=='internal', \
+        'A failed stream should end with an error element.'
+
+
+def testPermissionClausesWithFlags():
+    from girderformindlogger.constants import AccessType
+    from girderformindlogger.models.model_base import _permissionClauses
+    user = {'_id': 'u', 'admin': False, 'groups': ['g']}
+    assert _permissionClauses({'admin': True}, AccessType.READ, flags='f')=={}
+    clauses = _permissionClauses(user, AccessType.WRITE, flags=['f'])
+    assert clauses['$and'][0]==_permissionClauses(user, AccessType.WRITE)
+    assert clauses['$and'][1]=={'$or': [
+        {'publicFlags': 'f'},
+        {'access.users': {'$elemMatch': {'id': 'u', 'flags': 'f'}}},
+        {'access.groups': {'$elemMatch': {'id': {'$in': ['g']}, 'flags': 'f'}}}
+    ]}
+
+
+def testGroupListingsQueryPermissions(db):
+    from bson.objectid import ObjectId
+    from girderformindlogger.constants import AccessType
+    from girderformindlogger.models.group import Group
+    member = {'_id': ObjectId(), 'admin': False, 'groups': []}
+    Group().collection.insert_many([{
+        'name': name, 'public': False, 'access': {'users': users, 'groups': []}
+    } for name, users in (
+        ('members', [{'id': member['_id'], 'level': AccessType.READ}]),
+        ('others', [])
+    )])
+    listed = Group().findWithPermissions({}, user=member)
+    assert listed.count()==1 and [doc['name'] for doc in listed]==['members'], \
+        'A READ member should list only their group.'
+
+
+def testAsyncEventsPoolOrdering():
+    import time
+    from girderformindlogger import events
+    handled = []
+
+    def handler(event):
+        time.sleep(0.01)
+        handled.append(event.info)
+
+    pool = events.AsyncEventsPool(workers=3, capacity=10)
+    with events.bound('test.ordered', 'test', handler, ordered=True):
+        pool.start()
+        for i in range(5):
+            pool.trigger('test.ordered', i)
+        deadline = time.time() + 5
+        while len(handled) < 5 and time.time() < deadline:
+            time.sleep(0.01)
+        pool.stop()
+    assert handled==list(range(5)), 'Ordered events ran out of order.'
+    assert pool.metrics()['events']['test.ordered']['processed']==5
+
+
+def testBufferedAuditLogHandler(db):
+    from girder_audit_logs import Record, _BufferedAuditLogDatabaseHandler
+    handler = _BufferedAuditLogDatabaseHandler(
+        capacity=2, flushRecords=2, flushInterval=60)
+    handler.write({'type': 'a'})
+    assert handler.metrics()['buffered']==1, 'Record was not buffered.'
+    assert Record().find().count()==0
+    handler.write({'type': 'b'})
+    handler.stop()
+    handler.write({'type': 'c'})
+    assert Record().find().count()==3, \
+        'Records were not written at or after stop.'
+    handler.start()
+    with handler._condition:
+        # hold the (reentrant) lock so the writer can't drain the buffer yet
+        for type in 'def':
+            handler.write({'type': type})
+        metrics = handler.metrics()
+    assert (metrics['dropped'], metrics['buffered'])==(1, 2), \
+        'A full buffer did not drop records.'
+    handler.stop()
+    assert handler.metrics()['written']==4
+    assert Record().find().count()==5
+
+
+class _FakeStatisticsCollection(object):
+    """
+    Applies download-statistics bulk writes to in-memory files, failing each
+    call as scripted: ``(error, appliedIds)`` applies the updates of the files
+    in ``appliedIds`` and raises ``error``.
+    """
+    def __init__(self):
+        self.files = {}
+        self.calls = []
+        self.script = []
+
+    def bulk_write(self, requests, ordered=True):
+        from pymongo.errors import BulkWriteError
+        error, applied = self.script.pop(0) if self.script else (None, None)
+        batchId = requests[0]._doc['$set']['downloadStatisticsBatch']
+        self.calls.append((batchId, [request._filter['_id'] for request in requests]))
+        writeErrors = []
+        for index, request in enumerate(requests):
+            fileId = request._filter['_id']
+            if applied is not None and fileId not in applied:
+                writeErrors.append({'index': index, 'code': 11000})
+                continue
+            file = self.files.setdefault(fileId, {'counts': {}, 'batch': None})
+            if file['batch'] == batchId:
+                continue
+            for field, amount in request._doc['$inc'].items():
+                field = field.split('.', 1)[1]
+                file['counts'][field] = file['counts'].get(field, 0) + amount
+            file['batch'] = batchId
+        if error is BulkWriteError:
+            raise BulkWriteError({'writeErrors': writeErrors, 'writeConcernErrors': []})
+        if error is not None:
+            raise error
+
+    def totals(self):
+        return {fileId: file['counts'] for fileId, file in self.files.items()}
+
+
+def _downloadCounter(monkeypatch):
+    import types
+    import girder_download_statistics
+    collection = _FakeStatisticsCollection()
+    monkeypatch.setattr(
+        girder_download_statistics, 'File',
+        lambda: types.SimpleNamespace(collection=collection))
+    return girder_download_statistics.DownloadCounter(interval=60), collection
+
+
+def testDownloadCounterPartialWriteError(monkeypatch):
+    from pymongo.errors import BulkWriteError
+    counter, collection = _downloadCounter(monkeypatch)
+    for fileId in 'abc':
+        counter.add(fileId, requested=1, started=1)
+    counter.add('b', requested=1)
+    collection.script.append((BulkWriteError, {'a', 'c'}))
+    counter.flush()
+    assert collection.totals()=={
+        'a': {'requested': 1, 'started': 1}, 'c': {'requested': 1, 'started': 1}}
+    assert counter._counts=={'b': {'requested': 2, 'started': 1}}, \
+        'Only the failed update should be merged back.'
+    assert counter.metrics()['retryingFiles']==0
+    counter.add('a', completed=1)
+    counter.stop()
+    assert collection.totals()=={
+        'a': {'requested': 1, 'started': 1, 'completed': 1},
+        'b': {'requested': 2, 'started': 1},
+        'c': {'requested': 1, 'started': 1}
+    }, 'Totals are not exact after stop.'
+    assert counter.metrics()['pendingFiles']==0
+
+
+def testDownloadCounterRetriesUnknownWrite(monkeypatch):
+    from pymongo.errors import AutoReconnect
+    counter, collection = _downloadCounter(monkeypatch)
+    counter.add('a', requested=1)
+    counter.add('b', requested=1)
+    # the connection drops after the update of a was applied
+    collection.script.append((AutoReconnect('lost'), {'a'}))
+    counter.flush()
+    assert counter.metrics()['retryingFiles']==2
+    counter.add('a', requested=5)
+    collection.script.append((AutoReconnect('lost'), set()))
+    counter.flush()
+    assert len(collection.calls)==2 and \
+        collection.calls[1][0]==collection.calls[0][0], \
+        'An unknown write was not retried with its batch ID.'
+    assert counter._counts=={'a': {'requested': 5}}, \
+        'New counts were written before the retry succeeded.'
+    counter.add('c', requested=1)
+    counter.stop()
+    batchIds = [batchId for batchId, fileIds in collection.calls]
+    assert batchIds[2]==batchIds[0] and batchIds[3]!=batchIds[0], \
+        'The retry did not come before the new counts.'
+    assert collection.totals()=={
+        'a': {'requested': 6}, 'b': {'requested': 1}, 'c': {'requested': 1}
+    }, 'A count was lost or added twice.'
+    assert counter.metrics()=={'pendingFiles': 0, 'retryingFiles': 0, 'writes': 2}
+
+
+def testAuthUserCoreKeepsGroupInvites():
+    from girderformindlogger.utility.auth_cache import userCore
+    invites = [{'groupId': 'g', 'level': 0}]
+    assert userCore({'_id': 'u', 'groupInvites': invites})=={
+        '_id': 'u', 'groupInvites': invites
+    }, 'Group access checks need groupInvites.'
+
+
+def testAuthCache():
+    import time
+    from girderformindlogger.utility.auth_cache import AuthCache, userCore
+    cache = AuthCache(ttl=0.05, maxSize=2)
+    cache.setToken({'_id': 't1', 'userId': 'u1'})
+    cache.setUser('t1', userCore({'_id': 'u1', 'admin': False, 'cached': {}}))
+    entry = cache.get('t1')
+    assert entry['user']=={'_id': 'u1', 'admin': False}
+    entry['user']['admin'] = True
+    assert cache.get('t1')['user']['admin'] is False, 'Cached entry was mutated.'
+    cache.setToken({'_id': 't2', 'userId': 'u2'})
+    cache.invalidateUser('u1')
+    assert cache.get('t1') is None and cache.get('t2') is not None
+    time.sleep(0.06)
+    assert cache.get('t2') is None, 'Entry outlived its TTL.'